@@ -1,20 +1,219 @@
-from sqlalchemy import create_engine
+from fastapi import HTTPException
+from sqlalchemy import (
+    DateTime, Float, Numeric, String, TypeDecorator, cast, create_engine, event, func, inspect, literal, text,
+    type_coerce
+)
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
+import time
 
-# Configuração do banco de dados
-DATABASE_URL = "sqlite:///./projeto_pdv.db"
+# Configuração do banco de dados (SQLite local por padrão; lojas maiores
+# apontam DATABASE_URL para um PostgreSQL)
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./projeto_pdv.db")
+if DATABASE_URL.startswith("postgres://"):
+    DATABASE_URL = "postgresql://" + DATABASE_URL[len("postgres://"):]
 
-engine = create_engine(
-    DATABASE_URL, 
-    connect_args={"check_same_thread": False}
-)
+# Perfis de PRAGMA aplicados a cada conexão SQLite. "performance" usa WAL
+# (leituras não bloqueiam a escrita), synchronous=NORMAL (seguro com WAL),
+# cache de 64 MB, mmap de 256 MB e espera de 5 s em vez de "database is
+# locked". "legacy" mantém os padrões do SQLite. Cada valor pode ser
+# sobrescrito por variável de ambiente PDV_SQLITE_<PRAGMA>.
+SQLITE_PROFILES = {
+    "performance": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": "-65536",
+        "mmap_size": "268435456",
+        "temp_store": "MEMORY",
+        "busy_timeout": "5000",
+        "foreign_keys": "ON",
+    },
+    "legacy": {},
+    # Conexões somente leitura: sem PRAGMAs que gravam no arquivo
+    "read_only": {
+        "cache_size": "-65536",
+        "mmap_size": "268435456",
+        "temp_store": "MEMORY",
+        "busy_timeout": "5000",
+        "query_only": "ON",
+    },
+}
+
+def sqlite_pragmas(profile=None):
+    """PRAGMAs do perfil escolhido, com as sobrescritas do ambiente"""
+    profile = profile or os.getenv("PDV_SQLITE_PROFILE", "performance")
+    if profile not in SQLITE_PROFILES:
+        raise ValueError(f"Perfil SQLite desconhecido: {profile}")
+    
+    pragmas = dict(SQLITE_PROFILES[profile])
+    # O perfil somente leitura só aceita sobrescrever os próprios PRAGMAs
+    overridable = pragmas if profile == "read_only" else SQLITE_PROFILES["performance"]
+    for name in list(overridable):
+        value = os.getenv(f"PDV_SQLITE_{name.upper()}")
+        if value:
+            pragmas[name] = value
+    return pragmas
+
+def create_db_engine(
+    url=DATABASE_URL,
+    profile=None,
+    statement_timeout=None,
+    env_prefix="PDV_DB",
+    **engine_options
+):
+    """Criar engine com pool configurável e, no SQLite, o perfil de PRAGMAs.
+
+    `statement_timeout` (segundos) interrompe consultas longas: no SQLite
+    por um progress handler, nos demais bancos pela opção do servidor.
+    O pool é dimensionado pelas variáveis <env_prefix>_POOL_SIZE,
+    _MAX_OVERFLOW e _POOL_TIMEOUT.
+    """
+    options = {
+        "pool_size": int(os.getenv(f"{env_prefix}_POOL_SIZE", "10")),
+        "max_overflow": int(os.getenv(f"{env_prefix}_MAX_OVERFLOW", "20")),
+        "pool_timeout": float(os.getenv(f"{env_prefix}_POOL_TIMEOUT", "30")),
+        # Cache de SQL compilado do SQLAlchemy (por engine)
+        "query_cache_size": int(os.getenv("PDV_DB_QUERY_CACHE_SIZE", "1000")),
+    }
+    
+    is_sqlite = url.startswith("sqlite")
+    if is_sqlite:
+        options["connect_args"] = {"check_same_thread": False}
+        if ":memory:" in url or url in ("sqlite://", "sqlite:///"):
+            # Banco em memória usa pool próprio, sem dimensionamento
+            options = {"connect_args": options["connect_args"]}
+    else:
+        # Servidor de banco: descartar conexões derrubadas e reciclá-las
+        options["pool_pre_ping"] = os.getenv("PDV_DB_POOL_PRE_PING", "1") != "0"
+        options["pool_recycle"] = int(os.getenv("PDV_DB_POOL_RECYCLE", "1800"))
+        connect_args = {}
+        if url.startswith("postgresql"):
+            if statement_timeout:
+                connect_args["options"] = f"-c statement_timeout={int(statement_timeout * 1000)}"
+            if url.startswith("postgresql+psycopg:"):
+                # psycopg 3: prepared statements no servidor após N execuções
+                connect_args["prepare_threshold"] = int(os.getenv("PDV_PG_PREPARE_THRESHOLD", "5"))
+        if connect_args:
+            options["connect_args"] = connect_args
+    options.update(engine_options)
+    
+    db_engine = create_engine(url, **options)
+    
+    if is_sqlite:
+        pragmas = sqlite_pragmas(profile)
+        
+        @event.listens_for(db_engine, "connect")
+        def _apply_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+            cursor.close()
+        
+        if statement_timeout:
+            _install_sqlite_statement_timeout(db_engine, statement_timeout)
+    
+    return db_engine
+
+def _install_sqlite_statement_timeout(db_engine, timeout):
+    """Interromper no SQLite as instruções que passarem de `timeout` segundos"""
+    
+    @event.listens_for(db_engine, "connect")
+    def _install_handler(dbapi_connection, connection_record):
+        state = connection_record.info.setdefault("statement_deadline", {"deadline": None})
+        
+        def _check_deadline():
+            deadline = state["deadline"]
+            return 1 if deadline is not None and time.monotonic() > deadline else 0
+        
+        dbapi_connection.set_progress_handler(_check_deadline, 10000)
+    
+    @event.listens_for(db_engine, "before_cursor_execute")
+    def _start_deadline(conn, cursor, statement, parameters, context, executemany):
+        state = conn.info.get("statement_deadline")
+        if state is not None:
+            state["deadline"] = time.monotonic() + timeout
+    
+    @event.listens_for(db_engine, "after_cursor_execute")
+    def _clear_deadline(conn, cursor, statement, parameters, context, executemany):
+        state = conn.info.get("statement_deadline")
+        if state is not None:
+            state["deadline"] = None
+
+def read_only_url(url=DATABASE_URL):
+    """URL da réplica de leitura, ou do mesmo arquivo SQLite em modo somente leitura"""
+    replica = os.getenv("PDV_READ_DATABASE_URL")
+    if replica:
+        return replica
+    if url.startswith("sqlite:///") and ":memory:" not in url:
+        path = url[len("sqlite:///"):]
+        return f"sqlite:///file:{path}?mode=ro&uri=true"
+    return url
+
+engine = create_db_engine(DATABASE_URL)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Engine separada para relatórios: pool próprio e tempo limite por consulta,
+# para que a carga analítica não ocupe as conexões do checkout
+READ_STATEMENT_TIMEOUT = float(os.getenv("PDV_READ_STATEMENT_TIMEOUT", "15"))
+
+read_engine = create_db_engine(
+    read_only_url(DATABASE_URL),
+    profile="read_only",
+    statement_timeout=READ_STATEMENT_TIMEOUT,
+    env_prefix="PDV_READ_DB"
+)
+
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
 Base = declarative_base()
 
+class _TimestampBound(TypeDecorator):
+    """Data/hora comparada com colunas DateTime.
+
+    No SQLite a coluna é texto: o padrão `now()` grava 'AAAA-MM-DD HH:MM:SS'
+    e o ORM grava com microssegundos. O valor vai no mesmo formato (sem
+    fração quando é zero, ou sempre com fração em `upper`), para que a
+    comparação de texto siga a ordem cronológica e use os índices. Nos
+    outros bancos é um timestamp comum.
+    """
+    impl = DateTime
+    cache_ok = True
+
+    def __init__(self, upper=False):
+        super().__init__()
+        self.upper = upper
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "sqlite":
+            return dialect.type_descriptor(String())
+        return dialect.type_descriptor(DateTime(timezone=True))
+
+    def process_bind_param(self, value, dialect):
+        if value is None or dialect.name != "sqlite":
+            return value
+        timespec = "microseconds" if value.microsecond or self.upper else "seconds"
+        return value.replace(tzinfo=None).isoformat(sep=" ", timespec=timespec)
+
+def timestamp_bound(value, upper=False):
+    """Limite de data/hora para filtros e cursores sobre colunas DateTime.
+
+    No SQLite o mesmo instante pode estar gravado sem fração ou com
+    '.000000': `upper=True` dá o maior dos dois textos, para comparações
+    com <= que precisam incluir o instante nos dois formatos.
+    """
+    return literal(value, _TimestampBound(upper))
+
+def round_money(expression, digits=2):
+    """round() em SQL para valores em reais.
+
+    O PostgreSQL só arredonda com casas decimais em NUMERIC (não em double
+    precision, o tipo das colunas Float); o resultado volta como float.
+    """
+    return type_coerce(func.round(cast(expression, Numeric), digits), Float)
+
 def get_db():
     """Dependency para obter sessão do banco de dados"""
     db = SessionLocal()
@@ -23,13 +222,59 @@ def get_db():
     finally:
         db.close()
 
+def get_read_db():
+    """Dependency para sessão somente leitura (relatórios e resumos)"""
+    db = ReadSessionLocal()
+    try:
+        yield db
+    except OperationalError as exc:
+        if "interrupted" in str(exc.orig):
+            raise HTTPException(
+                status_code=503,
+                detail="Consulta excedeu o tempo limite de relatórios"
+            ) from exc
+        raise
+    finally:
+        db.close()
+
 def create_tables():
     """Cria todas as tabelas no banco de dados"""
     # Importar todos os modelos para garantir que as tabelas sejam criadas
     from backend.models.product import Product, Category
     from backend.models.customer import Customer
     from backend.models.sale import Sale, SaleItem
-    from backend.models.inventory import Inventory, InventoryMovement
+    from backend.models.inventory import Inventory, InventoryMovement, StockLevelEvent
     from backend.models.payment import PaymentMethod, Payment
+    from backend.models.store import Store
+    from backend.models.idempotency import IdempotencyKey
+    from backend.models.receipt import SaleReceipt
+    from backend.models.outbox import OutboxMessage
+    from backend.models.nfce import NfceDocument, NfceSequence
+    from backend.models.promotion import Promotion
+    from backend.models.reservation import StockReservation
+    from backend.models.shift import RegisterShift, RegisterShiftTotal, RegisterShiftMovement
+    from backend.models.replenishment import ReplenishmentRun, ReplenishmentSuggestion
     
     Base.metadata.create_all(bind=engine)
+    migrate_schema()
+
+def migrate_schema():
+    """Adiciona colunas e índices novos em tabelas que já existiam.
+
+    O create_all só cria tabelas ausentes; bancos criados por versões
+    anteriores recebem aqui as colunas (sempre anuláveis) e os índices
+    declarados depois.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
@@ -8,12 +8,16 @@ from backend.models.product import Product, Category
 from backend.models.customer import Customer
 from backend.models.inventory import Inventory
 from backend.models.payment import PaymentMethod
+from backend.services import categories as category_service
+from backend.services import customer_search, stores
 
 def create_sample_data():
     """Criar dados de exemplo para o sistema"""
     db = SessionLocal()
     
     try:
+        stores.ensure_default_store(db)
+        
         # Criar categorias
         categories = [
             Category(name="Eletrônicos", description="Produtos eletrônicos"),
@@ -129,6 +133,7 @@ def create_sample_data():
         for i, product in enumerate(products):
             inventory = Inventory(
                 product_id=product.id,
+                store_id=stores.DEFAULT_STORE_ID,
                 quantity=50 + (i * 10),  # Quantidades variadas
                 min_stock=10,
                 max_stock=100,
@@ -138,6 +143,9 @@ def create_sample_data():
         
         db.commit()
         
+        # Vincular produtos às categorias por id e calcular os agregados
+        category_service.backfill_product_categories(db)
+        
         # Criar clientes de exemplo
         customers = [
             Customer(
@@ -191,6 +199,7 @@ def create_sample_data():
         ]
         
         for customer in customers:
+            customer_search.apply_search_keys(customer)
             db.add(customer)
         
         db.commit()
@@ -26,6 +26,12 @@ class Customer(Base):
     # Informações adicionais
     notes = Column(Text)
     active = Column(Boolean, default=True)
+    
+    # Chaves normalizadas de busca (ver backend/services/customer_search.py)
+    document_key = Column(String(20), index=True)  # Somente dígitos
+    phone_key = Column(String(20), index=True)  # Somente dígitos
+    name_key = Column(String(255), index=True)  # Minúsculas, sem acentos
+    email_key = Column(String(255), index=True)  # Minúsculas, sem acentos
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
@@ -0,0 +1,20 @@
+from sqlalchemy import Column, Integer, String, Text, DateTime
+from sqlalchemy.sql import func
+from backend.database import Base
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    scope = Column(String(50), primary_key=True)  # Operação, ex.: "sales.create"
+    key = Column(String(100), primary_key=True)  # Valor do header Idempotency-Key
+    request_hash = Column(String(64), nullable=False)
+    status = Column(String(20), nullable=False, default="processing")  # processing, completed
+    resource_id = Column(Integer)  # Id do registro criado (ex.: venda)
+    status_code = Column(Integer)
+    response_body = Column(Text)  # Resposta original em JSON
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    claimed_at = Column(DateTime(timezone=True))  # Início do lease de processamento
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<IdempotencyKey(scope='{self.scope}', key='{self.key}', status='{self.status}')>"
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, Float, DateTime, ForeignKey, String
+from sqlalchemy import Column, Integer, Float, DateTime, ForeignKey, String, Index, text
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from backend.database import Base
@@ -8,15 +8,34 @@ class Inventory(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    store_id = Column(Integer, ForeignKey("stores.id"))
     quantity = Column(Integer, nullable=False, default=0)
+    # Soma das reservas ativas (carrinhos e pedidos online), mantida a cada
+    # reserva: disponível = quantity - reserved_quantity
+    reserved_quantity = Column(Integer, default=0)
     min_stock = Column(Integer, default=0)
     max_stock = Column(Integer)
+    # Nível mantido a cada mudança de quantity/min_stock: ok, low, critical
+    # (ver services/stock_levels.py)
+    stock_level = Column(String(10), default="ok")
     location = Column(String(100))
     last_updated = Column(DateTime(timezone=True), server_default=func.now())
 
     # Relacionamento
     product = relationship("Product", back_populates="inventory")
 
+    __table_args__ = (
+        # Estoque de um produto em uma loja
+        Index("ix_inventory_store_product", "store_id", "product_id"),
+        # Só as linhas em estoque baixo ou crítico: listas e contagens de
+        # estoque baixo leem este índice pequeno
+        Index(
+            "ix_inventory_low_stock", "store_id", "product_id",
+            sqlite_where=text("stock_level IN ('low', 'critical')"),
+            postgresql_where=text("stock_level IN ('low', 'critical')")
+        ),
+    )
+
     def __repr__(self):
         return f"<Inventory(product_id={self.product_id}, quantity={self.quantity})>"
 
@@ -25,6 +44,8 @@ class InventoryMovement(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    store_id = Column(Integer, ForeignKey("stores.id"))
+    terminal_id = Column(String(50))
     movement_type = Column(String(20), nullable=False)  # 'in', 'out', 'adjustment'
     quantity = Column(Integer, nullable=False)
     previous_quantity = Column(Integer)
@@ -36,5 +57,30 @@ class InventoryMovement(Base):
     # Relacionamento
     product = relationship("Product")
 
+    __table_args__ = (
+        # Histórico de movimentações do produto por loja
+        Index("ix_inventory_movements_store_product_created", "store_id", "product_id", "created_at"),
+    )
+
     def __repr__(self):
         return f"<InventoryMovement(product_id={self.product_id}, type='{self.movement_type}', quantity={self.quantity})>"
+
+class StockLevelEvent(Base):
+    __tablename__ = "stock_level_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    store_id = Column(Integer, ForeignKey("stores.id"))
+    previous_level = Column(String(10), nullable=False)
+    level = Column(String(10), nullable=False)  # ok, low, critical
+    quantity = Column(Integer, nullable=False)
+    min_stock = Column(Integer)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        # Alertas da loja em ordem de chegada
+        Index("ix_stock_level_events_store_id", "store_id", "id"),
+    )
+
+    def __repr__(self):
+        return f"<StockLevelEvent(product_id={self.product_id}, {self.previous_level} -> {self.level})>"
@@ -0,0 +1,40 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, LargeBinary, UniqueConstraint
+from sqlalchemy.sql import func
+from backend.database import Base
+
+class NfceDocument(Base):
+    __tablename__ = "nfce_documents"
+
+    id = Column(Integer, primary_key=True, index=True)
+    sale_id = Column(Integer, ForeignKey("sales.id"), nullable=False, unique=True, index=True)
+    store_id = Column(Integer, ForeignKey("stores.id"))
+    series = Column(Integer, nullable=False)
+    number = Column(Integer, nullable=False)
+    access_key = Column(String(44), nullable=False, unique=True, index=True)
+    emission_type = Column(Integer, nullable=False, default=1)  # 1 normal, 9 contingência offline
+    environment = Column(Integer, nullable=False, default=2)  # 1 produção, 2 homologação
+    status = Column(String(20), nullable=False, default="pending", index=True)  # pending, signed, authorized, rejected
+    status_code = Column(Integer)  # cStat devolvido pela SEFAZ
+    protocol = Column(String(20))  # Protocolo de autorização
+    rejection_reason = Column(String(255))
+    xml = Column(LargeBinary)  # XML assinado (zlib)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    authorized_at = Column(DateTime(timezone=True))
+
+    __table_args__ = (
+        UniqueConstraint("store_id", "series", "number", name="uq_nfce_documents_number"),
+    )
+
+    def __repr__(self):
+        return f"<NfceDocument(sale_id={self.sale_id}, number={self.number}, status='{self.status}')>"
+
+class NfceSequence(Base):
+    """Próximo número da NFC-e por loja e série"""
+    __tablename__ = "nfce_sequences"
+
+    store_id = Column(Integer, ForeignKey("stores.id"), primary_key=True)
+    series = Column(Integer, primary_key=True)
+    next_number = Column(Integer, nullable=False, default=1)
+
+    def __repr__(self):
+        return f"<NfceSequence(store_id={self.store_id}, series={self.series}, next={self.next_number})>"
@@ -0,0 +1,27 @@
+from sqlalchemy import Column, Integer, String, Text, DateTime, Index
+from sqlalchemy.sql import func
+from backend.database import Base
+
+class OutboxMessage(Base):
+    __tablename__ = "outbox_messages"
+
+    id = Column(Integer, primary_key=True, index=True)
+    topic = Column(String(50), nullable=False)  # Ex.: "sale.created"
+    aggregate_id = Column(Integer)  # Registro de origem (ex.: id da venda)
+    payload = Column(Text, nullable=False)  # JSON
+    status = Column(String(20), nullable=False, default="pending")  # pending, done, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+    available_at = Column(DateTime(timezone=True), nullable=False)  # Próxima tentativa
+    processed_at = Column(DateTime(timezone=True))
+
+    # Fila do worker: pendentes por ordem de disponibilidade
+    __table_args__ = (
+        Index("ix_outbox_messages_status_available", "status", "available_at"),
+        # Relay de eventos e limpeza: entregues por ordem de conclusão
+        Index("ix_outbox_messages_status_processed", "status", "processed_at"),
+    )
+
+    def __repr__(self):
+        return f"<OutboxMessage(id={self.id}, topic='{self.topic}', status='{self.status}')>"
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, Float, String, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, Float, String, DateTime, ForeignKey, Boolean, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from backend.database import Base
@@ -23,18 +23,29 @@ class Payment(Base):
     id = Column(Integer, primary_key=True, index=True)
     sale_id = Column(Integer, ForeignKey("sales.id"), nullable=False)
     payment_method_id = Column(Integer, ForeignKey("payment_methods.id"), nullable=False)
+    store_id = Column(Integer, ForeignKey("stores.id"))
+    terminal_id = Column(String(50))
+    shift_id = Column(Integer, ForeignKey("register_shifts.id"), index=True)  # Caixa que recebeu ou estornou
     amount = Column(Float, nullable=False)
     fee_amount = Column(Float, default=0)
     net_amount = Column(Float, nullable=False)
     authorization_code = Column(String(100))
     transaction_id = Column(String(100))
-    status = Column(String(20), default="pending")  # pending, approved, declined, cancelled
+    status = Column(String(20), default="pending")  # pending, approved, declined, cancelled, refunded (estorno)
+    decline_reason = Column(String(255))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     processed_at = Column(DateTime(timezone=True))
+    attempted_at = Column(DateTime(timezone=True))  # Última tentativa de autorização no adquirente
 
     # Relacionamentos
     sale = relationship("Sale")
     payment_method = relationship("PaymentMethod")
 
+    __table_args__ = (
+        # Pagamentos de uma venda e conciliação por venda
+        Index("ix_payments_sale_status", "sale_id", "status"),
+        Index("ix_payments_store_created", "store_id", "created_at"),
+    )
+
     def __repr__(self):
         return f"<Payment(id={self.id}, sale_id={self.sale_id}, amount={self.amount}, status='{self.status}')>"
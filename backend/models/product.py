@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, Text
+from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, Text, ForeignKey
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from backend.database import Base
@@ -12,7 +12,8 @@ class Product(Base):
     price = Column(Float, nullable=False)
     cost_price = Column(Float)
     barcode = Column(String(100), unique=True, index=True)
-    category = Column(String(100))
+    category = Column(String(100))  # Nome da categoria (desnormalizado)
+    category_id = Column(Integer, ForeignKey("categories.id"), index=True)
     brand = Column(String(100))
     weight = Column(Float)
     dimensions = Column(String(50))
@@ -23,6 +24,7 @@ class Product(Base):
     # Relacionamentos
     inventory = relationship("Inventory", back_populates="product", uselist=False)
     sale_items = relationship("SaleItem", back_populates="product")
+    category_ref = relationship("Category", back_populates="products")
 
     def __repr__(self):
         return f"<Product(id={self.id}, name='{self.name}', price={self.price})>"
@@ -36,5 +38,15 @@ class Category(Base):
     active = Column(Boolean, default=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+    # Agregados mantidos pelas rotas de escrita (ver backend/services/categories.py)
+    product_count = Column(Integer, default=0)  # Produtos ativos
+    stock_value = Column(Float, default=0)  # Soma de quantidade * preço dos produtos ativos
+    sales_quantity = Column(Integer, default=0)
+    sales_total = Column(Float, default=0)
+    stats_updated_at = Column(DateTime(timezone=True))
+
+    # Relacionamentos
+    products = relationship("Product", back_populates="category_ref")
+
     def __repr__(self):
         return f"<Category(id={self.id}, name='{self.name}')>"
@@ -0,0 +1,26 @@
+from sqlalchemy import Column, Integer, Float, String, Boolean, DateTime, ForeignKey
+from sqlalchemy.sql import func
+from backend.database import Base
+
+class Promotion(Base):
+    __tablename__ = "promotions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(100), nullable=False)
+    type = Column(String(20), nullable=False)  # percentage, fixed, buy_x_get_y
+    value = Column(Float, default=0)  # % de desconto ou valor fixo por unidade
+    buy_quantity = Column(Integer)  # Leve X...
+    get_quantity = Column(Integer)  # ...ganhe Y (a cada X + Y unidades)
+    # Alcance: produto, categoria ou, sem nenhum dos dois, todos os produtos
+    product_id = Column(Integer, ForeignKey("products.id"), index=True)
+    category_id = Column(Integer, ForeignKey("categories.id"), index=True)
+    customer_id = Column(Integer, ForeignKey("customers.id"), index=True)  # Só para este cliente
+    starts_at = Column(DateTime(timezone=True))
+    ends_at = Column(DateTime(timezone=True))
+    priority = Column(Integer, default=0)  # Desempate entre descontos iguais
+    active = Column(Boolean, default=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<Promotion(id={self.id}, name='{self.name}', type='{self.type}')>"
@@ -0,0 +1,17 @@
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, LargeBinary
+from sqlalchemy.sql import func
+from backend.database import Base
+
+class SaleReceipt(Base):
+    __tablename__ = "sale_receipts"
+
+    sale_id = Column(Integer, ForeignKey("sales.id"), primary_key=True)
+    etag = Column(String(64), nullable=False)  # Hash do JSON do recibo
+    payload = Column(LargeBinary, nullable=False)  # JSON do recibo (zlib)
+    escpos = Column(LargeBinary, nullable=False)  # Impressão térmica ESC/POS (zlib)
+    stale = Column(Boolean, default=False)  # Situação do pagamento mudou desde a geração
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<SaleReceipt(sale_id={self.sale_id}, etag='{self.etag}')>"
@@ -0,0 +1,50 @@
+from sqlalchemy import Column, Integer, Float, String, Boolean, DateTime, ForeignKey, Index, UniqueConstraint
+from sqlalchemy.sql import func
+from backend.database import Base
+
+class ReplenishmentRun(Base):
+    __tablename__ = "replenishment_runs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    status = Column(String(20), nullable=False, default="running")  # running, done, failed
+    window_days = Column(Integer, nullable=False)  # Dias de histórico de saídas
+    lead_time_days = Column(Float, nullable=False)
+    review_days = Column(Float, nullable=False)
+    service_level = Column(Float, nullable=False)
+    stores = Column(Integer, default=0)
+    products = Column(Integer, default=0)
+    demand_rows = Column(Integer, default=0)  # Linhas (produto, dia) lidas das saídas
+    duration_seconds = Column(Float)
+    error = Column(String(255))
+    started_at = Column(DateTime(timezone=True), server_default=func.now())
+    finished_at = Column(DateTime(timezone=True))
+
+    def __repr__(self):
+        return f"<ReplenishmentRun(id={self.id}, status='{self.status}', products={self.products})>"
+
+class ReplenishmentSuggestion(Base):
+    __tablename__ = "replenishment_suggestions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    run_id = Column(Integer, ForeignKey("replenishment_runs.id"), nullable=False)
+    store_id = Column(Integer, ForeignKey("stores.id"), nullable=False)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    available = Column(Integer, nullable=False)  # Em mãos menos o reservado, na hora do cálculo
+    daily_demand = Column(Float, nullable=False)  # Média de saídas por dia
+    demand_std = Column(Float, nullable=False)  # Desvio padrão das saídas diárias
+    safety_stock = Column(Integer, nullable=False)
+    reorder_point = Column(Integer, nullable=False)
+    days_of_cover = Column(Float)  # Nulo sem demanda
+    suggested_quantity = Column(Integer, nullable=False, default=0)
+    needs_reorder = Column(Boolean, nullable=False, default=False)
+    computed_at = Column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (
+        # Uma sugestão vigente por produto e loja (a última execução)
+        UniqueConstraint("store_id", "product_id", name="uq_replenishment_suggestions_store_product"),
+        # Lista de compras da loja, do menor para o maior número de dias de cobertura
+        Index("ix_replenishment_suggestions_store_reorder_cover", "store_id", "needs_reorder", "days_of_cover"),
+    )
+
+    def __repr__(self):
+        return f"<ReplenishmentSuggestion(product_id={self.product_id}, suggested={self.suggested_quantity})>"
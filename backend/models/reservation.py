@@ -0,0 +1,30 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index, UniqueConstraint
+from sqlalchemy.sql import func
+from backend.database import Base
+
+class StockReservation(Base):
+    __tablename__ = "stock_reservations"
+
+    id = Column(Integer, primary_key=True, index=True)
+    owner_type = Column(String(20), nullable=False)  # cart, order
+    owner_id = Column(String(64), nullable=False)  # Id do carrinho ou do pedido online
+    store_id = Column(Integer, ForeignKey("stores.id"), nullable=False)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    quantity = Column(Integer, nullable=False, default=0)
+    status = Column(String(20), nullable=False, default="active")  # active, released, expired, converted
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    sale_id = Column(Integer, ForeignKey("sales.id"))  # Venda que consumiu a reserva
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+    __table_args__ = (
+        # Uma linha por produto de cada dono, reaproveitada a cada reserva
+        UniqueConstraint("owner_type", "owner_id", "store_id", "product_id", name="uq_stock_reservations_owner_product"),
+        # Reservas ativas de um produto na loja
+        Index("ix_stock_reservations_store_product_status", "store_id", "product_id", "status"),
+        # Varredura de expiração
+        Index("ix_stock_reservations_status_expires", "status", "expires_at"),
+    )
+
+    def __repr__(self):
+        return f"<StockReservation(owner='{self.owner_type}:{self.owner_id}', product_id={self.product_id}, quantity={self.quantity}, status='{self.status}')>"
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, Float, String, DateTime, ForeignKey, Boolean, Text
+from sqlalchemy import Column, Integer, Float, String, DateTime, ForeignKey, Boolean, Text, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from backend.database import Base
@@ -8,22 +8,37 @@ class Sale(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     customer_id = Column(Integer, ForeignKey("customers.id"))
+    store_id = Column(Integer, ForeignKey("stores.id"))
+    terminal_id = Column(String(50))
+    shift_id = Column(Integer, ForeignKey("register_shifts.id"), index=True)  # Caixa aberto no terminal
+    client_id = Column(String(64), unique=True, index=True)  # Id gerado no terminal (vendas offline)
     total_amount = Column(Float, nullable=False)
     discount_amount = Column(Float, default=0)
     tax_amount = Column(Float, default=0)
     final_amount = Column(Float, nullable=False)
-    payment_method = Column(String(50), nullable=False)
-    payment_status = Column(String(20), default="pending")  # pending, paid, cancelled
+    paid_amount = Column(Float, default=0)  # Soma dos pagamentos aprovados, menos estornos
+    returned_amount = Column(Float, default=0)  # Valor devolvido ou cancelado
+    payment_method = Column(String(50), nullable=False)  # Principal forma ou "multiple"
+    payment_status = Column(String(20), default="pending")  # pending, partial, paid, cancelled
     nfce_number = Column(String(50))
     nfce_key = Column(String(50))
     notes = Column(Text)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    synced_at = Column(DateTime(timezone=True))  # Recebida do journal offline do terminal
 
     # Relacionamentos
     customer = relationship("Customer", back_populates="sales")
     items = relationship("SaleItem", back_populates="sale", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # Histórico de compras por cliente (paginação por created_at)
+        Index("ix_sales_customer_created", "customer_id", "created_at"),
+        # Consultas e relatórios por loja/terminal
+        Index("ix_sales_store_created", "store_id", "created_at"),
+        Index("ix_sales_store_terminal_created", "store_id", "terminal_id", "created_at"),
+    )
+
     def __repr__(self):
         return f"<Sale(id={self.id}, total={self.total_amount}, status='{self.payment_status}')>"
 
@@ -31,13 +46,15 @@ class SaleItem(Base):
     __tablename__ = "sale_items"
 
     id = Column(Integer, primary_key=True, index=True)
-    sale_id = Column(Integer, ForeignKey("sales.id"), nullable=False)
+    sale_id = Column(Integer, ForeignKey("sales.id"), nullable=False, index=True)
     product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
     quantity = Column(Integer, nullable=False)
     unit_price = Column(Float, nullable=False)
     total_price = Column(Float, nullable=False)
     discount_percentage = Column(Float, default=0)
     discount_amount = Column(Float, default=0)
+    promotion_id = Column(Integer, ForeignKey("promotions.id"))  # Promoção aplicada no item
+    returned_quantity = Column(Integer, default=0)  # Devolvida ou cancelada (já voltou ao estoque)
 
     # Relacionamentos
     sale = relationship("Sale", back_populates="items")
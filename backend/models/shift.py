@@ -0,0 +1,68 @@
+from sqlalchemy import Column, Integer, Float, String, Text, DateTime, ForeignKey, Index, text
+from sqlalchemy.sql import func
+from backend.database import Base
+
+class RegisterShift(Base):
+    __tablename__ = "register_shifts"
+
+    id = Column(Integer, primary_key=True, index=True)
+    store_id = Column(Integer, ForeignKey("stores.id"), nullable=False)
+    terminal_id = Column(String(50), nullable=False)
+    status = Column(String(20), nullable=False, default="open")  # open, closed
+    opened_by = Column(String(100))
+    closed_by = Column(String(100))
+    opening_float = Column(Float, nullable=False, default=0)  # Troco inicial
+    # Totais mantidos a cada venda e movimento de caixa
+    sales_count = Column(Integer, nullable=False, default=0)
+    sales_amount = Column(Float, nullable=False, default=0)
+    deposits = Column(Float, nullable=False, default=0)  # Suprimentos
+    withdrawals = Column(Float, nullable=False, default=0)  # Sangrias
+    # Fechamento
+    expected_cash = Column(Float)
+    counted_cash = Column(Float)
+    cash_difference = Column(Float)  # Contado - esperado
+    notes = Column(Text)
+    opened_at = Column(DateTime(timezone=True), server_default=func.now())
+    closed_at = Column(DateTime(timezone=True))
+
+    __table_args__ = (
+        # No máximo um caixa aberto por terminal
+        Index(
+            "uq_register_shifts_open_terminal", "store_id", "terminal_id",
+            unique=True,
+            sqlite_where=text("status = 'open'"),
+            postgresql_where=text("status = 'open'")
+        ),
+        Index("ix_register_shifts_store_terminal_opened", "store_id", "terminal_id", "opened_at"),
+    )
+
+    def __repr__(self):
+        return f"<RegisterShift(id={self.id}, terminal_id='{self.terminal_id}', status='{self.status}')>"
+
+class RegisterShiftTotal(Base):
+    __tablename__ = "register_shift_totals"
+
+    shift_id = Column(Integer, ForeignKey("register_shifts.id"), primary_key=True)
+    payment_method_id = Column(Integer, ForeignKey("payment_methods.id"), primary_key=True)
+    method_type = Column(String(50))  # Tipo do método (cash entra no esperado da gaveta)
+    payments_count = Column(Integer, nullable=False, default=0)
+    received_amount = Column(Float, nullable=False, default=0)  # Pagamentos aprovados
+    refunded_amount = Column(Float, nullable=False, default=0)  # Estornos
+    counted_amount = Column(Float)  # Informado no fechamento
+
+    def __repr__(self):
+        return f"<RegisterShiftTotal(shift_id={self.shift_id}, payment_method_id={self.payment_method_id}, received={self.received_amount})>"
+
+class RegisterShiftMovement(Base):
+    __tablename__ = "register_shift_movements"
+
+    id = Column(Integer, primary_key=True, index=True)
+    shift_id = Column(Integer, ForeignKey("register_shifts.id"), nullable=False, index=True)
+    type = Column(String(20), nullable=False)  # withdrawal (sangria), deposit (suprimento)
+    amount = Column(Float, nullable=False)
+    reason = Column(String(255))
+    created_by = Column(String(100))
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    def __repr__(self):
+        return f"<RegisterShiftMovement(shift_id={self.shift_id}, type='{self.type}', amount={self.amount})>"
@@ -0,0 +1,21 @@
+from sqlalchemy import Column, Integer, String, Boolean, DateTime
+from sqlalchemy.sql import func
+from backend.database import Base
+
+class Store(Base):
+    __tablename__ = "stores"
+
+    id = Column(Integer, primary_key=True, index=True)
+    code = Column(String(20), nullable=False, unique=True)
+    name = Column(String(255), nullable=False)
+    database_url = Column(String(500))  # Banco próprio da loja (opcional)
+    active = Column(Boolean, default=True)
+    # Dados fiscais da NFC-e (sem eles valem os padrões PDV_NFCE_*)
+    cnpj = Column(String(14))
+    state_code = Column(String(2))  # Código IBGE da UF
+    city_code = Column(String(7))  # Código IBGE do município
+    nfce_series = Column(Integer)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    def __repr__(self):
+        return f"<Store(id={self.id}, code='{self.code}', name='{self.name}')>"
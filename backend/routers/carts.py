@@ -0,0 +1,127 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+from typing import Optional
+from backend.database import get_db
+from backend.models.sale import Sale
+from backend.schemas import (
+    Sale as SaleSchema, SaleCreate, SaleItemCreate,
+    CartCreate, CartUpdate, CartItemScan, CartCheckout
+)
+from backend.routers import sales as sales_router
+from backend.services.carts import CartError, store
+from backend.services.stores import get_store_id, get_terminal_id
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+router = APIRouter()
+
+def _cart_error(exc: CartError):
+    return HTTPException(status_code=exc.status_code, detail=exc.detail)
+
+@router.post("/")
+async def open_cart(
+    cart_data: CartCreate,
+    store_id: int = Depends(get_store_id),
+    terminal_id: Optional[str] = Depends(get_terminal_id)
+):
+    """Abrir um carrinho para o caixa"""
+    try:
+        cart = store.open(store_id, terminal_id, cart_data.customer_id, cart_data.reserve_stock)
+    except CartError as exc:
+        raise _cart_error(exc)
+    return cart.view()
+
+@router.get("/stats")
+async def cart_stats():
+    """Carrinhos em memória e unidades reservadas"""
+    return store.stats()
+
+@router.get("/{cart_id}")
+async def get_cart(cart_id: str):
+    """Obter o carrinho com itens e totais"""
+    try:
+        return store.get(cart_id).view()
+    except CartError as exc:
+        raise _cart_error(exc)
+
+@router.put("/{cart_id}")
+async def update_cart(cart_id: str, cart_update: CartUpdate, db: Session = Depends(get_db)):
+    """Identificar o cliente (reaplica as promoções de cliente)"""
+    try:
+        return store.set_customer(db, cart_id, cart_update.customer_id).view()
+    except CartError as exc:
+        raise _cart_error(exc)
+
+@router.post("/{cart_id}/items")
+async def scan_item(cart_id: str, scan: CartItemScan, db: Session = Depends(get_db)):
+    """Adicionar um item pelo código de barras (ou id do produto)"""
+    if scan.barcode is None and scan.product_id is None:
+        raise HTTPException(status_code=400, detail="Informe barcode ou product_id")
+    try:
+        cart = store.set_quantity(db, cart_id, scan.product_id, scan.barcode, delta=scan.quantity)
+    except CartError as exc:
+        raise _cart_error(exc)
+    return cart.view()
+
+@router.delete("/{cart_id}/items/{product_id}")
+async def remove_item(
+    cart_id: str,
+    product_id: int,
+    quantity: Optional[int] = Query(None, ge=1),
+    db: Session = Depends(get_db)
+):
+    """Remover um produto do carrinho (ou só `quantity` unidades)"""
+    try:
+        if quantity is None:
+            cart = store.set_quantity(db, cart_id, product_id, quantity=0)
+        else:
+            cart = store.set_quantity(db, cart_id, product_id, delta=-quantity)
+    except CartError as exc:
+        raise _cart_error(exc)
+    return cart.view()
+
+@router.post("/{cart_id}/checkout", response_model=SaleSchema)
+async def checkout_cart(cart_id: str, checkout: CartCheckout, db: Session = Depends(get_db)):
+    """Fechar o carrinho em uma venda.
+
+    O id do carrinho vira o client_id da venda: repetir o fechamento
+    devolve a mesma venda.
+    """
+    try:
+        cart = store.begin_checkout(cart_id)
+    except CartError as exc:
+        raise _cart_error(exc)
+    if cart.status == "closed":
+        return db.query(Sale).filter(Sale.id == cart.sale_id).first()
+
+    sale_data = SaleCreate(
+        customer_id=cart.customer_id,
+        items=[
+            SaleItemCreate(product_id=line.product_id, quantity=line.quantity, unit_price=line.unit_price)
+            for line in cart.lines.values()
+        ],
+        payment_method=checkout.payment_method,
+        discount_amount=checkout.discount_amount,
+        notes=checkout.notes
+    )
+    try:
+        sale = sales_router._create_sale(
+            db, sale_data, cart.store_id, cart.terminal_id, cart.id,
+            ("cart", cart.id) if cart.reserve_stock else None
+        )
+    except Exception:
+        store.abort_checkout(cart_id)
+        raise
+    store.close(cart_id, sale.id)
+    return sale
+
+@router.delete("/{cart_id}")
+async def discard_cart(cart_id: str, db: Session = Depends(get_db)):
+    """Descartar o carrinho e liberar as reservas"""
+    try:
+        store.discard(db, cart_id)
+    except CartError as exc:
+        raise _cart_error(exc)
+    return {"message": "Carrinho descartado"}
@@ -1,9 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, File
+from sqlalchemy.orm import Session, selectinload, joinedload
+from sqlalchemy import func, or_, and_
 from typing import List, Optional
-from backend.database import get_db
+from datetime import datetime
+from backend.database import get_db, timestamp_bound
 from backend.models.customer import Customer
+from backend.models.sale import Sale, SaleItem
 from backend.schemas import Customer as CustomerSchema, CustomerCreate, CustomerUpdate
+from backend.services import customer_search, customer_import
+import io
+import base64
+import binascii
 import sys
 import os
 
@@ -15,22 +22,36 @@ router = APIRouter()
 async def create_customer(customer: CustomerCreate, db: Session = Depends(get_db)):
     """Criar um novo cliente"""
     # Verificar se já existe cliente com mesmo email ou documento
-    if customer.email:
-        existing_email = db.query(Customer).filter(Customer.email == customer.email).first()
-        if existing_email:
-            raise HTTPException(status_code=400, detail="Email já cadastrado")
-    
-    if customer.document:
-        existing_doc = db.query(Customer).filter(Customer.document == customer.document).first()
-        if existing_doc:
-            raise HTTPException(status_code=400, detail="Documento já cadastrado")
+    _check_duplicates(db, customer.email, customer.document)
     
     db_customer = Customer(**customer.dict())
+    customer_search.apply_search_keys(db_customer)
     db.add(db_customer)
     db.commit()
     db.refresh(db_customer)
     return db_customer
 
+@router.post("/import")
+async def import_customers(
+    file: UploadFile = File(...),
+    format: Optional[str] = Query(None, pattern="^(csv|ndjson)$"),
+    upsert: bool = Query(False),
+    db: Session = Depends(get_db)
+):
+    """Importar clientes em massa de um arquivo CSV ou NDJSON"""
+    file_format = format
+    if file_format is None:
+        name = (file.filename or "").lower()
+        file_format = "ndjson" if name.endswith((".ndjson", ".jsonl")) else "csv"
+    
+    stream = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+    try:
+        return customer_import.import_customers(db, stream, file_format=file_format, upsert=upsert)
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Arquivo deve estar em UTF-8")
+    finally:
+        stream.detach()
+
 @router.get("/", response_model=List[CustomerSchema])
 async def list_customers(
     skip: int = Query(0, ge=0),
@@ -40,14 +61,12 @@ async def list_customers(
     db: Session = Depends(get_db)
 ):
     """Listar clientes com filtros opcionais"""
-    query = db.query(Customer)
-    
     if search:
-        query = query.filter(
-            Customer.name.contains(search) |
-            Customer.email.contains(search) |
-            Customer.document.contains(search)
-        )
+        # Busca por prefixo nas chaves normalizadas, ordenada por relevância
+        customers = customer_search.search_customers(db, search, limit=skip + limit, active=active)
+        return customers[skip:]
+    
+    query = db.query(Customer)
     
     if active is not None:
         query = query.filter(Customer.active == active)
@@ -55,6 +74,16 @@ async def list_customers(
     customers = query.offset(skip).limit(limit).all()
     return customers
 
+@router.get("/search", response_model=List[CustomerSchema])
+async def search_customers(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=100),
+    active: Optional[bool] = Query(True),
+    db: Session = Depends(get_db)
+):
+    """Identificar cliente por CPF/CNPJ, telefone, email ou nome (prefixo)"""
+    return customer_search.search_customers(db, q, limit=limit, active=active)
+
 @router.get("/{customer_id}", response_model=CustomerSchema)
 async def get_customer(customer_id: int, db: Session = Depends(get_db)):
     """Obter um cliente específico"""
@@ -63,6 +92,100 @@ async def get_customer(customer_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Cliente não encontrado")
     return customer
 
+@router.get("/{customer_id}/purchases")
+async def get_customer_purchases(
+    customer_id: int,
+    cursor: Optional[str] = Query(None),
+    limit: int = Query(50, ge=1, le=500),
+    include_items: bool = Query(False),
+    include_cancelled: bool = Query(False),
+    db: Session = Depends(get_db)
+):
+    """Histórico de compras do cliente com paginação por cursor.
+
+    Vendas canceladas só entram com `include_cancelled`, na lista e no
+    resumo da primeira página.
+    """
+    exists = db.query(Customer.id).filter(Customer.id == customer_id).first()
+    if not exists:
+        raise HTTPException(status_code=404, detail="Cliente não encontrado")
+    
+    criteria = [Sale.customer_id == customer_id]
+    if not include_cancelled:
+        criteria.append(or_(Sale.payment_status.is_(None), Sale.payment_status != "cancelled"))
+    query = db.query(Sale).filter(*criteria)
+    
+    if cursor:
+        # (created_at, id) < cursor, pelo índice (customer_id, created_at);
+        # os dois limites cobrem os formatos do mesmo instante no SQLite
+        cursor_created, cursor_id = _decode_cursor(cursor)
+        query = query.filter(or_(
+            Sale.created_at < timestamp_bound(cursor_created),
+            and_(Sale.created_at <= timestamp_bound(cursor_created, upper=True), Sale.id < cursor_id)
+        ))
+    
+    if include_items:
+        # Itens e nomes dos produtos em uma única consulta adicional
+        query = query.options(selectinload(Sale.items).joinedload(SaleItem.product))
+    
+    rows = query.order_by(Sale.created_at.desc(), Sale.id.desc()).limit(limit + 1).all()
+    
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last_sale = rows[-1]
+        next_cursor = _encode_cursor(last_sale.created_at, last_sale.id)
+    
+    purchases = []
+    for sale in rows:
+        purchase = {
+            "id": sale.id,
+            "created_at": sale.created_at,
+            "total_amount": sale.total_amount,
+            "discount_amount": sale.discount_amount,
+            "final_amount": sale.final_amount,
+            "payment_method": sale.payment_method,
+            "payment_status": sale.payment_status
+        }
+        if include_items:
+            purchase["items"] = [
+                {
+                    "product_id": item.product_id,
+                    "product_name": item.product.name if item.product else None,
+                    "quantity": item.quantity,
+                    "unit_price": item.unit_price,
+                    "discount_amount": item.discount_amount,
+                    "total_price": item.total_price
+                }
+                for item in sale.items
+            ]
+        purchases.append(purchase)
+    
+    result = {
+        "customer_id": customer_id,
+        "purchases": purchases,
+        "next_cursor": next_cursor
+    }
+    
+    # Totais de toda a vida do cliente só na primeira página
+    if not cursor:
+        totals = db.query(
+            func.count(Sale.id),
+            func.sum(Sale.final_amount),
+            func.min(Sale.created_at),
+            func.max(Sale.created_at)
+        ).filter(*criteria).one()
+        total_purchases, total_spent, first_purchase, last_purchase = totals
+        result["summary"] = {
+            "total_purchases": total_purchases,
+            "total_spent": total_spent or 0,
+            "average_purchase": (total_spent or 0) / total_purchases if total_purchases else 0,
+            "first_purchase": first_purchase,
+            "last_purchase": last_purchase
+        }
+    
+    return result
+
 @router.put("/{customer_id}", response_model=CustomerSchema)
 async def update_customer(
     customer_id: int,
@@ -76,25 +199,11 @@ async def update_customer(
     
     # Verificar duplicatas em email e documento
     update_data = customer_update.dict(exclude_unset=True)
-    
-    if "email" in update_data and update_data["email"]:
-        existing_email = db.query(Customer).filter(
-            Customer.email == update_data["email"],
-            Customer.id != customer_id
-        ).first()
-        if existing_email:
-            raise HTTPException(status_code=400, detail="Email já cadastrado")
-    
-    if "document" in update_data and update_data["document"]:
-        existing_doc = db.query(Customer).filter(
-            Customer.document == update_data["document"],
-            Customer.id != customer_id
-        ).first()
-        if existing_doc:
-            raise HTTPException(status_code=400, detail="Documento já cadastrado")
+    _check_duplicates(db, update_data.get("email"), update_data.get("document"), exclude_id=customer_id)
     
     for field, value in update_data.items():
         setattr(customer, field, value)
+    customer_search.apply_search_keys(customer)
     
     db.commit()
     db.refresh(customer)
@@ -114,7 +223,7 @@ async def delete_customer(customer_id: int, db: Session = Depends(get_db)):
 @router.get("/document/{document}", response_model=CustomerSchema)
 async def get_customer_by_document(document: str, db: Session = Depends(get_db)):
     """Obter cliente por CPF/CNPJ"""
-    customer = db.query(Customer).filter(Customer.document == document).first()
+    customer = customer_search.find_by_document(db, document)
     if not customer:
         raise HTTPException(status_code=404, detail="Cliente não encontrado")
     return customer
@@ -126,3 +235,28 @@ async def get_customer_by_email(email: str, db: Session = Depends(get_db)):
     if not customer:
         raise HTTPException(status_code=404, detail="Cliente não encontrado")
     return customer
+
+def _check_duplicates(
+    db: Session,
+    email: Optional[str],
+    document: Optional[str],
+    exclude_id: Optional[int] = None
+):
+    """Rejeitar email ou documento já cadastrados (uma única consulta)"""
+    duplicate = customer_import.find_duplicate(db, email, document, exclude_id=exclude_id)
+    if duplicate == "email":
+        raise HTTPException(status_code=400, detail="Email já cadastrado")
+    if duplicate == "document":
+        raise HTTPException(status_code=400, detail="Documento já cadastrado")
+
+def _encode_cursor(created_at: datetime, sale_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{sale_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def _decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        created_at, sale_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(sale_id)
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
@@ -0,0 +1,83 @@
+from fastapi import APIRouter, Depends, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+from typing import Optional
+import asyncio
+from backend.database import get_read_db
+from backend.services.events import Event, bus, live_totals
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+router = APIRouter()
+
+# Comentário enviado quando não há eventos, para manter a conexão aberta
+HEARTBEAT_SECONDS = float(os.getenv("PDV_EVENTS_HEARTBEAT", "15"))
+
+@router.get("/stream")
+async def stream_events(
+    request: Request,
+    store_id: Optional[int] = Query(None),
+    db: Session = Depends(get_read_db)
+):
+    """Eventos ao vivo por Server-Sent Events.
+
+    O primeiro evento ("snapshot") traz os totais do dia; depois chegam
+    só as mudanças: sale, sales_batch, payment, inventory, low_stock e,
+    se o cliente ficar para trás, resync.
+    """
+    snapshot = Event(0, "snapshot", live_totals.snapshot(db, store_id), store_id)
+    # A conexão do banco não fica presa durante o stream
+    db.close()
+    subscriber = bus.subscribe(store_id)
+
+    async def generate():
+        try:
+            yield snapshot.sse
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                yield event.sse
+        finally:
+            bus.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.websocket("/ws")
+async def websocket_events(
+    websocket: WebSocket,
+    store_id: Optional[int] = Query(None),
+    db: Session = Depends(get_read_db)
+):
+    """Os mesmos eventos do /stream por WebSocket (uma mensagem JSON por evento)"""
+    await websocket.accept()
+    snapshot = Event(0, "snapshot", live_totals.snapshot(db, store_id), store_id)
+    db.close()
+    subscriber = bus.subscribe(store_id)
+    try:
+        await websocket.send_text(snapshot.json)
+        while True:
+            event = await subscriber.queue.get()
+            await websocket.send_text(event.json)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        bus.unsubscribe(subscriber)
+
+@router.get("/stats")
+async def event_stats():
+    """Assinantes conectados e eventos descartados por lentidão"""
+    subscribers = bus.subscribers()
+    return {
+        "subscribers": len(subscribers),
+        "dropped_events": sum(subscriber.dropped for subscriber in subscribers),
+        "queued_events": sum(subscriber.queue.qsize() for subscriber in subscribers)
+    }
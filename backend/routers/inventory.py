@@ -1,12 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 from typing import List, Optional
 from datetime import datetime, date
-from backend.database import get_db
+from backend.database import get_db, get_read_db
 from backend.models.inventory import Inventory, InventoryMovement
 from backend.models.product import Product
 from backend.schemas import Inventory as InventorySchema, InventoryCreate, InventoryUpdate, InventoryAdjust
+from backend.services import categories as category_service
+from backend.services import events, replenishment, stock_levels
+from backend.services.stores import get_store_id
 import sys
 import os
 
@@ -15,21 +19,27 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 router = APIRouter()
 
 @router.post("/", response_model=InventorySchema)
-async def create_inventory(inventory: InventoryCreate, db: Session = Depends(get_db)):
+async def create_inventory(
+    inventory: InventoryCreate,
+    store_id: int = Depends(get_store_id),
+    db: Session = Depends(get_db)
+):
     """Criar ou atualizar inventário de um produto"""
     # Verificar se produto existe
     product = db.query(Product).filter(Product.id == inventory.product_id).first()
     if not product:
         raise HTTPException(status_code=404, detail="Produto não encontrado")
     
-    # Verificar se já existe inventário para o produto
+    # Verificar se já existe inventário para o produto nesta loja
     existing_inventory = db.query(Inventory).filter(
-        Inventory.product_id == inventory.product_id
+        Inventory.product_id == inventory.product_id,
+        Inventory.store_id == store_id
     ).first()
     
     if existing_inventory:
         # Atualizar inventário existente
         previous_quantity = existing_inventory.quantity
+        previous_level = existing_inventory.stock_level
         existing_inventory.quantity = inventory.quantity
         existing_inventory.min_stock = inventory.min_stock
         existing_inventory.max_stock = inventory.max_stock
@@ -40,6 +50,7 @@ async def create_inventory(inventory: InventoryCreate, db: Session = Depends(get
         if previous_quantity != inventory.quantity:
             movement = InventoryMovement(
                 product_id=inventory.product_id,
+                store_id=store_id,
                 movement_type="adjustment",
                 quantity=inventory.quantity - previous_quantity,
                 previous_quantity=previous_quantity,
@@ -48,17 +59,27 @@ async def create_inventory(inventory: InventoryCreate, db: Session = Depends(get
             )
             db.add(movement)
         
+        db.flush()
+        category_service.refresh_category_stats(db, [product.category_id])
+        stock_levels.record_transition(
+            db, product.id, store_id, previous_level, inventory.quantity, inventory.min_stock
+        )
         db.commit()
         db.refresh(existing_inventory)
+        events.publish_stock_change(
+            product.id, store_id, previous_quantity, existing_inventory.quantity, existing_inventory.min_stock,
+            previous_level
+        )
         return existing_inventory
     else:
         # Criar novo inventário
-        db_inventory = Inventory(**inventory.dict())
+        db_inventory = Inventory(**inventory.dict(), store_id=store_id)
         db.add(db_inventory)
         
         # Registrar movimento inicial
         movement = InventoryMovement(
             product_id=inventory.product_id,
+            store_id=store_id,
             movement_type="in",
             quantity=inventory.quantity,
             previous_quantity=0,
@@ -67,8 +88,12 @@ async def create_inventory(inventory: InventoryCreate, db: Session = Depends(get
         )
         db.add(movement)
         
+        db.flush()
+        category_service.refresh_category_stats(db, [product.category_id])
+        stock_levels.record_transition(db, product.id, store_id, "ok", inventory.quantity, inventory.min_stock)
         db.commit()
         db.refresh(db_inventory)
+        events.publish_stock_change(product.id, store_id, 0, db_inventory.quantity, db_inventory.min_stock, "ok")
         return db_inventory
 
 @router.get("/", response_model=List[InventorySchema])
@@ -77,15 +102,18 @@ async def list_inventory(
     limit: int = Query(100, ge=1, le=1000),
     low_stock: Optional[bool] = Query(None),
     product_name: Optional[str] = Query(None),
+    store_id: int = Depends(get_store_id),
     db: Session = Depends(get_db)
 ):
     """Listar inventário com filtros opcionais"""
     from sqlalchemy.orm import joinedload
     
-    query = db.query(Inventory).options(joinedload(Inventory.product))
+    query = db.query(Inventory).options(joinedload(Inventory.product)).filter(
+        Inventory.store_id == store_id
+    )
     
     if low_stock:
-        query = query.filter(Inventory.quantity <= Inventory.min_stock)
+        query = query.filter(stock_levels.is_low())
     
     if product_name:
         query = query.join(Product).filter(Product.name.contains(product_name))
@@ -94,9 +122,16 @@ async def list_inventory(
     return inventory
 
 @router.get("/product/{product_id}", response_model=InventorySchema)
-async def get_product_inventory(product_id: int, db: Session = Depends(get_db)):
+async def get_product_inventory(
+    product_id: int,
+    store_id: int = Depends(get_store_id),
+    db: Session = Depends(get_db)
+):
     """Obter inventário de um produto específico"""
-    inventory = db.query(Inventory).filter(Inventory.product_id == product_id).first()
+    inventory = db.query(Inventory).filter(
+        Inventory.product_id == product_id,
+        Inventory.store_id == store_id
+    ).first()
     if not inventory:
         raise HTTPException(status_code=404, detail="Inventário não encontrado para este produto")
     return inventory
@@ -113,14 +148,16 @@ async def update_inventory(
         raise HTTPException(status_code=404, detail="Inventário não encontrado")
     
     update_data = inventory_update.dict(exclude_unset=True)
+    previous_quantity = inventory.quantity
+    previous_level = inventory.stock_level
     
     # Registrar movimento se quantidade mudou
     if "quantity" in update_data and update_data["quantity"] != inventory.quantity:
-        previous_quantity = inventory.quantity
         new_quantity = update_data["quantity"]
         
         movement = InventoryMovement(
             product_id=inventory.product_id,
+            store_id=inventory.store_id,
             movement_type="adjustment",
             quantity=new_quantity - previous_quantity,
             previous_quantity=previous_quantity,
@@ -133,22 +170,39 @@ async def update_inventory(
         setattr(inventory, field, value)
     
     inventory.last_updated = datetime.now()
+    if "quantity" in update_data:
+        db.flush()
+        category_service.refresh_category_stats(db, [inventory.product.category_id])
+    if "quantity" in update_data or "min_stock" in update_data:
+        stock_levels.record_transition(
+            db, inventory.product_id, inventory.store_id, previous_level, inventory.quantity, inventory.min_stock
+        )
     db.commit()
     db.refresh(inventory)
+    if "quantity" in update_data or "min_stock" in update_data:
+        events.publish_stock_change(
+            inventory.product_id, inventory.store_id, previous_quantity, inventory.quantity, inventory.min_stock,
+            previous_level
+        )
     return inventory
 
 @router.post("/adjust/{product_id}")
 async def adjust_inventory(
     product_id: int,
     payload: InventoryAdjust,
+    store_id: int = Depends(get_store_id),
     db: Session = Depends(get_db)
 ):
     """Ajustar quantidade do inventário (define a quantidade final)."""
-    inventory = db.query(Inventory).filter(Inventory.product_id == product_id).first()
+    inventory = db.query(Inventory).filter(
+        Inventory.product_id == product_id,
+        Inventory.store_id == store_id
+    ).first()
     if not inventory:
         raise HTTPException(status_code=404, detail="Inventário não encontrado")
 
     previous_quantity = inventory.quantity
+    previous_level = inventory.stock_level
     new_quantity = payload.quantity
 
     if new_quantity < 0:
@@ -160,6 +214,7 @@ async def adjust_inventory(
     # Registrar movimento (diferença)
     movement = InventoryMovement(
         product_id=product_id,
+        store_id=store_id,
         movement_type="adjustment",
         quantity=new_quantity - previous_quantity,
         previous_quantity=previous_quantity,
@@ -168,7 +223,12 @@ async def adjust_inventory(
     )
     db.add(movement)
 
+    db.flush()
+    category_service.refresh_category_stats(db, [inventory.product.category_id])
+    min_stock = inventory.min_stock
+    stock_levels.record_transition(db, product_id, store_id, previous_level, new_quantity, min_stock)
     db.commit()
+    events.publish_stock_change(product_id, store_id, previous_quantity, new_quantity, min_stock, previous_level)
     return {"message": f"Estoque ajustado de {previous_quantity} para {new_quantity}"}
 
 @router.get("/movements/{product_id}")
@@ -176,10 +236,12 @@ async def get_product_movements(
     product_id: int,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
+    store_id: int = Depends(get_store_id),
     db: Session = Depends(get_db)
 ):
     """Obter movimentações de estoque de um produto"""
     movements = db.query(InventoryMovement).filter(
+        InventoryMovement.store_id == store_id,
         InventoryMovement.product_id == product_id
     ).order_by(InventoryMovement.created_at.desc()).offset(skip).limit(limit).all()
     
@@ -192,45 +254,74 @@ async def get_product_movements(
             "new_quantity": movement.new_quantity,
             "reason": movement.reason,
             "reference_id": movement.reference_id,
+            "terminal_id": movement.terminal_id,
             "created_at": movement.created_at
         }
         for movement in movements
     ]
 
 @router.get("/low-stock")
-async def get_low_stock_products(db: Session = Depends(get_db)):
-    """Listar produtos com estoque baixo"""
-    low_stock = db.query(Inventory).join(Product).filter(
-        Inventory.quantity <= Inventory.min_stock,
+async def get_low_stock_products(
+    store_id: int = Depends(get_store_id),
+    db: Session = Depends(get_db)
+):
+    """Listar produtos com estoque baixo (nível mantido a cada mudança, lido pelo índice)"""
+    low_stock = db.query(
+        Inventory.product_id, Product.name, Inventory.quantity, Inventory.min_stock,
+        Inventory.location, Inventory.stock_level
+    ).join(Product).filter(
+        Inventory.store_id == store_id,
+        stock_levels.is_low(),
         Product.active == True
     ).all()
     
     return [
         {
             "product_id": inv.product_id,
-            "product_name": inv.product.name,
+            "product_name": inv.name,
             "current_quantity": inv.quantity,
             "min_stock": inv.min_stock,
-            "location": inv.location
+            "location": inv.location,
+            "stock_level": inv.stock_level
         }
         for inv in low_stock
     ]
 
+@router.get("/low-stock/events")
+async def get_low_stock_events(
+    after_id: Optional[int] = Query(None),
+    limit: int = Query(100, ge=1, le=1000),
+    store_id: int = Depends(get_store_id),
+    db: Session = Depends(get_db)
+):
+    """Passagens de nível do estoque (ok, low, critical) da loja.
+
+    Com `after_id`, só as posteriores ao último evento já recebido.
+    """
+    return stock_levels.recent_events(db, store_id, after_id, limit)
+
 @router.get("/summary")
-async def get_inventory_summary(db: Session = Depends(get_db)):
+async def get_inventory_summary(
+    store_id: int = Depends(get_store_id),
+    db: Session = Depends(get_read_db)
+):
     """Resumo do inventário"""
     total_products = db.query(Product).filter(Product.active == True).count()
-    total_inventory = db.query(Inventory).count()
+    total_inventory = db.query(Inventory).filter(Inventory.store_id == store_id).count()
     
     # Produtos com estoque baixo
-    low_stock_count = db.query(Inventory).filter(
-        Inventory.quantity <= Inventory.min_stock
-    ).count()
+    low_stock_count = db.query(func.count(Inventory.id)).filter(
+        Inventory.store_id == store_id,
+        stock_levels.is_low()
+    ).scalar()
     
     # Valor total do estoque
     total_value = db.query(
         func.sum(Inventory.quantity * Product.price)
-    ).join(Product).filter(Product.active == True).scalar() or 0
+    ).join(Product).filter(
+        Inventory.store_id == store_id,
+        Product.active == True
+    ).scalar() or 0
     
     return {
         "total_products": total_products,
@@ -238,3 +329,22 @@ async def get_inventory_summary(db: Session = Depends(get_db)):
         "low_stock_count": low_stock_count,
         "total_value": total_value
     }
+
+@router.get("/replenishment")
+async def get_replenishment(
+    only_reorder: bool = Query(True),
+    skip: int = 0,
+    limit: int = Query(100, le=1000),
+    store_id: int = Depends(get_store_id),
+    db: Session = Depends(get_read_db)
+):
+    """Sugestões de reposição da última execução, as de menor cobertura primeiro"""
+    return {
+        "run": replenishment.last_run(db),
+        "suggestions": replenishment.suggestions(db, store_id, only_reorder, skip, limit)
+    }
+
+@router.post("/replenishment/run")
+async def run_replenishment(store_id: int = Depends(get_store_id)):
+    """Recalcular agora as sugestões da loja (a execução noturna recalcula todas)"""
+    return await run_in_threadpool(replenishment.scheduler.run_once, store_id)
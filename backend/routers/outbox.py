@@ -0,0 +1,26 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.orm import Session
+from typing import Optional
+from backend.database import get_db
+from backend.services import outbox
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+router = APIRouter()
+
+@router.get("/stats")
+async def outbox_stats(db: Session = Depends(get_db)):
+    """Profundidade da fila, atraso da mensagem mais antiga e contadores do worker"""
+    return outbox.stats(db)
+
+@router.post("/requeue")
+async def requeue_failed_messages(
+    topic: Optional[str] = Query(None),
+    db: Session = Depends(get_db)
+):
+    """Devolver para a fila as mensagens que esgotaram as tentativas"""
+    requeued = outbox.requeue_failed(db, topic)
+    outbox.worker.notify()
+    return {"requeued": requeued}
@@ -1,11 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, BackgroundTasks
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import case, func
 from typing import List, Optional
 from datetime import datetime, date
-from backend.database import get_db
+from backend.database import get_db, get_read_db
 from backend.models.payment import PaymentMethod, Payment
-from backend.schemas import PaymentMethod as PaymentMethodSchema, PaymentMethodCreate
+from backend.schemas import PaymentMethod as PaymentMethodSchema, PaymentMethodCreate, SplitPaymentCreate
+from backend.services.payment_methods import registry as payment_method_registry
+from backend.services import events, payment_gateway, settlement, shifts
+from backend.services.stores import get_terminal_id
 import sys
 import os
 
@@ -31,6 +34,7 @@ async def create_payment_method(
     db.add(db_payment_method)
     db.commit()
     db.refresh(db_payment_method)
+    payment_method_registry.invalidate()
     return db_payment_method
 
 @router.get("/methods/", response_model=List[PaymentMethodSchema])
@@ -91,6 +95,7 @@ async def update_payment_method(
     
     db.commit()
     db.refresh(method)
+    payment_method_registry.invalidate()
     return method
 
 @router.delete("/methods/{method_id}")
@@ -102,6 +107,7 @@ async def delete_payment_method(method_id: int, db: Session = Depends(get_db)):
     
     method.active = False
     db.commit()
+    payment_method_registry.invalidate()
     return {"message": "Método de pagamento desativado com sucesso"}
 
 @router.post("/process/{sale_id}")
@@ -109,8 +115,10 @@ async def process_payment(
     sale_id: int,
     payment_method_id: int,
     amount: float,
+    background_tasks: BackgroundTasks,
     authorization_code: Optional[str] = None,
     transaction_id: Optional[str] = None,
+    terminal_id: Optional[str] = Depends(get_terminal_id),
     db: Session = Depends(get_db)
 ):
     """Processar pagamento de uma venda"""
@@ -121,21 +129,114 @@ async def process_payment(
     if not sale:
         raise HTTPException(status_code=404, detail="Venda não encontrada")
     
-    # Verificar se método de pagamento existe
-    payment_method = db.query(PaymentMethod).filter(
-        PaymentMethod.id == payment_method_id
-    ).first()
+    # Verificar se método de pagamento existe (cache em memória)
+    payment_method = payment_method_registry.get(db, payment_method_id)
     if not payment_method:
         raise HTTPException(status_code=404, detail="Método de pagamento não encontrado")
     
+    payment = _record_payment(db, sale, payment_method, amount, authorization_code, transaction_id, terminal_id)
+    
+    db.commit()
+    db.refresh(payment)
+    
+    events.publish_payment(db, payment, sale)
+    _schedule_authorization(background_tasks, payment, payment_method)
+    
+    return _payment_result(payment)
+
+@router.post("/process/{sale_id}/split")
+async def process_split_payment(
+    sale_id: int,
+    split: SplitPaymentCreate,
+    background_tasks: BackgroundTasks,
+    terminal_id: Optional[str] = Depends(get_terminal_id),
+    db: Session = Depends(get_db)
+):
+    """Processar vários pagamentos da mesma venda (ex.: dinheiro + cartão)"""
+    from backend.models.sale import Sale
+    
+    sale = db.query(Sale).filter(Sale.id == sale_id).first()
+    if not sale:
+        raise HTTPException(status_code=404, detail="Venda não encontrada")
+    
+    if not split.tenders:
+        raise HTTPException(status_code=400, detail="Informe ao menos um pagamento")
+    
+    methods = []
+    for tender in split.tenders:
+        payment_method = payment_method_registry.get(db, tender.payment_method_id)
+        if not payment_method:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Método de pagamento ID {tender.payment_method_id} não encontrado"
+            )
+        methods.append(payment_method)
+    
+    payments = [
+        _record_payment(
+            db, sale, payment_method, tender.amount,
+            tender.authorization_code, tender.transaction_id, terminal_id
+        )
+        for tender, payment_method in zip(split.tenders, methods)
+    ]
+    
+    # Todos os pagamentos e o saldo da venda na mesma transação
+    db.commit()
+    
+    for payment, payment_method in zip(payments, methods):
+        db.refresh(payment)
+        events.publish_payment(db, payment, sale)
+        _schedule_authorization(background_tasks, payment, payment_method)
+    
+    db.refresh(sale)
+    return {
+        "sale_id": sale.id,
+        "final_amount": sale.final_amount,
+        "paid_amount": sale.paid_amount or 0,
+        "remaining_amount": max(sale.final_amount - (sale.paid_amount or 0), 0),
+        "payment_status": sale.payment_status,
+        "payments": [_payment_result(payment) for payment in payments]
+    }
+
+def _record_payment(
+    db: Session,
+    sale,
+    payment_method,
+    amount: float,
+    authorization_code: Optional[str],
+    transaction_id: Optional[str],
+    terminal_id: Optional[str] = None
+) -> Payment:
+    """Registrar um pagamento e, se aprovado, somá-lo ao saldo da venda"""
+    if amount <= 0:
+        raise HTTPException(status_code=400, detail="Valor do pagamento deve ser positivo")
+    
+    if sale.payment_status == "cancelled":
+        raise HTTPException(status_code=400, detail="Venda cancelada não aceita pagamentos")
+    
     # Calcular taxa se aplicável
-    fee_amount = (amount * payment_method.fee_percentage) / 100
+    fee_amount = payment_method.fee_for(amount)
     net_amount = amount - fee_amount
     
+    # Métodos com aprovação são autorizados no adquirente após a resposta;
+    # o transaction_id identifica a transação nas novas tentativas
+    if payment_method.requires_approval and not transaction_id:
+        transaction_id = payment_gateway.new_transaction_id()
+    
+    # Caixa aberto no terminal que recebe o pagamento
+    terminal_id = terminal_id or sale.terminal_id
+    try:
+        shift_id = shifts.shift_for_sale(db, sale.store_id, terminal_id)
+    except shifts.ShiftError as exc:
+        raise HTTPException(status_code=exc.status_code, detail=exc.detail)
+    
     # Criar pagamento
     payment = Payment(
-        sale_id=sale_id,
-        payment_method_id=payment_method_id,
+        sale_id=sale.id,
+        payment_method_id=payment_method.id,
+        store_id=sale.store_id,
+        terminal_id=terminal_id,
+        shift_id=shift_id,
         amount=amount,
         fee_amount=fee_amount,
         net_amount=net_amount,
@@ -144,23 +245,62 @@ async def process_payment(
         status="approved" if not payment_method.requires_approval else "pending"
     )
     
+    if payment.status == "approved":
+        payment.processed_at = datetime.now()
+    else:
+        # Marca para a varredura retomar se a autorização não terminar
+        payment.attempted_at = datetime.now()
+    
     db.add(payment)
     
-    # Atualizar status da venda se pagamento aprovado
+    # Atualizar saldo e status da venda se pagamento aprovado
     if payment.status == "approved":
-        sale.payment_status = "paid"
-    
-    db.commit()
-    db.refresh(payment)
+        settlement.register_approved_payment(db, sale.id, amount)
+        shifts.record_payments(db, [(shift_id, payment_method.id, amount, False)])
     
+    return payment
+
+def _schedule_authorization(background_tasks: BackgroundTasks, payment: Payment, payment_method):
+    if payment.status != "pending":
+        return
+    background_tasks.add_task(
+        payment_gateway.authorize_payment,
+        payment.id,
+        payment_gateway.AuthorizationRequest(
+            transaction_id=payment.transaction_id,
+            amount=payment.amount,
+            method_type=payment_method.type,
+            sale_id=payment.sale_id
+        )
+    )
+
+def _payment_result(payment: Payment) -> dict:
     return {
         "payment_id": payment.id,
         "status": payment.status,
+        "transaction_id": payment.transaction_id,
         "amount": payment.amount,
         "net_amount": payment.net_amount,
         "fee_amount": payment.fee_amount
     }
 
+@router.get("/reconciliation")
+async def reconciliation_report(
+    start_date: Optional[date] = Query(None),
+    end_date: Optional[date] = Query(None),
+    only_mismatched: bool = Query(True),
+    limit: Optional[int] = Query(None, ge=1, le=100000),
+    db: Session = Depends(get_read_db)
+):
+    """Conciliação: vendas pagas a menos ou a mais em relação aos pagamentos aprovados"""
+    return settlement.reconcile(
+        db,
+        start_date=start_date,
+        end_date=end_date,
+        only_mismatched=only_mismatched,
+        limit=limit
+    )
+
 @router.get("/transactions/", response_model=List[dict])
 async def list_payments(
     skip: int = Query(0, ge=0),
@@ -196,7 +336,7 @@ async def list_payments(
         {
             "id": payment.id,
             "sale_id": payment.sale_id,
-            "payment_method": payment.payment_method.name,
+            "payment_method": payment_method_registry.name_of(db, payment.payment_method_id),
             "amount": payment.amount,
             "fee_amount": payment.fee_amount,
             "net_amount": payment.net_amount,
@@ -209,14 +349,50 @@ async def list_payments(
         for payment in payments
     ]
 
+@router.get("/transactions/{payment_id}")
+async def get_payment(payment_id: int, db: Session = Depends(get_db)):
+    """Consultar uma transação (ex.: acompanhar a autorização de um pagamento pendente)"""
+    payment = db.query(Payment).filter(Payment.id == payment_id).first()
+    if not payment:
+        raise HTTPException(status_code=404, detail="Pagamento não encontrado")
+    
+    return {
+        "id": payment.id,
+        "sale_id": payment.sale_id,
+        "payment_method": payment_method_registry.name_of(db, payment.payment_method_id),
+        "amount": payment.amount,
+        "fee_amount": payment.fee_amount,
+        "net_amount": payment.net_amount,
+        "status": payment.status,
+        "decline_reason": payment.decline_reason,
+        "authorization_code": payment.authorization_code,
+        "transaction_id": payment.transaction_id,
+        "created_at": payment.created_at,
+        "processed_at": payment.processed_at
+    }
+
 @router.get("/summary")
 async def get_payments_summary(
     start_date: Optional[date] = Query(None),
     end_date: Optional[date] = Query(None),
-    db: Session = Depends(get_db)
+    store_id: Optional[int] = Query(None),
+    db: Session = Depends(get_read_db)
 ):
-    """Resumo de pagamentos por método"""
-    query = db.query(Payment).join(PaymentMethod)
+    """Resumo de pagamentos por método.
+
+    `total_amount` é o recebido (pagamentos aprovados); `refunded_amount`,
+    o estornado em devoluções e cancelamentos; `net_amount` desconta as
+    taxas e os estornos.
+    """
+    approved = Payment.status == "approved"
+    query = db.query(
+        Payment.payment_method_id,
+        func.count(case((approved, Payment.id))).label("count"),
+        func.sum(case((approved, Payment.amount), else_=0)).label("total_amount"),
+        func.sum(case((approved, Payment.fee_amount), else_=0)).label("total_fees"),
+        func.sum(case((approved, Payment.net_amount), else_=0)).label("net_amount"),
+        func.sum(case((Payment.status == "refunded", Payment.amount), else_=0)).label("refunded_amount")
+    )
     
     if start_date:
         query = query.filter(func.date(Payment.created_at) >= start_date)
@@ -224,30 +400,41 @@ async def get_payments_summary(
     if end_date:
         query = query.filter(func.date(Payment.created_at) <= end_date)
     
-    payments = query.filter(Payment.status == "approved").all()
+    if store_id is not None:
+        query = query.filter(Payment.store_id == store_id)
+    
+    rows = query.filter(
+        Payment.status.in_(("approved", "refunded"))
+    ).group_by(Payment.payment_method_id).all()
     
     summary = {}
     total_amount = 0
     total_fees = 0
+    total_refunded = 0
+    total_transactions = 0
     
-    for payment in payments:
-        method_name = payment.payment_method.name
+    for row in rows:
+        method_name = payment_method_registry.name_of(db, row.payment_method_id) or str(row.payment_method_id)
         
         if method_name not in summary:
             summary[method_name] = {
                 "count": 0,
                 "total_amount": 0,
                 "total_fees": 0,
+                "refunded_amount": 0,
                 "net_amount": 0
             }
         
-        summary[method_name]["count"] += 1
-        summary[method_name]["total_amount"] += payment.amount
-        summary[method_name]["total_fees"] += payment.fee_amount
-        summary[method_name]["net_amount"] += payment.net_amount
+        summary[method_name]["count"] += row.count
+        summary[method_name]["total_amount"] += row.total_amount or 0
+        summary[method_name]["total_fees"] += row.total_fees or 0
+        summary[method_name]["refunded_amount"] += row.refunded_amount or 0
+        summary[method_name]["net_amount"] += (row.net_amount or 0) - (row.refunded_amount or 0)
         
-        total_amount += payment.amount
-        total_fees += payment.fee_amount
+        total_amount += row.total_amount or 0
+        total_fees += row.total_fees or 0
+        total_refunded += row.refunded_amount or 0
+        total_transactions += row.count
     
     return {
         "period": {
@@ -258,7 +445,8 @@ async def get_payments_summary(
         "totals": {
             "total_amount": total_amount,
             "total_fees": total_fees,
-            "net_amount": total_amount - total_fees,
-            "total_transactions": len(payments)
+            "refunded_amount": total_refunded,
+            "net_amount": total_amount - total_fees - total_refunded,
+            "total_transactions": total_transactions
         }
     }
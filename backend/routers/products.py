@@ -1,9 +1,15 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 from typing import List, Optional
-from backend.database import get_db
+from datetime import datetime
+from backend.database import get_db, get_read_db
 from backend.models.product import Product, Category
+from backend.models.inventory import Inventory
 from backend.schemas import Product as ProductSchema, ProductCreate, ProductUpdate
+from backend.services import categories as category_service
+from backend.services import pricing
+from backend.services.payment_methods import registry as payment_method_registry
+from backend.services.stores import get_store_id
 import sys
 import os
 
@@ -16,9 +22,13 @@ router = APIRouter()
 async def create_product(product: ProductCreate, db: Session = Depends(get_db)):
     """Criar um novo produto"""
     db_product = Product(**product.dict())
+    _link_category(db, db_product, product.category, product.category_id)
     db.add(db_product)
+    db.flush()
+    category_service.refresh_category_stats(db, [db_product.category_id])
     db.commit()
     db.refresh(db_product)
+    pricing.engine.invalidate()
     return db_product
 
 @router.get("/", response_model=List[ProductSchema])
@@ -27,6 +37,7 @@ async def list_products(
     limit: int = Query(100, ge=1, le=1000),
     search: Optional[str] = Query(None),
     category: Optional[str] = Query(None),
+    category_id: Optional[int] = Query(None),
     active: Optional[bool] = Query(None),
     db: Session = Depends(get_db)
 ):
@@ -39,8 +50,14 @@ async def list_products(
             Product.barcode.contains(search)
         )
     
-    if category:
-        query = query.filter(Product.category == category)
+    # Filtro por categoria sempre pelo id indexado
+    if category and category_id is None:
+        category_id = category_service.category_id_for_name(db, category)
+        if category_id is None:
+            return []
+    
+    if category_id is not None:
+        query = query.filter(Product.category_id == category_id)
     
     if active is not None:
         query = query.filter(Product.active == active)
@@ -68,11 +85,21 @@ async def update_product(
         raise HTTPException(status_code=404, detail="Produto não encontrado")
     
     update_data = product_update.dict(exclude_unset=True)
+    previous_category_id = product.category_id
     for field, value in update_data.items():
         setattr(product, field, value)
     
+    if "category" in update_data or "category_id" in update_data:
+        _link_category(db, product, update_data.get("category"), update_data.get("category_id"))
+    
+    # Preço, status e categoria alteram os agregados da categoria
+    if update_data.keys() & {"price", "active", "category", "category_id"}:
+        db.flush()
+        category_service.refresh_category_stats(db, [previous_category_id, product.category_id])
+    
     db.commit()
     db.refresh(product)
+    pricing.engine.invalidate()
     return product
 
 @router.delete("/{product_id}")
@@ -83,7 +110,10 @@ async def delete_product(product_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Produto não encontrado")
     
     product.active = False
+    db.flush()
+    category_service.refresh_category_stats(db, [product.category_id])
     db.commit()
+    pricing.engine.invalidate()
     return {"message": "Produto desativado com sucesso"}
 
 @router.get("/barcode/{barcode}", response_model=ProductSchema)
@@ -97,8 +127,82 @@ async def get_product_by_barcode(barcode: str, db: Session = Depends(get_db)):
 @router.get("/categories/list")
 async def list_categories(db: Session = Depends(get_db)):
     """Listar todas as categorias"""
-    categories = db.query(Product.category).filter(
-        Product.category.isnot(None),
-        Product.active == True
-    ).distinct().all()
-    return [cat[0] for cat in categories]
+    return [
+        category["name"]
+        for category in category_service.get_category_summary(db)
+        if category["product_count"] > 0
+    ]
+
+@router.get("/categories/summary")
+async def list_categories_summary(
+    include_inactive: bool = Query(False),
+    db: Session = Depends(get_db)
+):
+    """Listar categorias com contagem de produtos, valor em estoque e vendas"""
+    return category_service.get_category_summary(db, include_inactive=include_inactive)
+
+@router.get("/catalog/snapshot")
+async def get_catalog_snapshot(
+    store_id: int = Depends(get_store_id),
+    db: Session = Depends(get_read_db)
+):
+    """Catálogo completo para o modo offline do terminal.
+
+    Produtos ativos com código de barras, preço e saldo na loja, e os
+    métodos de pagamento ativos, em uma única leitura.
+    """
+    rows = db.query(
+        Product.id,
+        Product.name,
+        Product.barcode,
+        Product.price,
+        Product.category_id,
+        Inventory.quantity
+    ).outerjoin(
+        Inventory,
+        (Inventory.product_id == Product.id) & (Inventory.store_id == store_id)
+    ).filter(Product.active == True).all()
+    
+    return {
+        "generated_at": datetime.now().isoformat(),
+        "store_id": store_id,
+        "products": [
+            {
+                "id": row.id,
+                "name": row.name,
+                "barcode": row.barcode,
+                "price": row.price,
+                "category_id": row.category_id,
+                "quantity": row.quantity
+            }
+            for row in rows
+        ],
+        "payment_methods": [
+            {
+                "id": method.id,
+                "name": method.name,
+                "type": method.type,
+                "requires_approval": method.requires_approval
+            }
+            for method in payment_method_registry.all(db)
+            if method.active
+        ]
+    }
+
+def _link_category(
+    db: Session,
+    product: Product,
+    name: Optional[str],
+    category_id: Optional[int]
+):
+    """Vincular o produto à categoria por id, mantendo o nome desnormalizado"""
+    if category_id is None and not name:
+        product.category = None
+        product.category_id = None
+        return
+
+    category = category_service.resolve_category(db, name=name, category_id=category_id)
+    if not category:
+        raise HTTPException(status_code=404, detail="Categoria não encontrada")
+    product.category = category.name
+    product.category_id = category.id
@@ -0,0 +1,122 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+from typing import List, Optional
+from backend.database import get_db
+from backend.models.promotion import Promotion
+from backend.schemas import Promotion as PromotionSchema, PromotionCreate, PromotionUpdate, PriceQuoteRequest
+from backend.services import pricing
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+router = APIRouter()
+
+def _validate(promotion: Promotion):
+    if promotion.product_id is not None and promotion.category_id is not None:
+        raise HTTPException(status_code=400, detail="Informe produto ou categoria, não os dois")
+    if promotion.type == "percentage" and (promotion.value or 0) > 100:
+        raise HTTPException(status_code=400, detail="Percentual de desconto acima de 100%")
+    if promotion.type == "buy_x_get_y" and not (promotion.buy_quantity and promotion.get_quantity):
+        raise HTTPException(status_code=400, detail="Leve X, ganhe Y exige buy_quantity e get_quantity")
+    if promotion.type in ("percentage", "fixed") and not promotion.value:
+        raise HTTPException(status_code=400, detail="Informe o valor do desconto")
+    if promotion.starts_at and promotion.ends_at and promotion.ends_at <= promotion.starts_at:
+        raise HTTPException(status_code=400, detail="Fim da vigência deve ser depois do início")
+
+@router.post("/", response_model=PromotionSchema)
+async def create_promotion(promotion: PromotionCreate, db: Session = Depends(get_db)):
+    """Criar uma promoção"""
+    db_promotion = Promotion(**promotion.model_dump())
+    _validate(db_promotion)
+    db.add(db_promotion)
+    db.commit()
+    db.refresh(db_promotion)
+    pricing.engine.invalidate()
+    return db_promotion
+
+@router.get("/", response_model=List[PromotionSchema])
+async def list_promotions(
+    active: Optional[bool] = Query(None),
+    product_id: Optional[int] = Query(None),
+    category_id: Optional[int] = Query(None),
+    customer_id: Optional[int] = Query(None),
+    db: Session = Depends(get_db)
+):
+    """Listar promoções com filtros opcionais"""
+    query = db.query(Promotion)
+    if active is not None:
+        query = query.filter(Promotion.active == active)
+    if product_id is not None:
+        query = query.filter(Promotion.product_id == product_id)
+    if category_id is not None:
+        query = query.filter(Promotion.category_id == category_id)
+    if customer_id is not None:
+        query = query.filter(Promotion.customer_id == customer_id)
+    return query.order_by(Promotion.id).all()
+
+@router.get("/{promotion_id}", response_model=PromotionSchema)
+async def get_promotion(promotion_id: int, db: Session = Depends(get_db)):
+    """Obter uma promoção específica"""
+    promotion = db.query(Promotion).filter(Promotion.id == promotion_id).first()
+    if not promotion:
+        raise HTTPException(status_code=404, detail="Promoção não encontrada")
+    return promotion
+
+@router.put("/{promotion_id}", response_model=PromotionSchema)
+async def update_promotion(
+    promotion_id: int,
+    promotion_update: PromotionUpdate,
+    db: Session = Depends(get_db)
+):
+    """Atualizar uma promoção"""
+    promotion = db.query(Promotion).filter(Promotion.id == promotion_id).first()
+    if not promotion:
+        raise HTTPException(status_code=404, detail="Promoção não encontrada")
+
+    for field, value in promotion_update.model_dump(exclude_unset=True).items():
+        setattr(promotion, field, value)
+    _validate(promotion)
+
+    db.commit()
+    db.refresh(promotion)
+    pricing.engine.invalidate()
+    return promotion
+
+@router.delete("/{promotion_id}")
+async def delete_promotion(promotion_id: int, db: Session = Depends(get_db)):
+    """Desativar uma promoção"""
+    promotion = db.query(Promotion).filter(Promotion.id == promotion_id).first()
+    if not promotion:
+        raise HTTPException(status_code=404, detail="Promoção não encontrada")
+
+    promotion.active = False
+    db.commit()
+    pricing.engine.invalidate()
+    return {"message": "Promoção desativada com sucesso"}
+
+@router.post("/quote")
+async def quote_prices(quote: PriceQuoteRequest, db: Session = Depends(get_db)):
+    """Preço do carrinho com as promoções vigentes, sem gravar venda"""
+    try:
+        lines = pricing.engine.price_items(db, quote.items, quote.customer_id)
+    except pricing.PriceError as exc:
+        raise HTTPException(status_code=400, detail=exc.detail)
+
+    return {
+        "items": [
+            {
+                "product_id": line.product.id,
+                "product_name": line.product.name,
+                "quantity": line.quantity,
+                "unit_price": line.unit_price,
+                "discount_amount": line.discount_amount,
+                "total_price": line.total_price,
+                "promotion_id": line.promotion_id
+            }
+            for line in lines
+        ],
+        "subtotal": round(sum(line.unit_price * line.quantity for line in lines), 2),
+        "discount": round(sum(line.discount_amount for line in lines), 2),
+        "total": round(sum(line.total_price for line in lines), 2)
+    }
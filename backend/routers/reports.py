@@ -4,12 +4,16 @@ from sqlalchemy.orm import Session
 from sqlalchemy import func, desc, and_
 from typing import List, Optional
 from datetime import datetime, date, timedelta
-from backend.database import get_db
+from backend.database import get_read_db
 from backend.models.sale import Sale, SaleItem
 from backend.models.product import Product
 from backend.models.customer import Customer
 from backend.models.inventory import Inventory
 from backend.models.payment import Payment, PaymentMethod
+from backend.models.store import Store
+from backend.services import stock_levels
+from backend.services.settlement import date_range_filter
+from backend.services.stores import store_router
 import io
 import csv
 import sys
@@ -24,11 +28,15 @@ async def sales_report(
     start_date: Optional[date] = Query(None),
     end_date: Optional[date] = Query(None),
     format: str = Query("json", regex="^(json|csv)$"),
-    db: Session = Depends(get_db)
+    store_id: Optional[int] = Query(None),
+    db: Session = Depends(get_read_db)
 ):
     """Relatório de vendas"""
     query = db.query(Sale)
     
+    if store_id is not None:
+        query = query.filter(Sale.store_id == store_id)
+    
     if start_date:
         query = query.filter(func.date(Sale.created_at) >= start_date)
     else:
@@ -103,7 +111,8 @@ async def top_selling_products(
     start_date: Optional[date] = Query(None),
     end_date: Optional[date] = Query(None),
     limit: int = Query(10, ge=1, le=100),
-    db: Session = Depends(get_db)
+    category_id: Optional[int] = Query(None),
+    db: Session = Depends(get_read_db)
 ):
     """Produtos mais vendidos"""
     query = db.query(
@@ -123,6 +132,9 @@ async def top_selling_products(
     if end_date:
         query = query.filter(func.date(Sale.created_at) <= end_date)
     
+    if category_id is not None:
+        query = query.filter(Product.category_id == category_id)
+    
     query = query.group_by(Product.id, Product.name, Product.price)\
                 .order_by(desc("total_quantity"))\
                 .limit(limit)
@@ -141,22 +153,29 @@ async def top_selling_products(
     ]
 
 @router.get("/inventory/low-stock")
-async def low_stock_report(db: Session = Depends(get_db)):
+async def low_stock_report(
+    store_id: Optional[int] = Query(None),
+    db: Session = Depends(get_read_db)
+):
     """Relatório de produtos com estoque baixo"""
-    low_stock = db.query(Inventory).join(Product).filter(
-        Inventory.quantity <= Inventory.min_stock,
+    query = db.query(Inventory).join(Product).filter(
+        stock_levels.is_low(),
         Product.active == True
-    ).all()
+    )
+    if store_id is not None:
+        query = query.filter(Inventory.store_id == store_id)
+    low_stock = query.all()
     
     return [
         {
             "product_id": inv.product_id,
             "product_name": inv.product.name,
+            "store_id": inv.store_id,
             "current_quantity": inv.quantity,
             "min_stock": inv.min_stock,
             "max_stock": inv.max_stock,
             "location": inv.location,
-            "status": "CRÍTICO" if inv.quantity == 0 else "BAIXO"
+            "status": "CRÍTICO" if inv.stock_level == "critical" else "BAIXO"
         }
         for inv in low_stock
     ]
@@ -164,14 +183,18 @@ async def low_stock_report(db: Session = Depends(get_db)):
 @router.get("/financial/daily")
 async def daily_financial_report(
     report_date: Optional[date] = Query(None),
-    db: Session = Depends(get_db)
+    store_id: Optional[int] = Query(None),
+    db: Session = Depends(get_read_db)
 ):
     """Relatório financeiro diário"""
     if not report_date:
         report_date = date.today()
     
     # Vendas do dia
-    sales_today = db.query(Sale).filter(func.date(Sale.created_at) == report_date).all()
+    query = db.query(Sale).filter(func.date(Sale.created_at) == report_date)
+    if store_id is not None:
+        query = query.filter(Sale.store_id == store_id)
+    sales_today = query.all()
     
     total_sales = len(sales_today)
     total_revenue = sum(sale.final_amount for sale in sales_today)
@@ -212,7 +235,7 @@ async def top_customers(
     start_date: Optional[date] = Query(None),
     end_date: Optional[date] = Query(None),
     limit: int = Query(10, ge=1, le=100),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Clientes que mais compram"""
     query = db.query(
@@ -250,27 +273,34 @@ async def top_customers(
     ]
 
 @router.get("/dashboard/summary")
-async def dashboard_summary(db: Session = Depends(get_db)):
+async def dashboard_summary(
+    store_id: Optional[int] = Query(None),
+    db: Session = Depends(get_read_db)
+):
     """Resumo para dashboard"""
     today = date.today()
+    store_sales = (Sale.store_id == store_id) if store_id is not None else True
     
     # Vendas de hoje
-    sales_today = db.query(Sale).filter(func.date(Sale.created_at) == today).count()
+    sales_today = db.query(Sale).filter(func.date(Sale.created_at) == today, store_sales).count()
     revenue_today = db.query(func.sum(Sale.final_amount)).filter(
-        func.date(Sale.created_at) == today
+        func.date(Sale.created_at) == today,
+        store_sales
     ).scalar() or 0
     
     # Vendas do mês
     month_start = today.replace(day=1)
-    sales_month = db.query(Sale).filter(Sale.created_at >= month_start).count()
+    sales_month = db.query(Sale).filter(Sale.created_at >= month_start, store_sales).count()
     revenue_month = db.query(func.sum(Sale.final_amount)).filter(
-        Sale.created_at >= month_start
+        Sale.created_at >= month_start,
+        store_sales
     ).scalar() or 0
     
     # Produtos com estoque baixo
-    low_stock_count = db.query(Inventory).filter(
-        Inventory.quantity <= Inventory.min_stock
-    ).count()
+    low_stock_query = db.query(func.count(Inventory.id)).filter(stock_levels.is_low())
+    if store_id is not None:
+        low_stock_query = low_stock_query.filter(Inventory.store_id == store_id)
+    low_stock_count = low_stock_query.scalar()
     
     # Total de produtos ativos
     total_products = db.query(Product).filter(Product.active == True).count()
@@ -295,3 +325,70 @@ async def dashboard_summary(db: Session = Depends(get_db)):
             "total_active": total_customers
         }
     }
+
+@router.get("/stores/summary")
+async def stores_summary(
+    start_date: Optional[date] = Query(None),
+    end_date: Optional[date] = Query(None),
+    db: Session = Depends(get_read_db)
+):
+    """Vendas por loja e total da rede.
+
+    Com um banco por loja (PDV_STORE_DATABASES) a consulta roda em cada
+    banco e os resultados são somados; com banco único, é um GROUP BY
+    store_id.
+    """
+    if not start_date and not end_date:
+        start_date = date.today() - timedelta(days=30)
+    period = date_range_filter(Sale.created_at, start_date, end_date)
+    
+    def store_totals(session: Session, only_store: Optional[int] = None):
+        query = session.query(
+            Sale.store_id,
+            func.count(Sale.id).label("sales"),
+            func.sum(Sale.final_amount).label("revenue"),
+            func.sum(Sale.discount_amount).label("discounts")
+        ).filter(period)
+        if only_store is not None:
+            query = query.filter(Sale.store_id == only_store)
+        return {
+            row.store_id: {
+                "sales": row.sales,
+                "revenue": row.revenue or 0,
+                "discounts": row.discounts or 0
+            }
+            for row in query.group_by(Sale.store_id).all()
+        }
+    
+    if store_router.partitioned:
+        per_store = {}
+        for store_id, result in store_router.fan_out(store_totals).items():
+            per_store[store_id] = result.get(store_id, {"sales": 0, "revenue": 0, "discounts": 0})
+    else:
+        per_store = store_totals(db)
+    
+    names = dict(db.query(Store.id, Store.name).all())
+    stores = [
+        {
+            "store_id": store_id,
+            "store_name": names.get(store_id),
+            **totals,
+            "average_sale": totals["revenue"] / totals["sales"] if totals["sales"] else 0
+        }
+        for store_id, totals in sorted(per_store.items(), key=lambda item: (item[0] is None, item[0]))
+    ]
+    total_sales = sum(store["sales"] for store in stores)
+    total_revenue = sum(store["revenue"] for store in stores)
+    
+    return {
+        "period": {
+            "start_date": start_date.strftime("%d/%m/%Y") if start_date else None,
+            "end_date": end_date.strftime("%d/%m/%Y") if end_date else None
+        },
+        "stores": stores,
+        "totals": {
+            "sales": total_sales,
+            "revenue": total_revenue,
+            "average_sale": total_revenue / total_sales if total_sales else 0
+        }
+    }
@@ -0,0 +1,71 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from typing import List
+from backend.database import get_db
+from backend.schemas import ReservationCreate, StockReservation as StockReservationSchema
+from backend.services import reservations
+from backend.services.stock import InsufficientStock
+from backend.services.stores import get_store_id
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+router = APIRouter()
+
+@router.post("/", response_model=List[StockReservationSchema])
+async def reserve_order(
+    reservation: ReservationCreate,
+    store_id: int = Depends(get_store_id),
+    db: Session = Depends(get_db)
+):
+    """Reservar o estoque de um pedido online.
+
+    Define a quantidade reservada de cada item (0 libera o item) e renova o
+    prazo de todo o pedido. Tudo ou nada: faltando saldo para um item,
+    nenhuma reserva é alterada. A venda do pedido consome as reservas com o
+    header Reservation-Key igual ao order_id.
+    """
+    try:
+        active = reservations.reserve(
+            db, "order", reservation.order_id, store_id,
+            [(item.product_id, item.quantity) for item in reservation.items],
+            reservation.ttl_seconds
+        )
+    except InsufficientStock as exc:
+        db.rollback()
+        raise HTTPException(
+            status_code=409,
+            detail=f"Estoque insuficiente para o produto ID {exc.product_id}. Disponível: {exc.available}"
+        )
+    db.commit()
+    return active
+
+@router.get("/stats")
+async def reservation_stats(db: Session = Depends(get_db)):
+    """Reservas ativas por tipo, vencidas à espera da varredura e métricas"""
+    return reservations.stats(db)
+
+@router.get("/availability/{product_id}")
+async def get_availability(
+    product_id: int,
+    store_id: int = Depends(get_store_id),
+    db: Session = Depends(get_db)
+):
+    """Em mãos, reservado e disponível do produto na loja"""
+    availability = reservations.availability(db, product_id, store_id)
+    if availability is None:
+        raise HTTPException(status_code=404, detail="Estoque não encontrado para este produto")
+    return availability
+
+@router.get("/{order_id}", response_model=List[StockReservationSchema])
+async def get_order_reservations(order_id: str, db: Session = Depends(get_db)):
+    """Reservas ativas de um pedido online"""
+    return reservations.active(db, "order", order_id)
+
+@router.delete("/{order_id}")
+async def release_order(order_id: str, db: Session = Depends(get_db)):
+    """Liberar as reservas de um pedido online (cancelado ou abandonado)"""
+    released = reservations.release(db, "order", order_id)
+    db.commit()
+    return {"released": released}
@@ -1,92 +1,225 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import JSONResponse, Response
 from sqlalchemy.orm import Session
 from sqlalchemy import func
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from datetime import datetime, date
 from backend.database import get_db
 from backend.models.sale import Sale, SaleItem
-from backend.models.product import Product
+from backend.models.customer import Customer
 from backend.models.inventory import Inventory, InventoryMovement
-from backend.schemas import Sale as SaleSchema, SaleCreate, SaleUpdate, SaleItem as SaleItemSchema
+from backend.models.nfce import NfceDocument
+from backend.schemas import (
+    Sale as SaleSchema, SaleCreate, SaleUpdate, SaleItem as SaleItemSchema, SaleSyncBatch, BulkSaleBatch,
+    SaleCancel, SaleCancelBatch, SaleReturnCreate
+)
+from backend.services import events, idempotency, nfce, outbox, pricing, receipts, reservations, returns, sale_batches, sale_effects, shifts, stock, stock_levels
+from backend.services.settlement import TOLERANCE
+from backend.services.stores import get_store_id, get_terminal_id
 import sys
 import os
+import zlib
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 
 router = APIRouter()
 
+IDEMPOTENCY_SCOPE = "sales.create"
+
 @router.post("/", response_model=SaleSchema)
-async def create_sale(sale_data: SaleCreate, db: Session = Depends(get_db)):
-    """Criar uma nova venda"""
+async def create_sale(
+    sale_data: SaleCreate,
+    store_id: int = Depends(get_store_id),
+    terminal_id: Optional[str] = Depends(get_terminal_id),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=64),
+    reservation_key: Optional[str] = Header(None, alias="Reservation-Key", max_length=64),
+    db: Session = Depends(get_db)
+):
+    """Criar uma nova venda.
+
+    Com o header Idempotency-Key, repetições da requisição (ex.: reenvio
+    após timeout) devolvem a venda já criada, sem gravar de novo nem baixar
+    o estoque outra vez. Com Reservation-Key, a venda consome o estoque
+    reservado para o pedido online (POST /api/reservations).
+    """
+    reservation_owner = ("order", reservation_key) if reservation_key else None
+    if not idempotency_key:
+        return _create_sale(db, sale_data, store_id, terminal_id, reservation_owner=reservation_owner)
+    
+    fingerprint = idempotency.request_hash(sale_data.model_dump(mode="json"), store_id, terminal_id)
+    stored = idempotency.lookup(db, IDEMPOTENCY_SCOPE, idempotency_key, fingerprint)
+    if stored is not None:
+        if stored.body is None:
+            # A venda foi gravada, mas a resposta não: remontar pela venda
+            sale = db.query(Sale).filter(Sale.id == stored.resource_id).first()
+            stored = idempotency.complete(
+                db, IDEMPOTENCY_SCOPE, idempotency_key, fingerprint, 200, _sale_body(sale), sale.id
+            )
+        return JSONResponse(stored.body, status_code=stored.status_code, headers={"Idempotent-Replayed": "true"})
+    
+    # Venda já recebida pela sincronização offline com o mesmo id
+    existing = db.query(Sale).filter(Sale.client_id == idempotency_key).first()
+    if existing:
+        return JSONResponse(_sale_body(existing), headers={"Idempotent-Replayed": "true"})
+    
+    lease = idempotency.claim(db, IDEMPOTENCY_SCOPE, idempotency_key, fingerprint)
+    try:
+        sale = _create_sale(db, sale_data, store_id, terminal_id, idempotency_key, reservation_owner, lease)
+    except Exception:
+        idempotency.release(db, IDEMPOTENCY_SCOPE, idempotency_key, lease)
+        raise
+    
+    body = _sale_body(sale)
+    idempotency.complete(db, IDEMPOTENCY_SCOPE, idempotency_key, fingerprint, 200, body, sale.id)
+    return JSONResponse(body)
+
+def _sale_body(sale: Sale) -> dict:
+    return SaleSchema.model_validate(sale).model_dump(mode="json")
+
+def _create_sale(
+    db: Session,
+    sale_data: SaleCreate,
+    store_id: int,
+    terminal_id: Optional[str],
+    idempotency_key: Optional[str] = None,
+    reservation_owner: Optional[Tuple[str, str]] = None,
+    idempotency_lease: Optional[datetime] = None
+) -> Sale:
+    """Gravar a venda, os itens e a baixa de estoque em uma transação.
+
+    `reservation_owner` (tipo, id) é o carrinho ou pedido cujas reservas de
+    estoque a venda consome. `idempotency_lease` é a reserva da
+    Idempotency-Key, vinculada à venda na mesma transação.
+    """
+    # Com foreign_keys ativo, cliente inexistente falharia só no commit
+    customer = None
+    if sale_data.customer_id is not None:
+        customer = db.query(Customer.id, Customer.name).filter(Customer.id == sale_data.customer_id).first()
+        if not customer:
+            raise HTTPException(status_code=400, detail="Cliente não encontrado")
+    
     # Calcular total dos itens
     total_amount = 0
     items_data = []
+    category_lines = []
+    receipt_lines = []
+    min_stock = {}
     
-    for item in sale_data.items:
-        # Verificar se produto existe e está ativo
-        product = db.query(Product).filter(
-            Product.id == item.product_id,
-            Product.active == True
-        ).first()
-        
-        if not product:
+    # Caixa aberto no terminal, que soma a venda aos seus totais
+    try:
+        shift_id = shifts.shift_for_sale(db, store_id, terminal_id)
+    except shifts.ShiftError as exc:
+        raise HTTPException(status_code=exc.status_code, detail=exc.detail)
+    
+    # Unidades já reservadas para esta venda contam como disponíveis
+    held = reservations.held(db, *reservation_owner, store_id) if reservation_owner else {}
+    
+    # Preço do cadastro e promoções vigentes, calculados no servidor
+    try:
+        lines = pricing.engine.price_items(db, sale_data.items, sale_data.customer_id)
+    except pricing.PriceError as exc:
+        raise HTTPException(status_code=400, detail=exc.detail)
+    
+    for item, line in zip(sale_data.items, lines):
+        product = line.product
+        if abs(item.unit_price - line.unit_price) > TOLERANCE:
             raise HTTPException(
-                status_code=400, 
-                detail=f"Produto ID {item.product_id} não encontrado ou inativo"
+                status_code=409,
+                detail=f"Preço do produto {product.name} mudou: R$ {line.unit_price:.2f} (enviado R$ {item.unit_price:.2f})"
             )
         
-        # Verificar estoque disponível
-        inventory = db.query(Inventory).filter(Inventory.product_id == item.product_id).first()
-        if inventory and inventory.quantity < item.quantity:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Estoque insuficiente para o produto {product.name}. Disponível: {inventory.quantity}"
-            )
+        # Verificar estoque disponível (em mãos menos o reservado por outros)
+        inventory = db.query(Inventory).filter(
+            Inventory.product_id == item.product_id,
+            Inventory.store_id == store_id
+        ).first()
+        if inventory:
+            available = inventory.quantity - (inventory.reserved_quantity or 0) + held.get(item.product_id, 0)
+            if available < item.quantity:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Estoque insuficiente para o produto {product.name}. Disponível: {max(available, 0)}"
+                )
+        if inventory:
+            min_stock[item.product_id] = inventory.min_stock
         
-        # Calcular preços
-        discount_amount = (item.unit_price * item.quantity * item.discount_percentage) / 100
-        total_price = (item.unit_price * item.quantity) - discount_amount
-        total_amount += total_price
+        total_amount += line.total_price
         
         items_data.append({
             "product_id": item.product_id,
             "quantity": item.quantity,
-            "unit_price": item.unit_price,
-            "total_price": total_price,
-            "discount_percentage": item.discount_percentage,
-            "discount_amount": discount_amount
+            "unit_price": line.unit_price,
+            "total_price": line.total_price,
+            "discount_percentage": line.discount_percentage,
+            "discount_amount": line.discount_amount,
+            "promotion_id": line.promotion_id
         })
+        category_lines.append({
+            "category_id": product.category_id,
+            "quantity": item.quantity,
+            "revenue": line.total_price,
+            "stock_value": product.price * item.quantity if inventory else 0
+        })
+        receipt_lines.append({
+            "product_name": product.name,
+            "quantity": item.quantity,
+            "unit_price": line.unit_price,
+            "total_price": line.total_price
+        })
+    
+    discount_error = pricing.engine.sale_discount_error(sale_data.discount_amount, total_amount)
+    if discount_error:
+        raise HTTPException(status_code=422, detail=discount_error)
     
     # Criar venda
     sale = Sale(
         customer_id=sale_data.customer_id,
+        store_id=store_id,
+        terminal_id=terminal_id,
+        shift_id=shift_id,
         total_amount=total_amount,
         discount_amount=sale_data.discount_amount or 0,
         final_amount=total_amount - (sale_data.discount_amount or 0),
         payment_method=sale_data.payment_method,
-        notes=sale_data.notes
+        notes=sale_data.notes,
+        client_id=idempotency_key
     )
     
+    # Venda, itens e baixa de estoque na mesma transação
     db.add(sale)
-    db.commit()
-    db.refresh(sale)
+    db.flush()
+    shifts.record_sales(db, shift_id, 1, sale.final_amount)
+    
+    # As reservas saem do reservado antes da baixa
+    if reservation_owner:
+        reservations.convert(db, *reservation_owner, sale.id)
     
     # Criar itens da venda e atualizar estoque
+    stock_changes = []
     for item_data in items_data:
         # Criar item da venda
         sale_item = SaleItem(sale_id=sale.id, **item_data)
         db.add(sale_item)
         
-        # Atualizar estoque
-        inventory = db.query(Inventory).filter(Inventory.product_id == item_data["product_id"]).first()
-        if inventory:
-            previous_quantity = inventory.quantity
-            new_quantity = previous_quantity - item_data["quantity"]
-            inventory.quantity = new_quantity
+        # Atualizar estoque (baixa atômica, protegida contra venda concorrente)
+        try:
+            stock_change = stock.decrement_stock(db, item_data["product_id"], item_data["quantity"], store_id)
+        except stock.InsufficientStock as exc:
+            db.rollback()
+            raise HTTPException(
+                status_code=409,
+                detail=f"Estoque insuficiente para o produto ID {exc.product_id}. Disponível: {exc.available}"
+            )
+        
+        if stock_change:
+            previous_quantity, new_quantity = stock_change
+            stock_changes.append((item_data["product_id"], previous_quantity, new_quantity, min_stock.get(item_data["product_id"])))
             
             # Registrar movimento do estoque
             movement = InventoryMovement(
                 product_id=item_data["product_id"],
+                store_id=store_id,
+                terminal_id=terminal_id,
                 movement_type="out",
                 quantity=item_data["quantity"],
                 previous_quantity=previous_quantity,
@@ -96,12 +229,74 @@ async def create_sale(sale_data: SaleCreate, db: Session = Depends(get_db)):
             )
             db.add(movement)
     
+    # Passagens de nível do estoque gravadas com a baixa
+    stock_levels.record(db, [
+        (product_id, store_id, previous_quantity, new_quantity, product_min_stock)
+        for product_id, previous_quantity, new_quantity, product_min_stock in stock_changes
+    ])
+    
+    # Agregados, recibo e eventos saem do checkout: vão pelo outbox, na
+    # mesma transação da venda
+    sale_effects.enqueue_sale_created(
+        db, sale, category_lines, receipt_lines,
+        customer.name if customer else None, stock_changes
+    )
+    nfce.enqueue_issue(db, sale.id)
+    
+    if idempotency_lease is not None:
+        idempotency.attach_resource(db, IDEMPOTENCY_SCOPE, idempotency_key, sale.id, idempotency_lease)
+    
     db.commit()
-    db.refresh(sale)
+    outbox.worker.notify()
     
     # Buscar venda completa com itens
     return db.query(Sale).filter(Sale.id == sale.id).first()
 
+# Limite de vendas por sincronização (um dia de movimento de um terminal)
+SYNC_MAX_SALES = int(os.getenv("PDV_SYNC_MAX_SALES", "20000"))
+
+@router.post("/sync")
+async def sync_offline_sales(
+    batch: SaleSyncBatch,
+    store_id: int = Depends(get_store_id),
+    terminal_id: Optional[str] = Depends(get_terminal_id),
+    db: Session = Depends(get_db)
+):
+    """Receber as vendas gravadas no journal offline do terminal.
+
+    Vendas já recebidas (mesmo client_id) são devolvidas como duplicadas;
+    divergências de estoque, preço ou cliente são gravadas e reportadas em
+    `conflicts`.
+    """
+    if len(batch.sales) > SYNC_MAX_SALES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Lote acima do limite de {SYNC_MAX_SALES} vendas"
+        )
+    return sale_batches.ingest_sales(db, batch.sales, store_id, terminal_id)
+
+BULK_MAX_SALES = int(os.getenv("PDV_BULK_MAX_SALES", "5000"))
+
+@router.post("/bulk")
+async def create_sales_bulk(
+    batch: BulkSaleBatch,
+    store_id: int = Depends(get_store_id),
+    terminal_id: Optional[str] = Depends(get_terminal_id),
+    db: Session = Depends(get_db)
+):
+    """Criar vendas em lote, cada uma com sua chave de idempotência.
+
+    Produtos, clientes e estoque do lote inteiro são validados em poucas
+    consultas; vendas recusadas não impedem as demais. Devolve um resultado
+    por venda, na ordem enviada.
+    """
+    if len(batch.sales) > BULK_MAX_SALES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Lote acima do limite de {BULK_MAX_SALES} vendas"
+        )
+    return sale_batches.ingest_sales(db, batch.sales, store_id, terminal_id, strict=True)
+
 @router.get("/", response_model=List[SaleSchema])
 async def list_sales(
     skip: int = Query(0, ge=0),
@@ -110,11 +305,19 @@ async def list_sales(
     payment_status: Optional[str] = Query(None),
     start_date: Optional[date] = Query(None),
     end_date: Optional[date] = Query(None),
+    store_id: Optional[int] = Query(None),
+    terminal_id: Optional[str] = Query(None),
     db: Session = Depends(get_db)
 ):
     """Listar vendas com filtros opcionais"""
     query = db.query(Sale)
     
+    if store_id is not None:
+        query = query.filter(Sale.store_id == store_id)
+    
+    if terminal_id:
+        query = query.filter(Sale.terminal_id == terminal_id)
+    
     if customer_id:
         query = query.filter(Sale.customer_id == customer_id)
     
@@ -144,56 +347,164 @@ async def update_sale(
     sale_update: SaleUpdate,
     db: Session = Depends(get_db)
 ):
-    """Atualizar uma venda"""
+    """Atualizar uma venda (cancelar pelo status devolve o estoque)"""
     sale = db.query(Sale).filter(Sale.id == sale_id).first()
     if not sale:
         raise HTTPException(status_code=404, detail="Venda não encontrada")
     
     update_data = sale_update.dict(exclude_unset=True)
+    if update_data.get("payment_status") == "cancelled" and sale.payment_status != "cancelled":
+        update_data.pop("payment_status")
+        _reverse(db, lambda: returns.cancel_sales(db, [sale.id], update_data.get("notes")))
+        sale = db.query(Sale).filter(Sale.id == sale_id).first()
+    
     for field, value in update_data.items():
         setattr(sale, field, value)
     
+    if "payment_status" in update_data:
+        receipts.mark_stale(db, sale.id)
+    
     db.commit()
     db.refresh(sale)
     return sale
 
-@router.get("/{sale_id}/receipt")
-async def get_sale_receipt(sale_id: int, db: Session = Depends(get_db)):
-    """Gerar recibo da venda"""
+def _reverse(db: Session, operation) -> returns.ReversalResult:
+    """Executar o estorno, gravar e publicar os eventos de estoque e totais"""
+    try:
+        result = operation()
+    except returns.ReturnError as exc:
+        db.rollback()
+        raise HTTPException(status_code=exc.status_code, detail=exc.detail)
+    db.commit()
+    
+    if result.sale_ids:
+        for store_id in result.store_ids or [None]:
+            events.publish_sale_reversal(store_id, result.view())
+    for product_id, store_id, previous_quantity, new_quantity, min_stock in result.stock_changes:
+        events.publish_stock_change(product_id, store_id, previous_quantity, new_quantity, min_stock)
+    return result
+
+@router.post("/cancel")
+async def cancel_sales_batch(
+    batch: SaleCancelBatch,
+    store_id: int = Depends(get_store_id),
+    terminal_id: Optional[str] = Depends(get_terminal_id),
+    db: Session = Depends(get_db)
+):
+    """Cancelar várias vendas em uma transação.
+
+    Informe `sale_ids` ou o `terminal_id` com o período (`start_at` e
+    `end_at`), por exemplo para anular o turno de um terminal.
+    """
+    if batch.sale_ids:
+        sale_ids = batch.sale_ids
+    elif batch.terminal_id and batch.start_at:
+        sale_ids = returns.select_sales(db, store_id, batch.terminal_id, batch.start_at, batch.end_at)
+    else:
+        raise HTTPException(status_code=400, detail="Informe sale_ids ou terminal_id e start_at")
+    
+    result = _reverse(db, lambda: returns.cancel_sales(db, sale_ids, batch.reason, terminal_id))
+    return result.view()
+
+@router.post("/{sale_id}/cancel", response_model=SaleSchema)
+async def cancel_sale(
+    sale_id: int,
+    cancel: SaleCancel,
+    terminal_id: Optional[str] = Depends(get_terminal_id),
+    db: Session = Depends(get_db)
+):
+    """Cancelar a venda: devolve ao estoque o que ainda não voltou e estorna o pago"""
     sale = db.query(Sale).filter(Sale.id == sale_id).first()
     if not sale:
         raise HTTPException(status_code=404, detail="Venda não encontrada")
+    if sale.payment_status == "cancelled":
+        raise HTTPException(status_code=400, detail="Venda já cancelada")
     
-    # Formatar dados do recibo
-    receipt_data = {
-        "sale_id": sale.id,
-        "date": sale.created_at.strftime("%d/%m/%Y %H:%M"),
-        "customer": sale.customer.name if sale.customer else "Cliente não identificado",
-        "items": [
-            {
-                "product_name": item.product.name,
-                "quantity": item.quantity,
-                "unit_price": item.unit_price,
-                "total_price": item.total_price
-            }
-            for item in sale.items
-        ],
-        "subtotal": sale.total_amount,
-        "discount": sale.discount_amount,
-        "total": sale.final_amount,
-        "payment_method": sale.payment_method,
-        "payment_status": sale.payment_status
-    }
+    _reverse(db, lambda: returns.cancel_sales(db, [sale_id], cancel.reason, terminal_id))
+    return db.query(Sale).filter(Sale.id == sale_id).first()
+
+@router.post("/{sale_id}/returns")
+async def return_sale_items(
+    sale_id: int,
+    sale_return: SaleReturnCreate,
+    terminal_id: Optional[str] = Depends(get_terminal_id),
+    db: Session = Depends(get_db)
+):
+    """Devolver parte dos itens: volta ao estoque e estorna a parte paga"""
+    result = _reverse(db, lambda: returns.return_items(
+        db, sale_id,
+        [(item.product_id, item.quantity) for item in sale_return.items],
+        sale_return.reason, terminal_id
+    ))
+    return dict(result.view(), sale=_sale_body(db.query(Sale).filter(Sale.id == sale_id).first()))
+
+@router.get("/{sale_id}/receipt")
+async def get_sale_receipt(
+    sale_id: int,
+    format: str = Query("json", pattern="^(json|escpos)$"),
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    """Recibo da venda (JSON ou ESC/POS para impressora térmica).
+
+    O recibo é o guardado na venda; com If-None-Match igual ao ETag a
+    resposta é 304, sem corpo.
+    """
+    snapshot = receipts.get_receipt(db, sale_id)
+    if not snapshot:
+        raise HTTPException(status_code=404, detail="Venda não encontrada")
     
-    return receipt_data
+    etag = receipts.etag_for(snapshot, format)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if receipts.etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    
+    media_type = "application/octet-stream" if format == "escpos" else "application/json"
+    return Response(content=receipts.content(snapshot, format), media_type=media_type, headers=headers)
+
+@router.get("/{sale_id}/nfce")
+async def get_sale_nfce(
+    sale_id: int,
+    format: str = Query("json", pattern="^(json|xml)$"),
+    db: Session = Depends(get_db)
+):
+    """Situação da NFC-e da venda ou o XML assinado"""
+    document = db.query(NfceDocument).filter(NfceDocument.sale_id == sale_id).first()
+    if not document:
+        raise HTTPException(status_code=404, detail="NFC-e não encontrada (venda inexistente ou na fila de emissão)")
+    
+    if format == "xml":
+        if document.xml is None:
+            raise HTTPException(status_code=409, detail="XML da NFC-e ainda não foi gerado")
+        return Response(content=zlib.decompress(document.xml), media_type="application/xml")
+    
+    return {
+        "sale_id": document.sale_id,
+        "series": document.series,
+        "number": document.number,
+        "access_key": document.access_key,
+        "emission_type": document.emission_type,
+        "environment": document.environment,
+        "status": document.status,
+        "status_code": document.status_code,
+        "protocol": document.protocol,
+        "rejection_reason": document.rejection_reason,
+        "authorized_at": document.authorized_at
+    }
 
 @router.get("/today/summary")
-async def get_today_sales_summary(db: Session = Depends(get_db)):
+async def get_today_sales_summary(
+    store_id: Optional[int] = Query(None),
+    db: Session = Depends(get_db)
+):
     """Resumo de vendas do dia"""
     today = date.today()
     
     # Vendas do dia
-    sales_today = db.query(Sale).filter(func.date(Sale.created_at) == today).all()
+    query = db.query(Sale).filter(func.date(Sale.created_at) == today)
+    if store_id is not None:
+        query = query.filter(Sale.store_id == store_id)
+    sales_today = query.all()
     
     total_sales = len(sales_today)
     total_amount = sum(sale.final_amount for sale in sales_today)
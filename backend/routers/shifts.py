@@ -0,0 +1,132 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+from typing import List, Optional
+from backend.database import get_db
+from backend.models.shift import RegisterShift, RegisterShiftMovement
+from backend.schemas import ShiftOpen, ShiftClose, ShiftMovementCreate, ShiftMovement as ShiftMovementSchema
+from backend.services import shifts
+from backend.services.stores import get_store_id, get_terminal_id
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+router = APIRouter()
+
+def _get_shift(db: Session, shift_id: int) -> RegisterShift:
+    shift = db.query(RegisterShift).filter(RegisterShift.id == shift_id).first()
+    if not shift:
+        raise HTTPException(status_code=404, detail="Caixa não encontrado")
+    return shift
+
+@router.post("/")
+async def open_shift(
+    shift_data: ShiftOpen,
+    store_id: int = Depends(get_store_id),
+    terminal_id: Optional[str] = Depends(get_terminal_id),
+    db: Session = Depends(get_db)
+):
+    """Abrir o caixa do terminal (header X-Terminal-Id) com o troco inicial"""
+    try:
+        shift = shifts.open_shift(
+            db, store_id, terminal_id, shift_data.opening_float, shift_data.opened_by, shift_data.notes
+        )
+    except shifts.ShiftError as exc:
+        raise HTTPException(status_code=exc.status_code, detail=exc.detail)
+    db.commit()
+    return shifts.summary(db, _get_shift(db, shift.id))
+
+@router.get("/current")
+async def get_current_shift(
+    store_id: int = Depends(get_store_id),
+    terminal_id: Optional[str] = Depends(get_terminal_id),
+    db: Session = Depends(get_db)
+):
+    """Caixa aberto no terminal, com os totais até o momento"""
+    shift_id = shifts.current_shift_id(db, store_id, terminal_id)
+    if shift_id is None:
+        raise HTTPException(status_code=404, detail="Nenhum caixa aberto neste terminal")
+    return shifts.summary(db, _get_shift(db, shift_id))
+
+@router.get("/")
+async def list_shifts(
+    terminal_id: Optional[str] = Query(None),
+    status: Optional[str] = Query(None),
+    skip: int = 0,
+    limit: int = Query(50, le=500),
+    store_id: int = Depends(get_store_id),
+    db: Session = Depends(get_db)
+):
+    """Listar os caixas da loja, do mais recente para o mais antigo"""
+    query = db.query(RegisterShift).filter(RegisterShift.store_id == store_id)
+    if terminal_id:
+        query = query.filter(RegisterShift.terminal_id == terminal_id)
+    if status:
+        query = query.filter(RegisterShift.status == status)
+    rows = query.order_by(RegisterShift.opened_at.desc(), RegisterShift.id.desc()).offset(skip).limit(limit).all()
+    return [
+        {
+            "id": shift.id,
+            "terminal_id": shift.terminal_id,
+            "status": shift.status,
+            "opened_by": shift.opened_by,
+            "opened_at": shift.opened_at,
+            "closed_at": shift.closed_at,
+            "sales_count": shift.sales_count,
+            "sales_amount": shift.sales_amount,
+            "expected_cash": shift.expected_cash,
+            "cash_difference": shift.cash_difference
+        }
+        for shift in rows
+    ]
+
+@router.get("/{shift_id}")
+async def get_shift(shift_id: int, db: Session = Depends(get_db)):
+    """Caixa com os totais por forma de pagamento"""
+    return shifts.summary(db, _get_shift(db, shift_id))
+
+@router.get("/{shift_id}/movements", response_model=List[ShiftMovementSchema])
+async def list_movements(shift_id: int, db: Session = Depends(get_db)):
+    """Sangrias e suprimentos do caixa"""
+    _get_shift(db, shift_id)
+    return db.query(RegisterShiftMovement).filter(
+        RegisterShiftMovement.shift_id == shift_id
+    ).order_by(RegisterShiftMovement.id).all()
+
+@router.post("/{shift_id}/movements", response_model=ShiftMovementSchema)
+async def add_movement(shift_id: int, movement: ShiftMovementCreate, db: Session = Depends(get_db)):
+    """Registrar sangria (withdrawal) ou suprimento (deposit) no caixa aberto"""
+    try:
+        created = shifts.add_movement(
+            db, shift_id, movement.type, movement.amount, movement.reason, movement.created_by
+        )
+    except shifts.ShiftError as exc:
+        db.rollback()
+        raise HTTPException(status_code=exc.status_code, detail=exc.detail)
+    db.commit()
+    db.refresh(created)
+    return created
+
+@router.post("/{shift_id}/close")
+async def close_shift(shift_id: int, closing: ShiftClose, db: Session = Depends(get_db)):
+    """Fechar o caixa com a contagem da gaveta.
+
+    O esperado vem dos totais mantidos a cada venda e pagamento; a resposta
+    traz a diferença entre o contado e o esperado.
+    """
+    try:
+        shift = shifts.close_shift(
+            db, shift_id, closing.counted_cash,
+            {item.payment_method_id: item.amount for item in closing.counted},
+            closing.closed_by, closing.notes
+        )
+    except shifts.ShiftError as exc:
+        db.rollback()
+        raise HTTPException(status_code=exc.status_code, detail=exc.detail)
+    db.commit()
+    return shifts.summary(db, shift)
+
+@router.get("/{shift_id}/reconcile")
+async def reconcile_shift(shift_id: int, db: Session = Depends(get_db)):
+    """Conferir os totais mantidos contra as vendas, pagamentos e movimentos do caixa"""
+    return shifts.reconcile(db, _get_shift(db, shift_id))
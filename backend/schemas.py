@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import AliasChoices, BaseModel, EmailStr, Field
 from typing import Optional, List
 from datetime import datetime
 
@@ -10,6 +10,7 @@ class ProductBase(BaseModel):
     cost_price: Optional[float] = None
     barcode: Optional[str] = None
     category: Optional[str] = None
+    category_id: Optional[int] = None
     brand: Optional[str] = None
     weight: Optional[float] = None
     dimensions: Optional[str] = None
@@ -25,6 +26,7 @@ class ProductUpdate(BaseModel):
     cost_price: Optional[float] = None
     barcode: Optional[str] = None
     category: Optional[str] = None
+    category_id: Optional[int] = None
     brand: Optional[str] = None
     weight: Optional[float] = None
     dimensions: Optional[str] = None
@@ -87,7 +89,7 @@ class Customer(CustomerBase):
 # Sale Item Schema
 class SaleItemCreate(BaseModel):
     product_id: int
-    quantity: int
+    quantity: int = Field(..., ge=1)
     unit_price: float
     discount_percentage: Optional[float] = 0
 
@@ -95,6 +97,8 @@ class SaleItem(SaleItemCreate):
     id: int
     total_price: float
     discount_amount: float
+    promotion_id: Optional[int] = None
+    returned_quantity: Optional[int] = 0
 
     class Config:
         from_attributes = True
@@ -104,7 +108,7 @@ class SaleCreate(BaseModel):
     customer_id: Optional[int] = None
     items: List[SaleItemCreate]
     payment_method: str
-    discount_amount: Optional[float] = 0
+    discount_amount: Optional[float] = Field(0, ge=0)
     notes: Optional[str] = None
 
 class SaleUpdate(BaseModel):
@@ -115,6 +119,12 @@ class Sale(SaleCreate):
     id: int
     total_amount: float
     final_amount: float
+    paid_amount: Optional[float] = 0
+    returned_amount: Optional[float] = 0
+    store_id: Optional[int] = None
+    terminal_id: Optional[str] = None
+    shift_id: Optional[int] = None
+    client_id: Optional[str] = None
     payment_status: str
     nfce_number: Optional[str] = None
     nfce_key: Optional[str] = None
@@ -125,6 +135,25 @@ class Sale(SaleCreate):
     class Config:
         from_attributes = True
 
+# Sale Cancellation and Return Schemas (estorno de estoque, agregados e pagamentos)
+class SaleCancel(BaseModel):
+    reason: Optional[str] = Field(None, max_length=200)
+
+class SaleCancelBatch(SaleCancel):
+    # Vendas informadas ou todas as do terminal no período
+    sale_ids: Optional[List[int]] = None
+    terminal_id: Optional[str] = None
+    start_at: Optional[datetime] = None
+    end_at: Optional[datetime] = None
+
+class SaleReturnItem(BaseModel):
+    product_id: int
+    quantity: int = Field(..., ge=1)
+
+class SaleReturnCreate(BaseModel):
+    items: List[SaleReturnItem]
+    reason: Optional[str] = Field(None, max_length=200)
+
 # Inventory Schemas
 class InventoryBase(BaseModel):
     product_id: int
@@ -144,6 +173,9 @@ class InventoryUpdate(BaseModel):
 
 class Inventory(InventoryBase):
     id: int
+    store_id: Optional[int] = None
+    reserved_quantity: Optional[int] = 0
+    stock_level: Optional[str] = "ok"  # ok, low, critical
     last_updated: datetime
     product: Optional[Product] = None
 
@@ -166,9 +198,160 @@ class PaymentMethodBase(BaseModel):
 class PaymentMethodCreate(PaymentMethodBase):
     pass
 
+# Split Payment Schemas (várias formas de pagamento na mesma venda)
+class TenderCreate(BaseModel):
+    payment_method_id: int
+    amount: float
+    authorization_code: Optional[str] = None
+    transaction_id: Optional[str] = None
+
+class SplitPaymentCreate(BaseModel):
+    tenders: List[TenderCreate]
+
 class PaymentMethod(PaymentMethodBase):
     id: int
     created_at: datetime
 
     class Config:
         from_attributes = True
+
+# Offline Sync Schemas (vendas gravadas no journal local do terminal)
+class OfflineSaleCreate(SaleCreate):
+    client_id: str = Field(..., min_length=1, max_length=64)
+    created_at: datetime
+    tenders: List[TenderCreate] = []
+
+class SaleSyncBatch(BaseModel):
+    sales: List[OfflineSaleCreate]
+
+# Bulk Sale Schemas (lotes de terminais e pedidos de marketplace)
+class BulkSaleCreate(SaleCreate):
+    # Chave de idempotência do integrador, gravada como client_id da venda
+    client_id: str = Field(
+        ...,
+        min_length=1,
+        max_length=64,
+        validation_alias=AliasChoices("idempotency_key", "client_id")
+    )
+    created_at: Optional[datetime] = None
+    tenders: List[TenderCreate] = []
+
+class BulkSaleBatch(BaseModel):
+    sales: List[BulkSaleCreate]
+
+# Promotion Schemas
+class PromotionBase(BaseModel):
+    name: str
+    type: str = Field(..., pattern="^(percentage|fixed|buy_x_get_y)$")
+    value: float = Field(0, ge=0)
+    buy_quantity: Optional[int] = Field(None, ge=1)
+    get_quantity: Optional[int] = Field(None, ge=1)
+    product_id: Optional[int] = None
+    category_id: Optional[int] = None
+    customer_id: Optional[int] = None
+    starts_at: Optional[datetime] = None
+    ends_at: Optional[datetime] = None
+    priority: int = 0
+    active: bool = True
+
+class PromotionCreate(PromotionBase):
+    pass
+
+class PromotionUpdate(BaseModel):
+    name: Optional[str] = None
+    value: Optional[float] = Field(None, ge=0)
+    buy_quantity: Optional[int] = Field(None, ge=1)
+    get_quantity: Optional[int] = Field(None, ge=1)
+    starts_at: Optional[datetime] = None
+    ends_at: Optional[datetime] = None
+    priority: Optional[int] = None
+    active: Optional[bool] = None
+
+class Promotion(PromotionBase):
+    id: int
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+# Price Quote Schemas (preço do carrinho antes de fechar a venda)
+class PriceQuoteItem(BaseModel):
+    product_id: int
+    quantity: int = Field(..., ge=1)
+    discount_percentage: Optional[float] = 0
+
+class PriceQuoteRequest(BaseModel):
+    customer_id: Optional[int] = None
+    items: List[PriceQuoteItem]
+
+# Cart Schemas (carrinho do caixa mantido no servidor)
+class CartCreate(BaseModel):
+    customer_id: Optional[int] = None
+    reserve_stock: bool = False
+
+class CartUpdate(BaseModel):
+    customer_id: Optional[int] = None
+
+class CartItemScan(BaseModel):
+    barcode: Optional[str] = None
+    product_id: Optional[int] = None
+    quantity: int = Field(1, ge=1)
+
+class CartCheckout(BaseModel):
+    payment_method: str
+    discount_amount: Optional[float] = Field(0, ge=0)
+    notes: Optional[str] = None
+
+# Stock Reservation Schemas (estoque reservado para pedidos online)
+class ReservationItem(BaseModel):
+    product_id: int
+    quantity: int = Field(..., ge=0)
+
+class ReservationCreate(BaseModel):
+    order_id: str = Field(..., min_length=1, max_length=64)
+    items: List[ReservationItem]
+    ttl_seconds: Optional[int] = Field(None, ge=1)
+
+class StockReservation(BaseModel):
+    id: int
+    owner_type: str
+    owner_id: str
+    store_id: int
+    product_id: int
+    quantity: int
+    status: str
+    expires_at: datetime
+    sale_id: Optional[int] = None
+
+    class Config:
+        from_attributes = True
+
+# Register Shift Schemas (abertura e fechamento de caixa)
+class ShiftOpen(BaseModel):
+    opening_float: float = Field(0, ge=0)
+    opened_by: Optional[str] = Field(None, max_length=100)
+    notes: Optional[str] = None
+
+class ShiftMovementCreate(BaseModel):
+    type: str  # withdrawal (sangria), deposit (suprimento)
+    amount: float = Field(..., gt=0)
+    reason: Optional[str] = Field(None, max_length=255)
+    created_by: Optional[str] = Field(None, max_length=100)
+
+class ShiftMovement(ShiftMovementCreate):
+    id: int
+    shift_id: int
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class ShiftCountedAmount(BaseModel):
+    payment_method_id: int
+    amount: float = Field(..., ge=0)
+
+class ShiftClose(BaseModel):
+    counted_cash: Optional[float] = Field(None, ge=0)
+    counted: List[ShiftCountedAmount] = []  # Conferência das demais formas (ex.: comprovantes de cartão)
+    closed_by: Optional[str] = Field(None, max_length=100)
+    notes: Optional[str] = None
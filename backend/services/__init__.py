@@ -0,0 +1 @@
+# Módulo de serviços de domínio (regras compartilhadas entre routers)
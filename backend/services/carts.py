@@ -0,0 +1,374 @@
+"""
+Carrinhos do caixa mantidos no servidor.
+
+O caixa abre um carrinho e envia cada leitura do código de barras; o
+servidor devolve na hora o preço, a promoção e o total. Cada leitura
+reprecifica só a linha alterada (o desconto de "leve X, ganhe Y" depende
+da quantidade da linha) e ajusta os totais pela diferença, sem percorrer
+o carrinho. Ao fechar, o carrinho vira uma venda normal.
+
+Os carrinhos ficam em memória, com limite de quantidade e expiração por
+inatividade, e são gravados em arquivo no desligamento do servidor e
+recarregados no início. Com `reserve_stock`, as unidades do carrinho ficam
+reservadas no estoque (services/reservations.py) por pouco tempo, renovado
+a cada leitura: outros carrinhos e vendas veem o saldo descontado dessas
+unidades. Sem reserva, a leitura confere o saldo disponível já descontado
+das reservas dos demais.
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from backend.models.inventory import Inventory
+from backend.services import pricing, reservations
+from backend.services.stock import InsufficientStock, available_quantity
+
+MAX_CARTS = int(os.getenv("PDV_CART_MAX", "10000"))
+TTL_SECONDS = int(os.getenv("PDV_CART_TTL", "1800"))
+RESERVATION_TTL_SECONDS = int(os.getenv("PDV_CART_RESERVATION_TTL", "300"))
+STATE_PATH = os.getenv("PDV_CART_STATE", "carts_state.json")
+PURGE_INTERVAL_SECONDS = 30
+
+class CartError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+@dataclass
+class CartLine:
+    product_id: int
+    name: str
+    quantity: int
+    unit_price: float
+    discount_amount: float
+    total_price: float
+    promotion_id: Optional[int] = None
+
+@dataclass
+class Cart:
+    id: str
+    store_id: int
+    terminal_id: Optional[str]
+    customer_id: Optional[int]
+    reserve_stock: bool
+    created_at: float
+    expires_at: float
+    lines: Dict[int, CartLine] = field(default_factory=dict)
+    subtotal: float = 0.0
+    discount: float = 0.0
+    total: float = 0.0
+    item_count: int = 0
+    # product_id -> unidades reservadas no estoque, válidas até
+    # reservation_expires_at (cópia das reservas do carrinho no banco)
+    reserved: Dict[int, int] = field(default_factory=dict)
+    reservation_expires_at: float = 0.0
+    status: str = "open"  # open, checkout, closed
+    sale_id: Optional[int] = None
+
+    def view(self) -> dict:
+        return {
+            "id": self.id,
+            "store_id": self.store_id,
+            "terminal_id": self.terminal_id,
+            "customer_id": self.customer_id,
+            "status": self.status,
+            "sale_id": self.sale_id,
+            "reserve_stock": self.reserve_stock,
+            "items": [asdict(line) for line in self.lines.values()],
+            "item_count": self.item_count,
+            "subtotal": round(self.subtotal, 2),
+            "discount": round(self.discount, 2),
+            "total": round(self.total, 2),
+            "expires_at": self.expires_at,
+            "reservation_expires_at": self.reservation_expires_at if self.reserved else None,
+        }
+
+    def _apply(self, line: Optional[CartLine], sign: int):
+        if line is None:
+            return
+        self.subtotal += sign * line.unit_price * line.quantity
+        self.discount += sign * line.discount_amount
+        self.total += sign * line.total_price
+        self.item_count += sign * line.quantity
+
+class CartStore:
+    def __init__(self, max_carts: int = MAX_CARTS):
+        self.max_carts = max_carts
+        self._lock = threading.Lock()
+        self._carts: "OrderedDict[str, Cart]" = OrderedDict()
+        self._last_purge = 0.0
+
+    def __len__(self) -> int:
+        return len(self._carts)
+
+    # Expiração
+
+    def _expire(self, now: float):
+        # As reservas no banco vencem sozinhas (varredura de reservations)
+        for cart_id in [cart_id for cart_id, cart in self._carts.items() if cart.expires_at <= now]:
+            del self._carts[cart_id]
+        for cart in self._carts.values():
+            if cart.reserved and cart.reservation_expires_at <= now:
+                cart.reserved = {}
+
+    def _maybe_purge(self, now: float):
+        if now - self._last_purge >= PURGE_INTERVAL_SECONDS:
+            self._last_purge = now
+            self._expire(now)
+
+    def _get(self, cart_id: str, now: float) -> Cart:
+        cart = self._carts.get(cart_id)
+        if cart is None or cart.expires_at <= now:
+            if cart is not None:
+                del self._carts[cart_id]
+            raise CartError(404, "Carrinho não encontrado ou expirado")
+        if cart.reserved and cart.reservation_expires_at <= now:
+            cart.reserved = {}
+        self._carts.move_to_end(cart_id)
+        return cart
+
+    # Operações
+
+    def open(
+        self,
+        store_id: int,
+        terminal_id: Optional[str],
+        customer_id: Optional[int] = None,
+        reserve_stock: bool = False
+    ) -> Cart:
+        now = time.time()
+        with self._lock:
+            self._maybe_purge(now)
+            if len(self._carts) >= self.max_carts:
+                self._expire(now)
+            if len(self._carts) >= self.max_carts:
+                raise CartError(503, "Limite de carrinhos abertos atingido")
+            cart = Cart(
+                id=uuid.uuid4().hex,
+                store_id=store_id,
+                terminal_id=terminal_id,
+                customer_id=customer_id,
+                reserve_stock=reserve_stock,
+                created_at=now,
+                expires_at=now + TTL_SECONDS
+            )
+            self._carts[cart.id] = cart
+            return cart
+
+    def get(self, cart_id: str) -> Cart:
+        with self._lock:
+            return self._get(cart_id, time.time())
+
+    def set_quantity(
+        self,
+        db: Session,
+        cart_id: str,
+        product_id: Optional[int] = None,
+        barcode: Optional[str] = None,
+        quantity: Optional[int] = None,
+        delta: int = 0
+    ) -> Cart:
+        """Definir a quantidade de um produto (quantity) ou somar a ela (delta)"""
+        catalog = pricing.engine.current(db)
+        if product_id is None:
+            product_id = catalog.barcodes.get(barcode or "")
+            if product_id is None:
+                raise CartError(404, f"Código de barras {barcode} não encontrado")
+
+        with self._lock:
+            cart = self._get(cart_id, time.time())
+            if cart.status != "open":
+                raise CartError(409, "Carrinho já fechado")
+            current = cart.lines.get(product_id)
+            new_quantity = quantity if quantity is not None else (current.quantity if current else 0) + delta
+            store_id = cart.store_id
+            customer_id = cart.customer_id
+            reserve_stock = cart.reserve_stock
+        if new_quantity < 0:
+            raise CartError(400, "Quantidade inválida")
+
+        line = None
+        if new_quantity > 0:
+            try:
+                price = pricing.engine.price_line(catalog, product_id, new_quantity, customer_id)
+            except pricing.PriceError as exc:
+                raise CartError(400, exc.detail)
+            line = CartLine(
+                product_id=product_id,
+                name=price.product.name,
+                quantity=new_quantity,
+                unit_price=price.unit_price,
+                discount_amount=price.discount_amount,
+                total_price=price.total_price,
+                promotion_id=price.promotion_id
+            )
+        # Saldo conferido fora do lock: a reserva é um UPDATE condicional no
+        # estoque; sem reserva, basta o disponível da linha do estoque
+        reserved_quantity = None
+        reservation_expires_at = None
+        try:
+            if reserve_stock:
+                reservation = reservations.hold(
+                    db, "cart", cart_id, store_id, product_id, new_quantity, RESERVATION_TTL_SECONDS
+                )
+                reserved_quantity = reservation.quantity if reservation is not None else 0
+                reservation_expires_at = reservations.renew(db, "cart", cart_id, RESERVATION_TTL_SECONDS).timestamp()
+                db.commit()
+            elif line is not None:
+                available = db.query(available_quantity()).filter(
+                    Inventory.product_id == product_id,
+                    Inventory.store_id == store_id
+                ).first()
+                if available is not None and available[0] < new_quantity:
+                    raise InsufficientStock(product_id, max(available[0], 0))
+        except InsufficientStock as exc:
+            db.rollback()
+            raise CartError(
+                409,
+                f"Estoque insuficiente para o produto {line.name if line else product_id}. Disponível: {exc.available}"
+            )
+
+        now = time.time()
+        with self._lock:
+            cart = self._get(cart_id, now)
+            if cart.status != "open":
+                raise CartError(409, "Carrinho já fechado")
+            cart._apply(cart.lines.get(product_id), -1)
+            if line is None:
+                cart.lines.pop(product_id, None)
+            else:
+                cart.lines[product_id] = line
+                cart._apply(line, 1)
+            if reserved_quantity is not None:
+                if reserved_quantity > 0:
+                    cart.reserved[product_id] = reserved_quantity
+                else:
+                    cart.reserved.pop(product_id, None)
+                cart.reservation_expires_at = reservation_expires_at
+            cart.expires_at = now + TTL_SECONDS
+            return cart
+
+    def set_customer(self, db: Session, cart_id: str, customer_id: Optional[int]) -> Cart:
+        """Trocar o cliente e reprecificar todas as linhas (promoções de cliente)"""
+        catalog = pricing.engine.current(db)
+        with self._lock:
+            cart = self._get(cart_id, time.time())
+            if cart.status != "open":
+                raise CartError(409, "Carrinho já fechado")
+            cart.customer_id = customer_id
+            cart.subtotal = cart.discount = cart.total = 0.0
+            cart.item_count = 0
+            for product_id, current in list(cart.lines.items()):
+                try:
+                    price = pricing.engine.price_line(catalog, product_id, current.quantity, customer_id)
+                except pricing.PriceError:
+                    continue
+                line = CartLine(
+                    product_id=product_id,
+                    name=price.product.name,
+                    quantity=current.quantity,
+                    unit_price=price.unit_price,
+                    discount_amount=price.discount_amount,
+                    total_price=price.total_price,
+                    promotion_id=price.promotion_id
+                )
+                cart.lines[product_id] = line
+                cart._apply(line, 1)
+            return cart
+
+    def begin_checkout(self, cart_id: str) -> Cart:
+        """Travar o carrinho para o fechamento (evita duas vendas do mesmo carrinho)"""
+        with self._lock:
+            cart = self._get(cart_id, time.time())
+            if cart.status == "checkout":
+                raise CartError(409, "Fechamento do carrinho em andamento")
+            if cart.status == "open":
+                if not cart.lines:
+                    raise CartError(400, "Carrinho vazio")
+                cart.status = "checkout"
+            return cart
+
+    def abort_checkout(self, cart_id: str):
+        with self._lock:
+            cart = self._carts.get(cart_id)
+            if cart is not None and cart.status == "checkout":
+                cart.status = "open"
+
+    def close(self, cart_id: str, sale_id: int) -> Cart:
+        """Marcar o carrinho como vendido (as reservas foram convertidas na venda)"""
+        with self._lock:
+            cart = self._get(cart_id, time.time())
+            cart.status = "closed"
+            cart.sale_id = sale_id
+            cart.reserved = {}
+            return cart
+
+    def discard(self, db: Session, cart_id: str):
+        """Descartar o carrinho e liberar as reservas no estoque"""
+        with self._lock:
+            cart = self._carts.pop(cart_id, None)
+            if cart is None:
+                raise CartError(404, "Carrinho não encontrado ou expirado")
+        if cart.reserve_stock:
+            reservations.release(db, "cart", cart_id)
+            db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._expire(time.time())
+            return {
+                "open_carts": sum(1 for cart in self._carts.values() if cart.status == "open"),
+                "closed_carts": sum(1 for cart in self._carts.values() if cart.status == "closed"),
+                "max_carts": self.max_carts,
+                "reserving_carts": sum(1 for cart in self._carts.values() if cart.reserved),
+                "reserved_units": sum(sum(cart.reserved.values()) for cart in self._carts.values()),
+            }
+
+    # Persistência
+
+    def save(self, path: str = STATE_PATH) -> int:
+        """Gravar os carrinhos abertos (desligamento do servidor)"""
+        with self._lock:
+            self._expire(time.time())
+            carts = [
+                dict(asdict(cart), lines=[asdict(line) for line in cart.lines.values()],
+                     reserved=list(cart.reserved.items()))
+                for cart in self._carts.values() if cart.status == "open"
+            ]
+        temporary = path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            json.dump(carts, file)
+        os.replace(temporary, path)
+        return len(carts)
+
+    def load(self, path: str = STATE_PATH) -> int:
+        """Recarregar os carrinhos gravados, descartando os expirados"""
+        if not os.path.exists(path):
+            return 0
+        with open(path, encoding="utf-8") as file:
+            carts = json.load(file)
+        now = time.time()
+        with self._lock:
+            for data in carts:
+                if data["expires_at"] <= now:
+                    continue
+                lines = {line["product_id"]: CartLine(**line) for line in data.pop("lines")}
+                # As reservas continuam no banco; vencidas já não valem
+                reserved = {product_id: quantity for product_id, quantity in data.pop("reserved")}
+                cart = Cart(**data, lines=lines)
+                if cart.reservation_expires_at > now:
+                    cart.reserved = reserved
+                self._carts[cart.id] = cart
+        os.remove(path)
+        return len(self._carts)
+
+store = CartStore()
@@ -0,0 +1,229 @@
+"""
+Categorias como dimensão do catálogo e seus agregados mantidos.
+
+Os produtos referenciam `Category` por id. Contagem de produtos ativos,
+valor em estoque e totais de venda ficam gravados na própria categoria e
+são atualizados pelas rotas de escrita, então a listagem de categorias não
+precisa varrer produtos, estoque ou itens de venda.
+"""
+
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import event, func, update
+from sqlalchemy.orm import Session
+
+from backend.models.inventory import Inventory
+from backend.models.product import Category, Product
+from backend.models.sale import SaleItem
+
+CACHE_TTL_SECONDS = 30
+
+_cache_lock = threading.Lock()
+_cache: Dict[str, object] = {"data": None, "expires_at": 0.0, "generation": 0}
+
+def invalidate_cache():
+    """Descartar a listagem de categorias em cache"""
+    with _cache_lock:
+        _cache["data"] = None
+        _cache["expires_at"] = 0.0
+        _cache["generation"] += 1
+
+def _invalidate_after_commit(db: Session):
+    """Descartar o cache só depois do commit da sessão.
+
+    Descartar antes deixaria um leitor concorrente repovoar o cache com os
+    valores anteriores ao commit.
+    """
+    db.info["categories_changed"] = True
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    if session.info.pop("categories_changed", False):
+        invalidate_cache()
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("categories_changed", None)
+
+def resolve_category(
+    db: Session,
+    name: Optional[str] = None,
+    category_id: Optional[int] = None
+) -> Optional[Category]:
+    """Obter a categoria pelo id ou pelo nome, criando-a se o nome for novo"""
+    if category_id is not None:
+        return db.query(Category).filter(Category.id == category_id).first()
+
+    if not name:
+        return None
+
+    category = db.query(Category).filter(Category.name == name).first()
+    if not category:
+        category = Category(name=name, product_count=0, stock_value=0, sales_quantity=0, sales_total=0)
+        db.add(category)
+        db.flush()
+        _invalidate_after_commit(db)
+    return category
+
+def category_id_for_name(db: Session, name: str) -> Optional[int]:
+    """Traduzir o nome de uma categoria no id usado nos filtros indexados"""
+    row = db.query(Category.id).filter(Category.name == name).first()
+    return row[0] if row else None
+
+def refresh_category_stats(db: Session, category_ids: Iterable[Optional[int]]):
+    """Recalcular contagem de produtos e valor em estoque das categorias informadas.
+
+    As consultas são agrupadas e restritas às categorias afetadas pelo
+    índice de `products.category_id`. Os totais de venda não são tocados.
+    """
+    ids = {category_id for category_id in category_ids if category_id is not None}
+    if not ids:
+        return
+
+    counts = dict(
+        db.query(Product.category_id, func.count(Product.id))
+        .filter(Product.category_id.in_(ids), Product.active == True)
+        .group_by(Product.category_id)
+        .all()
+    )
+    values = dict(
+        db.query(Product.category_id, func.sum(Inventory.quantity * Product.price))
+        .join(Inventory, Inventory.product_id == Product.id)
+        .filter(Product.category_id.in_(ids), Product.active == True)
+        .group_by(Product.category_id)
+        .all()
+    )
+
+    now = datetime.now()
+    for category_id in ids:
+        db.execute(
+            update(Category)
+            .where(Category.id == category_id)
+            .values(
+                product_count=counts.get(category_id, 0),
+                stock_value=values.get(category_id) or 0,
+                stats_updated_at=now
+            )
+        )
+    _invalidate_after_commit(db)
+
+def record_sale(db: Session, lines: List[dict]):
+    """Somar uma venda aos agregados das categorias.
+
+    Cada linha traz `category_id`, `quantity`, `revenue` e `stock_value`
+    (valor de estoque que saiu). A atualização é feita por incremento no
+    banco, sem ler a categoria.
+    """
+    deltas: Dict[int, Dict[str, float]] = {}
+    for line in lines:
+        category_id = line.get("category_id")
+        if category_id is None:
+            continue
+        delta = deltas.setdefault(category_id, {"quantity": 0, "revenue": 0, "stock_value": 0})
+        delta["quantity"] += line["quantity"]
+        delta["revenue"] += line["revenue"]
+        delta["stock_value"] += line.get("stock_value", 0)
+
+    for category_id, delta in deltas.items():
+        db.execute(
+            update(Category)
+            .where(Category.id == category_id)
+            .values(
+                sales_quantity=func.coalesce(Category.sales_quantity, 0) + delta["quantity"],
+                sales_total=func.coalesce(Category.sales_total, 0) + delta["revenue"],
+                stock_value=func.coalesce(Category.stock_value, 0) - delta["stock_value"]
+            )
+        )
+    if deltas:
+        _invalidate_after_commit(db)
+
+def rebuild_category_stats(db: Session):
+    """Recalcular do zero todos os agregados, inclusive os totais de venda"""
+    category_ids = [row[0] for row in db.query(Category.id).all()]
+    refresh_category_stats(db, category_ids)
+
+    sales = {
+        row.category_id: row
+        for row in db.query(
+            Product.category_id,
+            func.sum(SaleItem.quantity).label("quantity"),
+            func.sum(SaleItem.total_price).label("revenue")
+        ).join(SaleItem, SaleItem.product_id == Product.id)
+         .filter(Product.category_id.isnot(None))
+         .group_by(Product.category_id)
+         .all()
+    }
+    for category_id in category_ids:
+        row = sales.get(category_id)
+        db.execute(
+            update(Category)
+            .where(Category.id == category_id)
+            .values(
+                sales_quantity=row.quantity if row else 0,
+                sales_total=row.revenue if row else 0
+            )
+        )
+    _invalidate_after_commit(db)
+
+def backfill_product_categories(db: Session):
+    """Vincular por id os produtos que só têm o nome da categoria.
+
+    Executado na inicialização; só reconstrói os agregados quando algum
+    produto foi vinculado ou alguma categoria nunca teve estatística.
+    """
+    names = [
+        row[0] for row in db.query(Product.category).filter(
+            Product.category.isnot(None),
+            Product.category_id.is_(None)
+        ).distinct().all()
+    ]
+    for name in names:
+        category = resolve_category(db, name=name)
+        db.execute(
+            update(Product)
+            .where(Product.category == name, Product.category_id.is_(None))
+            .values(category_id=category.id)
+        )
+
+    missing_stats = db.query(Category.id).filter(Category.stats_updated_at.is_(None)).first()
+    if names or missing_stats:
+        rebuild_category_stats(db)
+    db.commit()
+
+def get_category_summary(db: Session, include_inactive: bool = False) -> List[dict]:
+    """Listagem de categorias com agregados, servida de um cache curto"""
+    now = time.monotonic()
+    with _cache_lock:
+        data = _cache["data"]
+        generation = _cache["generation"]
+        if data is None or _cache["expires_at"] <= now:
+            data = None
+
+    if data is None:
+        categories = db.query(Category).order_by(Category.name).all()
+        data = [
+            {
+                "id": category.id,
+                "name": category.name,
+                "description": category.description,
+                "active": category.active,
+                "product_count": category.product_count or 0,
+                "stock_value": category.stock_value or 0,
+                "sales_quantity": category.sales_quantity or 0,
+                "sales_total": category.sales_total or 0,
+                "stats_updated_at": category.stats_updated_at
+            }
+            for category in categories
+        ]
+        with _cache_lock:
+            # Um commit durante a leitura descartou o cache: não gravar o antigo
+            if _cache["generation"] == generation:
+                _cache["data"] = data
+                _cache["expires_at"] = now + CACHE_TTL_SECONDS
+
+    if include_inactive:
+        return list(data)
+    return [category for category in data if category["active"] is not False]
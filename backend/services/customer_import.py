@@ -0,0 +1,234 @@
+"""
+Importação em massa de clientes (CSV ou NDJSON).
+
+O arquivo é lido em fluxo e processado em lotes: cada lote é validado,
+tem as duplicatas verificadas em uma única consulta contra os campos
+únicos (email e documento normalizado) e é gravado com executemany, com
+um commit por lote. Linhas inválidas não interrompem a importação; entram
+no relatório de erros.
+"""
+
+import csv
+import json
+from typing import IO, Dict, Iterator, List, Optional, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from backend.models.customer import Customer
+from backend.schemas import CustomerCreate
+from backend.services import bulk, customer_search
+
+BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+
+def find_duplicate(
+    db: Session,
+    email: Optional[str],
+    document: Optional[str],
+    exclude_id: Optional[int] = None
+) -> Optional[str]:
+    """Verificar email e documento em uma única consulta.
+
+    Retorna o nome do campo já cadastrado ("email" ou "document") ou None.
+    """
+    document_key = customer_search.normalize_digits(document)
+    conditions = []
+    if email:
+        conditions.append(Customer.email == email)
+    if document_key:
+        conditions.append(Customer.document_key == document_key)
+    if not conditions:
+        return None
+
+    query = db.query(Customer.email, Customer.document_key).filter(or_(*conditions))
+    if exclude_id is not None:
+        query = query.filter(Customer.id != exclude_id)
+
+    for existing_email, existing_document_key in query.limit(2).all():
+        if email and existing_email == email:
+            return "email"
+        if document_key and existing_document_key == document_key:
+            return "document"
+    return None
+
+def _read_csv(stream: IO[str]) -> Iterator[Tuple[int, dict]]:
+    reader = csv.DictReader(stream)
+    for row in reader:
+        # Linha 1 é o cabeçalho
+        yield reader.line_num, {key: value for key, value in row.items() if key and value not in ("", None)}
+
+def _read_ndjson(stream: IO[str]) -> Iterator[Tuple[int, dict]]:
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            value = json.loads(line)
+        except json.JSONDecodeError as exc:
+            yield line_number, {"__error__": f"JSON inválido: {exc.msg}"}
+            continue
+        if not isinstance(value, dict):
+            yield line_number, {"__error__": "Linha deve ser um objeto JSON"}
+            continue
+        yield line_number, value
+
+class _Report:
+    def __init__(self):
+        self.processed = 0
+        self.inserted = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors: List[dict] = []
+
+    def error(self, line: int, message: str):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "error": message})
+
+    def as_dict(self) -> dict:
+        return {
+            "processed": self.processed,
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "failed": self.failed,
+            "errors": sorted(self.errors, key=lambda error: error["line"]),
+            "errors_truncated": self.failed > len(self.errors)
+        }
+
+# Chave de busca derivada de cada campo
+_SEARCH_KEYS = {
+    "document": "document_key",
+    "phone": "phone_key",
+    "name": "name_key",
+    "email": "email_key"
+}
+
+def _row_values(customer: CustomerCreate) -> dict:
+    """Valores completos para inserção, com as chaves de busca calculadas"""
+    values = customer.dict()
+    model = Customer(**values)
+    customer_search.apply_search_keys(model)
+    for key_column in _SEARCH_KEYS.values():
+        values[key_column] = getattr(model, key_column)
+    values["__provided__"] = customer.dict(exclude_unset=True).keys()
+    return values
+
+def _update_values(values: dict, customer_id: int) -> dict:
+    """No upsert só os campos presentes no arquivo sobrescrevem o cadastro"""
+    provided = values["__provided__"]
+    result = {"id": customer_id}
+    for field in provided:
+        result[field] = values[field]
+        if field in _SEARCH_KEYS:
+            result[_SEARCH_KEYS[field]] = values[_SEARCH_KEYS[field]]
+    return result
+
+def _flush_batch(db: Session, batch: List[Tuple[int, dict]], upsert: bool, report: _Report):
+    # Duplicatas dentro do próprio lote
+    rows = []
+    seen_emails: Dict[str, int] = {}
+    seen_documents: Dict[str, int] = {}
+    for line, values in batch:
+        email, document_key = values.get("email"), values.get("document_key")
+        if email and email in seen_emails:
+            report.error(line, f"Email repetido no arquivo (linha {seen_emails[email]})")
+            continue
+        if document_key and document_key in seen_documents:
+            report.error(line, f"Documento repetido no arquivo (linha {seen_documents[document_key]})")
+            continue
+        if email:
+            seen_emails[email] = line
+        if document_key:
+            seen_documents[document_key] = line
+        rows.append((line, values))
+
+    if not rows:
+        return
+
+    # Duplicatas contra o banco: uma consulta por lote
+    existing_by_email: Dict[str, int] = {}
+    existing_by_document: Dict[str, int] = {}
+    if seen_emails or seen_documents:
+        conditions = []
+        if seen_emails:
+            conditions.append(Customer.email.in_(list(seen_emails)))
+        if seen_documents:
+            conditions.append(Customer.document_key.in_(list(seen_documents)))
+        for customer_id, email, document_key in db.query(
+            Customer.id, Customer.email, Customer.document_key
+        ).filter(or_(*conditions)).all():
+            if email in seen_emails:
+                existing_by_email[email] = customer_id
+            if document_key in seen_documents:
+                existing_by_document[document_key] = customer_id
+
+    inserts, updates, written_lines = [], [], []
+    for line, values in rows:
+        by_email = existing_by_email.get(values.get("email"))
+        by_document = existing_by_document.get(values.get("document_key"))
+        if by_email is None and by_document is None:
+            inserts.append({key: value for key, value in values.items() if key != "__provided__"})
+            written_lines.append(line)
+            continue
+        if not upsert:
+            report.error(line, "Email já cadastrado" if by_email is not None else "Documento já cadastrado")
+            continue
+        if by_email is not None and by_document is not None and by_email != by_document:
+            report.error(line, f"Email e documento pertencem a clientes diferentes ({by_email}, {by_document})")
+            continue
+        updates.append(_update_values(values, by_email if by_email is not None else by_document))
+        written_lines.append(line)
+
+    try:
+        if inserts:
+            bulk.bulk_insert(db, Customer, inserts)
+        if updates:
+            db.execute(update(Customer), updates)
+        db.commit()
+    except IntegrityError:
+        # Conflito com gravação concorrente: o lote inteiro é descartado
+        db.rollback()
+        for line in written_lines:
+            report.error(line, "Conflito de chave única ao gravar o lote")
+        return
+
+    report.inserted += len(inserts)
+    report.updated += len(updates)
+
+def import_customers(
+    db: Session,
+    stream: IO[str],
+    file_format: str = "csv",
+    upsert: bool = False,
+    batch_size: int = BATCH_SIZE
+) -> dict:
+    """Importar clientes de um fluxo de texto e devolver o relatório"""
+    reader = _read_ndjson(stream) if file_format == "ndjson" else _read_csv(stream)
+    report = _Report()
+    batch: List[Tuple[int, dict]] = []
+
+    for line, raw in reader:
+        report.processed += 1
+        if "__error__" in raw:
+            report.error(line, raw["__error__"])
+            continue
+        try:
+            customer = CustomerCreate(**raw)
+        except ValidationError as exc:
+            first = exc.errors()[0]
+            field = ".".join(str(part) for part in first["loc"])
+            report.error(line, f"{field}: {first['msg']}")
+            continue
+
+        batch.append((line, _row_values(customer)))
+        if len(batch) >= batch_size:
+            _flush_batch(db, batch, upsert, report)
+            batch = []
+
+    if batch:
+        _flush_batch(db, batch, upsert, report)
+
+    return report.as_dict()
@@ -0,0 +1,123 @@
+"""
+Busca de clientes por chaves normalizadas.
+
+Cada cliente guarda chaves de busca indexadas: documento e telefone só com
+dígitos, nome e email em minúsculas e sem acentos. As buscas são por
+prefixo, expressas como intervalo (`chave >= termo AND chave < termo + U+FFFF`)
+para usar o índice B-tree em qualquer banco, e o resultado é ordenado por
+relevância.
+"""
+
+import re
+import unicodedata
+from typing import List, Optional
+
+from sqlalchemy.orm import Session
+
+from backend.models.customer import Customer
+
+MIN_DIGITS_PREFIX = 3
+BACKFILL_BATCH_SIZE = 1000
+
+# Pontuação por tipo de correspondência (maior = mais relevante)
+SCORE_DOCUMENT_EXACT = 100
+SCORE_PHONE_EXACT = 90
+SCORE_EMAIL_EXACT = 85
+SCORE_NAME_EXACT = 80
+SCORE_DOCUMENT_PREFIX = 60
+SCORE_PHONE_PREFIX = 50
+SCORE_EMAIL_PREFIX = 40
+SCORE_NAME_PREFIX = 30
+
+_NON_DIGITS = re.compile(r"\D+")
+_SPACES = re.compile(r"\s+")
+_NUMERIC_TERM = re.compile(r"[\d.\-/()\s+]+")
+
+def normalize_digits(value: Optional[str]) -> Optional[str]:
+    """Manter apenas os dígitos (CPF/CNPJ, telefone)"""
+    if not value:
+        return None
+    digits = _NON_DIGITS.sub("", value)
+    return digits or None
+
+def fold_text(value: Optional[str]) -> Optional[str]:
+    """Converter para minúsculas, remover acentos e espaços repetidos"""
+    if not value:
+        return None
+    decomposed = unicodedata.normalize("NFKD", value)
+    without_accents = "".join(char for char in decomposed if not unicodedata.combining(char))
+    folded = _SPACES.sub(" ", without_accents.casefold()).strip()
+    return folded or None
+
+def apply_search_keys(customer: Customer):
+    """Recalcular as chaves de busca a partir dos campos do cliente"""
+    customer.document_key = normalize_digits(customer.document)
+    customer.phone_key = normalize_digits(customer.phone)
+    customer.name_key = fold_text(customer.name) or ""
+    customer.email_key = fold_text(customer.email)
+
+def _prefix_filter(column, prefix: str):
+    return (column >= prefix) & (column < prefix + "\uffff")
+
+def find_by_document(db: Session, document: str) -> Optional[Customer]:
+    """Localizar cliente pelo CPF/CNPJ, com ou sem pontuação"""
+    key = normalize_digits(document)
+    if not key:
+        return db.query(Customer).filter(Customer.document == document).first()
+    return db.query(Customer).filter(Customer.document_key == key).first()
+
+def search_customers(
+    db: Session,
+    term: str,
+    limit: int = 20,
+    active: Optional[bool] = None
+) -> List[Customer]:
+    """Buscar clientes por prefixo de documento, telefone, email ou nome.
+
+    Cada chave aplicável é consultada pelo próprio índice com `limit`
+    resultados; os candidatos são unidos e ordenados por pontuação e nome.
+    """
+    folded = fold_text(term)
+    if not folded:
+        return []
+
+    digits = normalize_digits(term)
+    is_numeric = digits is not None and _NUMERIC_TERM.fullmatch(term.strip()) is not None
+
+    lookups = []
+    if is_numeric and len(digits) >= MIN_DIGITS_PREFIX:
+        lookups.append((Customer.document_key, digits, SCORE_DOCUMENT_EXACT, SCORE_DOCUMENT_PREFIX))
+        lookups.append((Customer.phone_key, digits, SCORE_PHONE_EXACT, SCORE_PHONE_PREFIX))
+    elif "@" in folded:
+        lookups.append((Customer.email_key, folded, SCORE_EMAIL_EXACT, SCORE_EMAIL_PREFIX))
+    elif not is_numeric:
+        lookups.append((Customer.name_key, folded, SCORE_NAME_EXACT, SCORE_NAME_PREFIX))
+        lookups.append((Customer.email_key, folded, SCORE_EMAIL_EXACT, SCORE_EMAIL_PREFIX))
+
+    scored = {}
+    for column, key, exact_score, prefix_score in lookups:
+        query = db.query(Customer).filter(_prefix_filter(column, key))
+        if active is not None:
+            query = query.filter(Customer.active == active)
+        for customer in query.order_by(column).limit(limit).all():
+            value = getattr(customer, column.key)
+            score = exact_score if value == key else prefix_score
+            current = scored.get(customer.id)
+            if current is None or score > current[0]:
+                scored[customer.id] = (score, customer)
+
+    ranked = sorted(scored.values(), key=lambda entry: (-entry[0], entry[1].name_key or ""))
+    return [customer for _, customer in ranked[:limit]]
+
+def backfill_search_keys(db: Session):
+    """Preencher as chaves de busca de clientes cadastrados antes delas existirem"""
+    while True:
+        customers = db.query(Customer).filter(
+            Customer.name_key.is_(None),
+            Customer.name.isnot(None)
+        ).limit(BACKFILL_BATCH_SIZE).all()
+        if not customers:
+            break
+        for customer in customers:
+            apply_search_keys(customer)
+        db.commit()
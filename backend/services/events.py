@@ -0,0 +1,308 @@
+"""
+Barramento de eventos ao vivo para painéis e visores de cliente.
+
+As rotas de venda, pagamento e estoque publicam eventos depois do commit;
+os assinantes (SSE ou WebSocket) recebem só o que mudou, junto com os
+totais do dia mantidos em memória. Cada evento é serializado uma vez e
+entregue a todos os assinantes, sem consulta ao banco por tela.
+
+Cada assinante tem uma fila limitada. Um cliente lento que enche a fila
+perde os eventos atrasados e recebe um único "resync", para recarregar o
+resumo, sem atrasar os demais.
+"""
+
+import asyncio
+import itertools
+import json
+import os
+import threading
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import Dict, Optional, Set
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from backend.models.sale import Sale
+from backend.services import stock_levels
+
+QUEUE_SIZE = int(os.getenv("PDV_EVENTS_QUEUE_SIZE", "100"))
+
+@dataclass
+class Event:
+    id: int
+    type: str
+    data: dict
+    store_id: Optional[int] = None
+    _json: Optional[str] = field(default=None, repr=False)
+
+    @property
+    def json(self) -> str:
+        if self._json is None:
+            self._json = json.dumps(
+                {"id": self.id, "type": self.type, "store_id": self.store_id, "data": self.data},
+                default=str
+            )
+        return self._json
+
+    @property
+    def sse(self) -> str:
+        return f"id: {self.id}\nevent: {self.type}\ndata: {self.json}\n\n"
+
+class Subscriber:
+    def __init__(self, store_id: Optional[int] = None, maxsize: int = QUEUE_SIZE):
+        self.store_id = store_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def offer(self, event: Event):
+        """Enfileirar o evento sem bloquear o publicador"""
+        if self.store_id is not None and event.store_id not in (None, self.store_id):
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Cliente lento: descartar o atraso e pedir que recarregue o resumo
+            while not self.queue.empty():
+                self.queue.get_nowait()
+                self.dropped += 1
+            self.queue.put_nowait(Event(event.id, "resync", {"dropped": self.dropped}, event.store_id))
+
+class EventBus:
+    def __init__(self, queue_size: int = QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers: Set[Subscriber] = set()
+        self._sequence = itertools.count(1)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def subscribers(self) -> list:
+        return list(self._subscribers)
+
+    def subscribe(self, store_id: Optional[int] = None) -> Subscriber:
+        """Registrar um assinante (chamado no loop do servidor)"""
+        self._loop = asyncio.get_running_loop()
+        subscriber = Subscriber(store_id, self.queue_size)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self._subscribers.discard(subscriber)
+
+    def publish(self, event_type: str, data: dict, store_id: Optional[int] = None) -> Event:
+        """Publicar um evento; pode ser chamado do loop ou de outra thread"""
+        event = Event(next(self._sequence), event_type, data, store_id)
+        if not self._subscribers:
+            return event
+
+        loop = self._loop
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if loop is None or running is loop:
+            self._dispatch(event)
+        elif not loop.is_closed():
+            loop.call_soon_threadsafe(self._dispatch, event)
+        return event
+
+    def _dispatch(self, event: Event):
+        for subscriber in list(self._subscribers):
+            subscriber.offer(event)
+
+class LiveTotals:
+    """Totais de vendas do dia por loja, carregados uma vez e incrementados"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._day: Optional[date] = None
+        # Chave None: todas as lojas
+        self._totals: Dict[Optional[int], dict] = {}
+
+    def _load(self, db: Session, store_id: Optional[int]) -> dict:
+        query = db.query(
+            Sale.payment_method,
+            func.count(Sale.id),
+            func.coalesce(func.sum(Sale.final_amount - func.coalesce(Sale.returned_amount, 0)), 0),
+            func.coalesce(func.sum(Sale.paid_amount), 0)
+        ).filter(
+            func.date(Sale.created_at) == self._day,
+            func.coalesce(Sale.payment_status, "") != "cancelled"
+        )
+        if store_id is not None:
+            query = query.filter(Sale.store_id == store_id)
+
+        totals = {"total_sales": 0, "total_amount": 0.0, "paid_amount": 0.0, "payment_methods": {}}
+        for method, count, amount, paid in query.group_by(Sale.payment_method).all():
+            totals["total_sales"] += count
+            totals["total_amount"] += amount
+            totals["paid_amount"] += paid
+            totals["payment_methods"][method] = {"count": count, "amount": amount}
+        return totals
+
+    def _roll_day(self):
+        today = date.today()
+        if self._day != today:
+            self._day = today
+            self._totals = {}
+
+    def _prepare(self, db: Session, store_id: Optional[int]) -> list:
+        """Totais a incrementar; os que ainda não existiam já vêm do banco"""
+        self._roll_day()
+        pending = []
+        for key in {store_id, None}:
+            if key in self._totals:
+                pending.append(self._totals[key])
+            else:
+                self._totals[key] = self._load(db, key)
+        return pending
+
+    def snapshot(self, db: Session, store_id: Optional[int] = None) -> dict:
+        with self._lock:
+            self._roll_day()
+            if store_id not in self._totals:
+                self._totals[store_id] = self._load(db, store_id)
+            return self._copy(store_id)
+
+    def _copy(self, store_id: Optional[int]) -> dict:
+        totals = self._totals[store_id]
+        return dict(
+            totals,
+            date=self._day.strftime("%d/%m/%Y"),
+            payment_methods={method: dict(value) for method, value in totals["payment_methods"].items()}
+        )
+
+    def invalidate(self):
+        """Descartar os totais (eventos deixaram de ser contados)"""
+        with self._lock:
+            self._totals = {}
+
+    def add_sales(self, db: Session, store_id: Optional[int], sales: list) -> Optional[dict]:
+        """Somar vendas (created_at, final_amount, payment_method, paid_amount) do dia"""
+        with self._lock:
+            pending = self._prepare(db, store_id)
+            for created_at, amount, method, paid in sales:
+                if created_at is None or created_at.date() != self._day:
+                    continue
+                for totals in pending:
+                    totals["total_sales"] += 1
+                    totals["total_amount"] += amount
+                    totals["paid_amount"] += paid or 0
+                    entry = totals["payment_methods"].setdefault(method, {"count": 0, "amount": 0})
+                    entry["count"] += 1
+                    entry["amount"] += amount
+            return self._copy(store_id)
+
+    def add_payment(self, db: Session, store_id: Optional[int], sale_created_at: datetime, amount: float) -> dict:
+        with self._lock:
+            pending = self._prepare(db, store_id)
+            if sale_created_at is not None and sale_created_at.date() == self._day:
+                for totals in pending:
+                    totals["paid_amount"] += amount
+            return self._copy(store_id)
+
+bus = EventBus()
+live_totals = LiveTotals()
+
+def publish_sale(db: Session, sale: Sale, items_count: int):
+    """Nova venda gravada (chamar depois do commit)"""
+    if not bus.subscriber_count:
+        # Sem assinantes os totais não são mantidos; recarregar depois
+        live_totals.invalidate()
+        return
+    totals = live_totals.add_sales(
+        db, sale.store_id,
+        [(sale.created_at, sale.final_amount, sale.payment_method, sale.paid_amount)]
+    )
+    bus.publish("sale", {
+        "sale_id": sale.id,
+        "terminal_id": sale.terminal_id,
+        "final_amount": sale.final_amount,
+        "payment_method": sale.payment_method,
+        "payment_status": sale.payment_status,
+        "items_count": items_count,
+        "totals": totals,
+    }, sale.store_id)
+
+def publish_sales_batch(db: Session, store_id: int, sales: list):
+    """Lote de vendas gravado (sincronização ou /bulk)"""
+    if not bus.subscriber_count:
+        live_totals.invalidate()
+        return
+    if not sales:
+        return
+    totals = live_totals.add_sales(db, store_id, sales)
+    bus.publish("sales_batch", {"created": len(sales), "totals": totals}, store_id)
+
+def publish_payment(db: Session, payment, sale: Sale):
+    """Pagamento registrado ou autorizado (chamar depois do commit)"""
+    if not bus.subscriber_count:
+        live_totals.invalidate()
+        return
+    totals = None
+    if payment.status == "approved":
+        totals = live_totals.add_payment(db, sale.store_id, sale.created_at, payment.amount)
+    bus.publish("payment", {
+        "payment_id": payment.id,
+        "sale_id": sale.id,
+        "amount": payment.amount,
+        "status": payment.status,
+        "payment_status": sale.payment_status,
+        "totals": totals,
+    }, sale.store_id)
+
+def publish_sale_reversal(store_id: Optional[int], reversal: dict):
+    """Cancelamento ou devolução gravado: os totais do dia são recarregados"""
+    live_totals.invalidate()
+    if not bus.subscriber_count:
+        return
+    bus.publish("sale_reversal", reversal, store_id)
+
+def publish_stock_change(
+    product_id: int,
+    store_id: Optional[int],
+    previous_quantity: int,
+    new_quantity: int,
+    min_stock: Optional[int],
+    previous_level: Optional[str] = None
+):
+    """Mudança de saldo; publica também a passagem de nível (ok, low, critical).
+
+    `previous_level` é o nível gravado antes da mudança, quando o estoque
+    mínimo também mudou; sem ele, sai do saldo anterior.
+    """
+    if not bus.subscriber_count:
+        return
+    bus.publish("inventory", {
+        "product_id": product_id,
+        "previous_quantity": previous_quantity,
+        "quantity": new_quantity,
+    }, store_id)
+
+    if previous_level is None:
+        previous_level = stock_levels.level_of(previous_quantity, min_stock)
+    level = stock_levels.level_of(new_quantity, min_stock)
+    if level != previous_level:
+        publish_stock_levels(store_id, [{
+            "product_id": product_id,
+            "previous_level": previous_level,
+            "level": level,
+            "quantity": new_quantity,
+            "min_stock": min_stock,
+        }])
+
+def publish_stock_levels(store_id: Optional[int], transitions):
+    """Passagens de nível já gravadas (ver services/stock_levels.py)"""
+    if not bus.subscriber_count:
+        return
+    for transition in transitions:
+        bus.publish("low_stock", {
+            "product_id": transition["product_id"],
+            "quantity": transition["quantity"],
+            "min_stock": transition["min_stock"] or 0,
+            "state": transition["level"],
+            "previous_state": transition["previous_level"],
+        }, store_id)
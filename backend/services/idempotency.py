@@ -0,0 +1,254 @@
+"""
+Requisições idempotentes pelo header Idempotency-Key.
+
+A primeira requisição com uma chave reserva a chave na tabela
+`idempotency_keys` ("processing") e, ao terminar com sucesso, grava a
+resposta. Repetições com a mesma chave devolvem a resposta gravada sem
+executar a operação de novo. As respostas recentes ficam também em um
+cache em memória, então a repetição típica (timeout do terminal seguido
+de reenvio) nem chega ao banco. Falhas liberam a chave, para que o
+reenvio possa ser executado de fato. A reserva é um lease: se o processo
+cair antes de gravar a operação, passado LEASE_SECONDS um reenvio assume
+a chave (e o dono antigo, se ainda vivo, perde o direito de gravar).
+Chaves expiram após o TTL e são removidas periodicamente.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from backend.models.idempotency import IdempotencyKey
+
+TTL_SECONDS = int(os.getenv("PDV_IDEMPOTENCY_TTL", str(24 * 3600)))
+# Tempo máximo de uma requisição em processamento antes que um reenvio
+# possa assumir a chave
+LEASE_SECONDS = int(os.getenv("PDV_IDEMPOTENCY_LEASE", "30"))
+CACHE_SIZE = int(os.getenv("PDV_IDEMPOTENCY_CACHE_SIZE", "10000"))
+PURGE_INTERVAL_SECONDS = 600
+
+@dataclass(frozen=True)
+class StoredResponse:
+    request_hash: str
+    status_code: Optional[int]
+    body: object
+    # Registro criado; com body None, a resposta precisa ser remontada
+    # (a operação gravou mas o processo caiu antes de gravar a resposta)
+    resource_id: Optional[int] = None
+
+class ResponseCache:
+    """LRU em memória das respostas concluídas, com expiração"""
+
+    def __init__(self, max_size: int = CACHE_SIZE):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, StoredResponse]]" = OrderedDict()
+
+    def get(self, scope: str, key: str) -> Optional[StoredResponse]:
+        with self._lock:
+            entry = self._entries.get((scope, key))
+            if entry is None:
+                return None
+            expires_at, response = entry
+            if time.monotonic() > expires_at:
+                del self._entries[(scope, key)]
+                return None
+            self._entries.move_to_end((scope, key))
+            return response
+
+    def put(self, scope: str, key: str, response: StoredResponse, ttl: float = TTL_SECONDS):
+        with self._lock:
+            self._entries[(scope, key)] = (time.monotonic() + ttl, response)
+            self._entries.move_to_end((scope, key))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+cache = ResponseCache()
+_last_purge = 0.0
+
+def request_hash(*parts) -> str:
+    """Hash do conteúdo da requisição, para detectar chave reutilizada"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(json.dumps(part, sort_keys=True, default=str).encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+def _check_hash(stored_hash: str, fingerprint: str):
+    if stored_hash != fingerprint:
+        raise HTTPException(
+            status_code=422,
+            detail="Idempotency-Key já usada com outro conteúdo de requisição"
+        )
+
+def _naive(value: datetime) -> datetime:
+    """Data/hora local sem fuso (o PostgreSQL devolve timestamptz com fuso)"""
+    if value.tzinfo is not None:
+        return value.astimezone().replace(tzinfo=None)
+    return value
+
+def _lease_expired(record: IdempotencyKey) -> bool:
+    if record.claimed_at is None:
+        return True
+    return _naive(record.claimed_at) <= datetime.now() - timedelta(seconds=LEASE_SECONDS)
+
+def _in_progress():
+    return HTTPException(
+        status_code=409,
+        detail="Requisição com esta Idempotency-Key ainda em processamento"
+    )
+
+def lookup(db: Session, scope: str, key: str, fingerprint: str) -> Optional[StoredResponse]:
+    """Resposta já gravada para a chave, do cache ou da tabela"""
+    stored = cache.get(scope, key)
+    if stored is not None:
+        _check_hash(stored.request_hash, fingerprint)
+        return stored
+
+    record = db.query(IdempotencyKey).filter(
+        IdempotencyKey.scope == scope,
+        IdempotencyKey.key == key,
+        IdempotencyKey.expires_at > datetime.now()
+    ).first()
+    if record is None:
+        return None
+    _check_hash(record.request_hash, fingerprint)
+    if record.status != "completed":
+        if record.resource_id is not None:
+            return StoredResponse(record.request_hash, None, None, record.resource_id)
+        if _lease_expired(record):
+            # Dono anterior caiu sem gravar nada: o reenvio assume no claim
+            return None
+        raise _in_progress()
+    stored = StoredResponse(
+        record.request_hash,
+        record.status_code,
+        json.loads(record.response_body),
+        record.resource_id
+    )
+    cache.put(scope, key, stored)
+    return stored
+
+def claim(db: Session, scope: str, key: str, fingerprint: str) -> datetime:
+    """Reservar a chave antes de executar a operação.
+
+    Devolve o instante da reserva, que identifica o lease em
+    `attach_resource` e `release`. Levanta 409 se outra requisição com a
+    mesma chave estiver em curso dentro do lease.
+    """
+    _maybe_purge(db)
+    now = datetime.now()
+    # Chave expirada ainda não removida, ou reserva cujo lease venceu sem
+    # registro gravado: liberar para reuso
+    db.query(IdempotencyKey).filter(
+        IdempotencyKey.scope == scope,
+        IdempotencyKey.key == key,
+        or_(
+            IdempotencyKey.expires_at <= now,
+            and_(
+                IdempotencyKey.status == "processing",
+                IdempotencyKey.resource_id.is_(None),
+                or_(
+                    IdempotencyKey.claimed_at.is_(None),
+                    IdempotencyKey.claimed_at <= now - timedelta(seconds=LEASE_SECONDS)
+                )
+            )
+        )
+    ).delete(synchronize_session=False)
+    db.add(IdempotencyKey(
+        scope=scope,
+        key=key,
+        request_hash=fingerprint,
+        status="processing",
+        claimed_at=now,
+        expires_at=now + timedelta(seconds=TTL_SECONDS)
+    ))
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise _in_progress()
+    return now
+
+def attach_resource(db: Session, scope: str, key: str, resource_id: int, claimed_at: datetime):
+    """Vincular o registro criado à chave, na mesma transação da operação.
+
+    Levanta 409 se o lease foi assumido por um reenvio: a operação não
+    deve ser gravada em dobro.
+    """
+    updated = db.query(IdempotencyKey).filter(
+        IdempotencyKey.scope == scope,
+        IdempotencyKey.key == key,
+        IdempotencyKey.claimed_at == claimed_at,
+        IdempotencyKey.resource_id.is_(None)
+    ).update({"resource_id": resource_id}, synchronize_session=False)
+    if updated != 1:
+        raise _in_progress()
+
+def complete(
+    db: Session,
+    scope: str,
+    key: str,
+    fingerprint: str,
+    status_code: int,
+    body,
+    resource_id: Optional[int] = None
+) -> StoredResponse:
+    """Gravar a resposta da operação concluída"""
+    values = {
+        "status": "completed",
+        "status_code": status_code,
+        "response_body": json.dumps(body, default=str)
+    }
+    if resource_id is not None:
+        values["resource_id"] = resource_id
+    db.query(IdempotencyKey).filter(
+        IdempotencyKey.scope == scope,
+        IdempotencyKey.key == key
+    ).update(values, synchronize_session=False)
+    db.commit()
+    stored = StoredResponse(fingerprint, status_code, body, resource_id)
+    cache.put(scope, key, stored)
+    return stored
+
+def release(db: Session, scope: str, key: str, claimed_at: datetime):
+    """Liberar a chave de uma operação que falhou (se o lease ainda é dela)"""
+    db.rollback()
+    db.query(IdempotencyKey).filter(
+        IdempotencyKey.scope == scope,
+        IdempotencyKey.key == key,
+        IdempotencyKey.claimed_at == claimed_at,
+        IdempotencyKey.status == "processing",
+        IdempotencyKey.resource_id.is_(None)
+    ).delete(synchronize_session=False)
+    db.commit()
+
+def purge_expired(db: Session) -> int:
+    """Remover as chaves vencidas"""
+    removed = db.query(IdempotencyKey).filter(
+        IdempotencyKey.expires_at <= datetime.now()
+    ).delete(synchronize_session=False)
+    db.commit()
+    return removed
+
+def _maybe_purge(db: Session):
+    global _last_purge
+    now = time.monotonic()
+    if now - _last_purge < PURGE_INTERVAL_SECONDS:
+        return
+    _last_purge = now
+    purge_expired(db)
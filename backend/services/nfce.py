@@ -0,0 +1,413 @@
+"""
+Emissão assíncrona de NFC-e.
+
+A venda entra na fila na própria transação, pelo outbox ("nfce.issue"); o
+checkout não espera a nota. O worker trata as vendas em lotes, em duas
+etapas, cada uma com as novas tentativas do outbox:
+
+1. "nfce.issue": reserva um bloco de números da série da loja com um único
+   UPDATE (sem disputa por venda), calcula a chave de acesso, grava o
+   documento "pending" e preenche `Sale.nfce_number`/`nfce_key`.
+2. "nfce.submit": monta e assina os XMLs em um pool de processos e envia
+   ao autorizador em lotes concorrentes. A chave já está gravada, então um
+   reenvio após falha devolve a mesma autorização, sem nota duplicada.
+
+Assinador e autorizador são plugáveis (`set_signer`, `set_authority`); o
+padrão é o `StubSigner` e o `SimulatorAuthority`, em homologação. Vendas
+da sincronização offline saem em contingência (tpEmis 9). Notas
+rejeitadas ficam com o motivo para correção; o número não é reaproveitado.
+"""
+
+import asyncio
+import itertools
+import multiprocessing
+import os
+import random
+import zlib
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from backend.models.customer import Customer
+from backend.models.nfce import NfceDocument, NfceSequence
+from backend.models.payment import Payment
+from backend.models.product import Product
+from backend.models.sale import Sale, SaleItem
+from backend.models.store import Store
+from backend.services import events, outbox
+from backend.services.nfce_xml import Signer, StubSigner, access_key, build_and_sign, numeric_code, payment_code
+from backend.services.payment_methods import registry as payment_method_registry
+
+ENABLED = os.getenv("PDV_NFCE", "on") != "off"
+ENVIRONMENT = int(os.getenv("PDV_NFCE_ENVIRONMENT", "2"))  # 1 produção, 2 homologação
+# Emitente padrão, para lojas sem dados fiscais cadastrados
+DEFAULT_CNPJ = os.getenv("PDV_NFCE_CNPJ", "11222333000181")
+DEFAULT_STATE_CODE = os.getenv("PDV_NFCE_STATE_CODE", "35")
+DEFAULT_CITY_CODE = os.getenv("PDV_NFCE_CITY_CODE", "3550308")
+DEFAULT_SERIES = int(os.getenv("PDV_NFCE_SERIES", "1"))
+# Carga tributária aproximada (Lei 12.741), em % do valor do item
+TAX_RATE = float(os.getenv("PDV_NFCE_TAX_RATE", "0"))
+
+POOL_WORKERS = int(os.getenv("PDV_NFCE_WORKERS", str(os.cpu_count() or 2)))
+# Lotes menores são montados no próprio worker (o pool não compensa)
+POOL_MIN_BATCH = 8
+AUTHORITY_BATCH_SIZE = 50
+AUTHORITY_CONCURRENCY = int(os.getenv("PDV_NFCE_AUTHORITY_CONCURRENCY", "8"))
+AUTHORITY_TIMEOUT_SECONDS = float(os.getenv("PDV_NFCE_AUTHORITY_TIMEOUT", "30"))
+
+ISSUE = "nfce.issue"
+SUBMIT = "nfce.submit"
+
+@dataclass(frozen=True)
+class AuthorityResult:
+    access_key: str
+    status_code: int  # cStat
+    reason: str
+    protocol: Optional[str] = None
+
+    @property
+    def authorized(self) -> bool:
+        return self.status_code in (100, 150)
+
+class AuthorityUnavailable(Exception):
+    """Autorizador fora do ar; o lote volta para a fila"""
+
+class AuthorityClient(ABC):
+    """Cliente do autorizador (SEFAZ)"""
+
+    @abstractmethod
+    async def authorize(self, documents: List[Tuple[str, bytes]]) -> List[AuthorityResult]:
+        """Enviar um lote de (chave, XML assinado); reenviar uma chave já
+        autorizada deve devolver o protocolo original"""
+
+class SimulatorAuthority(AuthorityClient):
+    """Autorizador simulado em processo, para testes e benchmark"""
+
+    def __init__(self, latency: float = 0.1, rejection_rate: float = 0.0, failure_rate: float = 0.0):
+        self.latency = latency
+        self.rejection_rate = rejection_rate
+        self.failure_rate = failure_rate
+        self._protocols: Dict[str, str] = {}
+        self._sequence = itertools.count(1)
+
+    async def authorize(self, documents: List[Tuple[str, bytes]]) -> List[AuthorityResult]:
+        await asyncio.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            raise AuthorityUnavailable("Autorizador simulado indisponível")
+
+        results = []
+        for key, xml in documents:
+            if key in self._protocols:
+                results.append(AuthorityResult(key, 100, "Autorizado o uso da NF-e", self._protocols[key]))
+            elif b"<Signature" not in xml:
+                results.append(AuthorityResult(key, 297, "Rejeição: Assinatura difere do calculado"))
+            elif random.random() < self.rejection_rate:
+                results.append(AuthorityResult(key, 999, "Rejeição simulada"))
+            else:
+                protocol = f"1{key[:2]}{next(self._sequence):012d}"
+                self._protocols[key] = protocol
+                results.append(AuthorityResult(key, 100, "Autorizado o uso da NF-e", protocol))
+        return results
+
+_signer: Signer = StubSigner()
+_authority: AuthorityClient = SimulatorAuthority(
+    latency=float(os.getenv("PDV_NFCE_SIMULATOR_LATENCY_MS", "100")) / 1000,
+    rejection_rate=float(os.getenv("PDV_NFCE_SIMULATOR_REJECTION_RATE", "0")),
+    failure_rate=float(os.getenv("PDV_NFCE_SIMULATOR_FAILURE_RATE", "0"))
+)
+_pool: Optional[ProcessPoolExecutor] = None
+
+def set_signer(signer: Signer):
+    """Trocar o assinador (ex.: certificado A1 da loja)"""
+    global _signer
+    _signer = signer
+
+def set_authority(client: AuthorityClient):
+    """Trocar o autorizador (ex.: webservice da SEFAZ)"""
+    global _authority
+    _authority = client
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: os processos não herdam threads nem conexões do servidor
+        _pool = ProcessPoolExecutor(max_workers=POOL_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+# Fila
+
+def issue_payload(sale_id: int, contingency: bool = False) -> dict:
+    return {"sale_id": sale_id, "contingency": contingency}
+
+def enqueue_issue(db: Session, sale_id: int, contingency: bool = False):
+    """Colocar a venda na fila de emissão (na transação da venda)"""
+    if ENABLED:
+        outbox.enqueue(db, ISSUE, issue_payload(sale_id, contingency), aggregate_id=sale_id)
+
+def issue_rows(sale_ids: Iterable[int], contingency: bool = False) -> List[dict]:
+    """Mensagens de emissão para inserção em massa (vendas em lote)"""
+    if not ENABLED:
+        return []
+    return outbox.message_rows(ISSUE, [(sale_id, issue_payload(sale_id, contingency)) for sale_id in sale_ids])
+
+# Numeração
+
+def reserve_numbers(db: Session, store_id: int, series: int, count: int) -> int:
+    """Reservar `count` números seguidos da série e devolver o primeiro"""
+    if db.query(NfceSequence.next_number).filter(
+        NfceSequence.store_id == store_id, NfceSequence.series == series
+    ).first() is None:
+        db.add(NfceSequence(store_id=store_id, series=series, next_number=1))
+        db.flush()
+    next_number = db.execute(
+        update(NfceSequence)
+        .where(NfceSequence.store_id == store_id, NfceSequence.series == series)
+        .values(next_number=NfceSequence.next_number + count)
+        .returning(NfceSequence.next_number)
+        .execution_options(synchronize_session=False)
+    ).scalar_one()
+    return next_number - count
+
+def _issuer(db: Session, store_id: Optional[int]) -> dict:
+    store = db.query(Store).filter(Store.id == store_id).first() if store_id is not None else None
+    return {
+        "cnpj": (store.cnpj if store and store.cnpj else DEFAULT_CNPJ),
+        "name": store.name if store else "Projeto_PDV",
+        "state_code": (store.state_code if store and store.state_code else DEFAULT_STATE_CODE),
+        "city_code": (store.city_code if store and store.city_code else DEFAULT_CITY_CODE),
+        "series": (store.nfce_series if store and store.nfce_series else DEFAULT_SERIES),
+    }
+
+@outbox.handler(ISSUE)
+def handle_issue(db: Session, payloads: List[dict]):
+    contingency = {payload["sale_id"]: payload.get("contingency", False) for payload in payloads}
+    issued = {
+        sale_id for (sale_id,) in
+        db.query(NfceDocument.sale_id).filter(NfceDocument.sale_id.in_(list(contingency))).all()
+    }
+    sales = (
+        db.query(Sale.id, Sale.store_id, Sale.created_at)
+        .filter(Sale.id.in_([sale_id for sale_id in contingency if sale_id not in issued]))
+        .order_by(Sale.id)
+        .all()
+    )
+    if not sales:
+        return None
+
+    by_store: Dict[Optional[int], list] = {}
+    for sale in sales:
+        by_store.setdefault(sale.store_id, []).append(sale)
+
+    documents = []
+    for store_id, store_sales in by_store.items():
+        issuer = _issuer(db, store_id)
+        first_number = reserve_numbers(db, store_id, issuer["series"], len(store_sales))
+        for number, sale in enumerate(store_sales, start=first_number):
+            emission_type = 9 if contingency[sale.id] else 1
+            code = numeric_code(number, f"{issuer['cnpj']}:{issuer['series']}:{number}:{sale.id}")
+            documents.append(NfceDocument(
+                sale_id=sale.id,
+                store_id=store_id,
+                series=issuer["series"],
+                number=number,
+                access_key=access_key(
+                    issuer["state_code"], sale.created_at.strftime("%y%m"), issuer["cnpj"],
+                    issuer["series"], number, emission_type, code
+                ),
+                emission_type=emission_type,
+                environment=ENVIRONMENT,
+                status="pending"
+            ))
+
+    db.add_all(documents)
+    db.flush()
+    db.execute(update(Sale), [
+        {"id": document.sale_id, "nfce_number": str(document.number), "nfce_key": document.access_key}
+        for document in documents
+    ])
+    outbox.enqueue(db, SUBMIT, {"document_ids": [document.id for document in documents]})
+    return outbox.worker.notify
+
+# Montagem, assinatura e envio
+
+def _allocate(total: float, weights: List[float]) -> List[float]:
+    """Ratear um valor pelos itens, com o arredondamento no último"""
+    base = sum(weights)
+    if not total or not base:
+        return [0.0] * len(weights)
+    shares = [round(total * weight / base, 2) for weight in weights[:-1]]
+    return shares + [round(total - sum(shares), 2)]
+
+def _document_data(db: Session, documents: List[NfceDocument]) -> List[dict]:
+    sale_ids = [document.sale_id for document in documents]
+    sales = {sale.id: sale for sale in db.query(Sale).filter(Sale.id.in_(sale_ids)).all()}
+
+    items: Dict[int, list] = {}
+    for row in (
+        db.query(SaleItem, Product.name, Product.barcode)
+        .join(Product, Product.id == SaleItem.product_id)
+        .filter(SaleItem.sale_id.in_(sale_ids))
+        .order_by(SaleItem.id)
+    ):
+        items.setdefault(row.SaleItem.sale_id, []).append(row)
+
+    payments: Dict[int, list] = {}
+    for payment in db.query(Payment).filter(Payment.sale_id.in_(sale_ids), Payment.status == "approved"):
+        method = payment_method_registry.get(db, payment.payment_method_id)
+        payments.setdefault(payment.sale_id, []).append(
+            {"code": payment_code(method.type if method else None), "amount": payment.amount}
+        )
+
+    customer_ids = {sale.customer_id for sale in sales.values() if sale.customer_id}
+    customer_documents = dict(
+        db.query(Customer.id, Customer.document_key).filter(Customer.id.in_(customer_ids)).all()
+    ) if customer_ids else {}
+    method_types = {method.name.lower(): method.type for method in payment_method_registry.all(db)}
+
+    issuers: Dict[Optional[int], dict] = {}
+    data = []
+    for document in documents:
+        sale = sales[document.sale_id]
+        if document.store_id not in issuers:
+            issuers[document.store_id] = _issuer(db, document.store_id)
+
+        rows = items.get(sale.id, [])
+        gross = [row.SaleItem.unit_price * row.SaleItem.quantity for row in rows]
+        item_discounts = [value - row.SaleItem.total_price for value, row in zip(gross, rows)]
+        # Desconto da venda rateado pelos itens, como exige o leiaute
+        sale_discounts = _allocate(sale.discount_amount or 0, [row.SaleItem.total_price for row in rows])
+        lines = []
+        for row, value, item_discount, sale_discount in zip(rows, gross, item_discounts, sale_discounts):
+            discount = round(item_discount + sale_discount, 2)
+            lines.append({
+                "code": str(row.SaleItem.product_id),
+                "barcode": row.barcode,
+                "name": row.name,
+                "quantity": row.SaleItem.quantity,
+                "unit_price": row.SaleItem.unit_price,
+                "gross": round(value, 2),
+                "discount": discount,
+                "tax": round((value - discount) * TAX_RATE / 100, 2),
+            })
+
+        tenders = payments.get(sale.id)
+        if not tenders:
+            method_type = method_types.get((sale.payment_method or "").lower(), sale.payment_method)
+            tenders = [{"code": payment_code(method_type), "amount": sale.final_amount}]
+        paid = sum(tender["amount"] for tender in tenders)
+
+        document_key = customer_documents.get(sale.customer_id)
+        data.append({
+            "document_id": document.id,
+            "access_key": document.access_key,
+            "number": document.number,
+            "series": document.series,
+            "emission_type": document.emission_type,
+            "environment": document.environment,
+            "issued_at": sale.created_at.astimezone().isoformat(timespec="seconds"),
+            "issuer": issuers[document.store_id],
+            "customer_document": document_key if document_key and len(document_key) in (11, 14) else None,
+            "items": lines,
+            "payments": tenders,
+            "change": round(paid - sale.final_amount, 2) if paid > sale.final_amount else 0,
+        })
+    return data
+
+def sign_documents(data: List[dict]) -> Dict[int, bytes]:
+    """Montar e assinar os XMLs; lotes grandes vão para o pool de processos"""
+    if len(data) < POOL_MIN_BATCH or POOL_WORKERS <= 1:
+        return dict(build_and_sign(_signer, doc) for doc in data)
+    chunksize = max(1, len(data) // (POOL_WORKERS * 4))
+    return dict(_get_pool().map(build_and_sign, itertools.repeat(_signer), data, chunksize=chunksize))
+
+async def _authorize_all(documents: List[Tuple[str, bytes]]) -> List[AuthorityResult]:
+    semaphore = asyncio.Semaphore(AUTHORITY_CONCURRENCY)
+
+    async def send(batch):
+        async with semaphore:
+            return await asyncio.wait_for(_authority.authorize(batch), AUTHORITY_TIMEOUT_SECONDS)
+
+    batches = [
+        documents[start:start + AUTHORITY_BATCH_SIZE]
+        for start in range(0, len(documents), AUTHORITY_BATCH_SIZE)
+    ]
+    responses = await asyncio.gather(*(send(batch) for batch in batches))
+    return [result for response in responses for result in response]
+
+@outbox.handler(SUBMIT)
+def handle_submit(db: Session, payloads: List[dict]):
+    document_ids = {document_id for payload in payloads for document_id in payload["document_ids"]}
+    documents = (
+        db.query(NfceDocument)
+        .filter(NfceDocument.id.in_(document_ids), NfceDocument.status.in_(("pending", "signed")))
+        .order_by(NfceDocument.id)
+        .all()
+    )
+    if not documents:
+        return None
+
+    unsigned = [document for document in documents if document.xml is None]
+    if unsigned:
+        signed = sign_documents(_document_data(db, unsigned))
+        for document in unsigned:
+            document.xml = zlib.compress(signed[document.id])
+            document.status = "signed"
+
+    # Roda na thread do worker: um loop próprio para os envios concorrentes
+    results = asyncio.run(_authorize_all(
+        [(document.access_key, zlib.decompress(document.xml)) for document in documents]
+    ))
+
+    by_key = {document.access_key: document for document in documents}
+    now = datetime.now()
+    updates = []
+    for result in results:
+        document = by_key[result.access_key]
+        document.status_code = result.status_code
+        if result.authorized:
+            document.status = "authorized"
+            document.protocol = result.protocol
+            document.authorized_at = now
+            document.rejection_reason = None
+        else:
+            document.status = "rejected"
+            document.rejection_reason = result.reason[:255]
+        updates.append((document.store_id, _event_data(document)))
+
+    def publish():
+        for store_id, data in updates:
+            events.bus.publish("nfce", data, store_id)
+
+    return publish
+
+@outbox.relay(SUBMIT)
+def relay_submit(db: Session, payloads: List[dict]):
+    document_ids = {document_id for payload in payloads for document_id in payload["document_ids"]}
+    documents = (
+        db.query(NfceDocument)
+        .filter(NfceDocument.id.in_(document_ids), NfceDocument.status.in_(("authorized", "rejected")))
+        .order_by(NfceDocument.id)
+        .all()
+    )
+    for document in documents:
+        events.bus.publish("nfce", _event_data(document), document.store_id)
+
+def _event_data(document: NfceDocument) -> dict:
+    return {
+        "sale_id": document.sale_id,
+        "number": document.number,
+        "access_key": document.access_key,
+        "status": document.status,
+        "reason": document.rejection_reason,
+    }
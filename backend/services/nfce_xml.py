@@ -0,0 +1,226 @@
+"""
+Chave de acesso, XML e assinatura da NFC-e (modelo 65, leiaute 4.00).
+
+Só usa a biblioteca padrão e recebe dados simples (dict), para rodar nos
+processos do pool de emissão sem carregar o banco nem o FastAPI.
+"""
+
+import base64
+import hashlib
+import hmac
+from abc import ABC, abstractmethod
+from typing import Optional, Tuple
+from xml.etree import ElementTree as ET
+
+NFE_NAMESPACE = "http://www.portalfiscal.inf.br/nfe"
+DSIG_NAMESPACE = "http://www.w3.org/2000/09/xmldsig#"
+LAYOUT_VERSION = "4.00"
+NFCE_MODEL = "65"
+
+# tPag por tipo de método de pagamento
+PAYMENT_CODES = {
+    "cash": "01",
+    "credit_card": "03",
+    "debit_card": "04",
+    "food_voucher": "10",
+    "meal_voucher": "11",
+    "pix": "17",
+}
+OTHER_PAYMENT_CODE = "99"
+
+def check_digit(key: str) -> str:
+    """Dígito verificador da chave (módulo 11, pesos 2 a 9 da direita)"""
+    total = 0
+    weight = 2
+    for digit in reversed(key):
+        total += int(digit) * weight
+        weight = 2 if weight == 9 else weight + 1
+    rest = total % 11
+    return "0" if rest < 2 else str(11 - rest)
+
+def numeric_code(number: int, seed: str) -> str:
+    """cNF de 8 dígitos, estável para a mesma nota e diferente do número"""
+    code = int(hashlib.sha256(seed.encode("utf-8")).hexdigest(), 16) % 10 ** 8
+    if code == number % 10 ** 8:
+        code = (code + 1) % 10 ** 8
+    return f"{code:08d}"
+
+def access_key(
+    state_code: str,
+    year_month: str,
+    cnpj: str,
+    series: int,
+    number: int,
+    emission_type: int,
+    code: str
+) -> str:
+    """Chave de acesso de 44 dígitos (year_month no formato AAMM)"""
+    key = (
+        f"{int(state_code):02d}{year_month}{cnpj:0>14}{NFCE_MODEL}"
+        f"{series:03d}{number:09d}{emission_type}{code}"
+    )
+    if len(key) != 43 or not key.isdigit():
+        raise ValueError(f"Dados inválidos para a chave de acesso: {key}")
+    return key + check_digit(key)
+
+def _money(value: float) -> str:
+    return f"{value:.2f}"
+
+def _add(parent: ET.Element, tag: str, text=None) -> ET.Element:
+    element = ET.SubElement(parent, tag)
+    if text is not None:
+        element.text = str(text)
+    return element
+
+def build_xml(doc: dict) -> bytes:
+    """XML da NFC-e (sem assinatura).
+
+    `doc` traz access_key, number, series, emission_type, environment,
+    issued_at (ISO com fuso), issuer (cnpj, name, state_code, city_code),
+    customer_document (opcional), items (code, barcode, name, quantity,
+    unit_price, gross, discount, tax), payments (code, amount) e change.
+    """
+    key = doc["access_key"]
+    root = ET.Element("NFe", {"xmlns": NFE_NAMESPACE})
+    inf = _add(root, "infNFe")
+    inf.set("Id", "NFe" + key)
+    inf.set("versao", LAYOUT_VERSION)
+
+    issuer = doc["issuer"]
+    ide = _add(inf, "ide")
+    _add(ide, "cUF", key[:2])
+    _add(ide, "cNF", key[35:43])
+    _add(ide, "natOp", "VENDA")
+    _add(ide, "mod", NFCE_MODEL)
+    _add(ide, "serie", doc["series"])
+    _add(ide, "nNF", doc["number"])
+    _add(ide, "dhEmi", doc["issued_at"])
+    _add(ide, "tpNF", 1)
+    _add(ide, "idDest", 1)
+    _add(ide, "cMunFG", issuer["city_code"])
+    _add(ide, "tpImp", 4)  # DANFE NFC-e
+    _add(ide, "tpEmis", doc["emission_type"])
+    _add(ide, "cDV", key[-1])
+    _add(ide, "tpAmb", doc["environment"])
+    _add(ide, "finNFe", 1)
+    _add(ide, "indFinal", 1)
+    _add(ide, "indPres", 1)
+    _add(ide, "procEmi", 0)
+    _add(ide, "verProc", "Projeto_PDV")
+    if doc["emission_type"] == 9:
+        _add(ide, "dhCont", doc["issued_at"])
+        _add(ide, "xJust", "Venda registrada sem conexao com o servidor")
+
+    emit = _add(inf, "emit")
+    _add(emit, "CNPJ", issuer["cnpj"])
+    _add(emit, "xNome", issuer["name"][:60])
+    _add(emit, "CRT", 1)  # Simples Nacional
+
+    document = doc.get("customer_document")
+    if document:
+        dest = _add(inf, "dest")
+        _add(dest, "CNPJ" if len(document) == 14 else "CPF", document)
+        _add(dest, "indIEDest", 9)
+
+    gross_total = discount_total = tax_total = 0.0
+    for index, item in enumerate(doc["items"], start=1):
+        det = _add(inf, "det")
+        det.set("nItem", str(index))
+        prod = _add(det, "prod")
+        _add(prod, "cProd", item["code"])
+        _add(prod, "cEAN", item.get("barcode") or "SEM GTIN")
+        _add(prod, "xProd", item["name"][:120])
+        _add(prod, "NCM", item.get("ncm") or "00000000")
+        _add(prod, "CFOP", 5102)
+        _add(prod, "uCom", "UN")
+        _add(prod, "qCom", f"{item['quantity']:.4f}")
+        _add(prod, "vUnCom", f"{item['unit_price']:.10f}")
+        _add(prod, "vProd", _money(item["gross"]))
+        _add(prod, "cEANTrib", item.get("barcode") or "SEM GTIN")
+        _add(prod, "uTrib", "UN")
+        _add(prod, "qTrib", f"{item['quantity']:.4f}")
+        _add(prod, "vUnTrib", f"{item['unit_price']:.10f}")
+        if item["discount"]:
+            _add(prod, "vDesc", _money(item["discount"]))
+        _add(prod, "indTot", 1)
+
+        imposto = _add(det, "imposto")
+        _add(imposto, "vTotTrib", _money(item["tax"]))
+        icms = _add(_add(imposto, "ICMS"), "ICMSSN102")
+        _add(icms, "orig", 0)
+        _add(icms, "CSOSN", 102)
+        _add(_add(_add(imposto, "PIS"), "PISNT"), "CST", "07")
+        _add(_add(_add(imposto, "COFINS"), "COFINSNT"), "CST", "07")
+
+        gross_total += item["gross"]
+        discount_total += item["discount"]
+        tax_total += item["tax"]
+
+    icms_tot = _add(_add(inf, "total"), "ICMSTot")
+    for tag in ("vBC", "vICMS", "vICMSDeson", "vFCP", "vBCST", "vST", "vFCPST", "vFCPSTRet"):
+        _add(icms_tot, tag, "0.00")
+    _add(icms_tot, "vProd", _money(gross_total))
+    for tag in ("vFrete", "vSeg"):
+        _add(icms_tot, tag, "0.00")
+    _add(icms_tot, "vDesc", _money(discount_total))
+    for tag in ("vII", "vIPI", "vIPIDevol", "vPIS", "vCOFINS", "vOutro"):
+        _add(icms_tot, tag, "0.00")
+    _add(icms_tot, "vNF", _money(gross_total - discount_total))
+    _add(icms_tot, "vTotTrib", _money(tax_total))
+
+    _add(_add(inf, "transp"), "modFrete", 9)
+
+    pag = _add(inf, "pag")
+    for payment in doc["payments"]:
+        det_pag = _add(pag, "detPag")
+        _add(det_pag, "tPag", payment["code"])
+        _add(det_pag, "vPag", _money(payment["amount"]))
+    if doc.get("change"):
+        _add(pag, "vTroco", _money(doc["change"]))
+
+    return ET.tostring(root, encoding="utf-8", xml_declaration=False)
+
+def _signed_part(xml: bytes) -> bytes:
+    start = xml.index(b"<infNFe")
+    end = xml.index(b"</infNFe>") + len(b"</infNFe>")
+    return xml[start:end]
+
+class Signer(ABC):
+    """Assinatura XMLDSig da NFC-e; precisa poder ser enviada ao pool (pickle)"""
+
+    @abstractmethod
+    def sign(self, xml: bytes, access_key: str) -> bytes:
+        """Devolver o XML com o elemento Signature"""
+
+class StubSigner(Signer):
+    """Assinatura de teste: estrutura XMLDSig com HMAC no lugar do certificado"""
+
+    def __init__(self, secret: str = "projeto-pdv"):
+        self.secret = secret.encode("utf-8")
+
+    def sign(self, xml: bytes, access_key: str) -> bytes:
+        digest = base64.b64encode(hashlib.sha1(_signed_part(xml)).digest()).decode("ascii")
+        value = base64.b64encode(
+            hmac.new(self.secret, digest.encode("ascii"), hashlib.sha256).digest()
+        ).decode("ascii")
+        signature = (
+            f'<Signature xmlns="{DSIG_NAMESPACE}"><SignedInfo>'
+            '<CanonicalizationMethod Algorithm="http://www.w3.org/TR/2001/REC-xml-c14n-20010315"/>'
+            f'<SignatureMethod Algorithm="{DSIG_NAMESPACE}rsa-sha1"/>'
+            f'<Reference URI="#NFe{access_key}"><Transforms>'
+            f'<Transform Algorithm="{DSIG_NAMESPACE}enveloped-signature"/>'
+            '<Transform Algorithm="http://www.w3.org/TR/2001/REC-xml-c14n-20010315"/>'
+            f'</Transforms><DigestMethod Algorithm="{DSIG_NAMESPACE}sha1"/>'
+            f"<DigestValue>{digest}</DigestValue></Reference></SignedInfo>"
+            f"<SignatureValue>{value}</SignatureValue>"
+            "<KeyInfo><X509Data><X509Certificate>STUB</X509Certificate></X509Data></KeyInfo>"
+            "</Signature>"
+        ).encode("utf-8")
+        return xml.replace(b"</NFe>", signature + b"</NFe>")
+
+def build_and_sign(signer: Signer, doc: dict) -> Tuple[int, bytes]:
+    """Tarefa do pool: montar e assinar; devolve (id do documento, XML)"""
+    return doc["document_id"], signer.sign(build_xml(doc), doc["access_key"])
+
+def payment_code(method_type: Optional[str]) -> str:
+    return PAYMENT_CODES.get(method_type or "", OTHER_PAYMENT_CODE)
@@ -0,0 +1,506 @@
+"""
+Outbox transacional para os efeitos posteriores à venda.
+
+A rota grava, na mesma transação da venda, uma mensagem em
+`outbox_messages` ("sale.created", por exemplo). Um worker em segundo
+plano lê as mensagens pendentes em lotes e entrega cada lote ao handler do
+tópico; o que não é essencial para fechar a venda (agregados, recibo,
+eventos ao vivo) sai do caminho crítico do checkout, sem risco de se
+perder se o processo cair.
+
+Entrega pelo menos uma vez: o worker reserva o lote com um prazo
+(`available_at` no futuro) e só o marca como "done" na mesma transação em
+que o handler gravou seus efeitos. Se o processo cair no meio, o prazo
+vence e o lote é entregue de novo. Falhas voltam para a fila com espera
+exponencial; depois de MAX_ATTEMPTS a mensagem fica "failed" para análise.
+
+O worker roda como tarefa asyncio do servidor ou, com
+PDV_OUTBOX_WORKER=off no servidor, como processo separado:
+
+    python -m backend.services.outbox
+
+Os eventos ao vivo só chegam aos painéis do processo que os publica. Com
+o worker à parte, o servidor roda o `EventRelay`: lê as mensagens
+entregues (status "done") e refaz a publicação pelo `relay` do tópico.
+"""
+
+import asyncio
+import json
+import os
+import time
+import traceback
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, update
+from sqlalchemy.orm import Session
+
+from backend.database import SessionLocal
+from backend.models.outbox import OutboxMessage
+
+WORKER_MODE = os.getenv("PDV_OUTBOX_WORKER", "inline")  # inline, off
+BATCH_SIZE = int(os.getenv("PDV_OUTBOX_BATCH_SIZE", "200"))
+POLL_SECONDS = float(os.getenv("PDV_OUTBOX_POLL", "1"))
+LEASE_SECONDS = int(os.getenv("PDV_OUTBOX_LEASE", "300"))
+MAX_ATTEMPTS = int(os.getenv("PDV_OUTBOX_MAX_ATTEMPTS", "10"))
+RETRY_BASE_SECONDS = 1
+RETRY_MAX_SECONDS = 600
+RETENTION_HOURS = int(os.getenv("PDV_OUTBOX_RETENTION_HOURS", "24"))
+PURGE_INTERVAL_SECONDS = 600
+# Janela relida pelo relay: lotes de outro worker gravados fora de ordem
+RELAY_OVERLAP_SECONDS = 5
+
+# Tópico -> handler(db, payloads) que devolve, opcionalmente, uma função
+# a executar depois do commit (ex.: publicar eventos)
+_handlers: Dict[str, Callable[[Session, List[dict]], Optional[Callable[[], None]]]] = {}
+
+# Tópico -> relay(db, payloads) que publica os eventos ao vivo de
+# mensagens já entregues por outro processo
+_relays: Dict[str, Callable[[Session, List[dict]], None]] = {}
+
+def handler(topic: str):
+    """Registrar o handler de um tópico"""
+    def register(function):
+        _handlers[topic] = function
+        return function
+    return register
+
+def relay(topic: str):
+    """Registrar a publicação ao vivo de um tópico (worker em processo separado)"""
+    def register(function):
+        _relays[topic] = function
+        return function
+    return register
+
+def _message_values(topic: str, payload: dict, aggregate_id: Optional[int], now: datetime) -> dict:
+    return {
+        "topic": topic,
+        "aggregate_id": aggregate_id,
+        "payload": json.dumps(payload, separators=(",", ":"), default=str),
+        "status": "pending",
+        "attempts": 0,
+        "created_at": now,
+        "available_at": now,
+    }
+
+def enqueue(db: Session, topic: str, payload: dict, aggregate_id: Optional[int] = None) -> OutboxMessage:
+    """Gravar uma mensagem na transação corrente (sem commit)"""
+    message = OutboxMessage(**_message_values(topic, payload, aggregate_id, datetime.now()))
+    db.add(message)
+    return message
+
+def message_rows(topic: str, messages: Iterable[Tuple[Optional[int], dict]]) -> List[dict]:
+    """Linhas para inserção em massa: (aggregate_id, payload) por mensagem"""
+    now = datetime.now()
+    return [_message_values(topic, payload, aggregate_id, now) for aggregate_id, payload in messages]
+
+@dataclass(frozen=True)
+class ClaimedMessage:
+    """Mensagem reservada por um ciclo do worker"""
+    id: int
+    topic: str
+    payload: str
+    attempts: int
+    created_at: datetime
+
+def retry_delay(attempts: int) -> float:
+    return min(RETRY_BASE_SECONDS * 2 ** max(attempts - 1, 0), RETRY_MAX_SECONDS)
+
+def _local(value: datetime) -> datetime:
+    # O PostgreSQL devolve timestamptz com fuso; as datas do worker são locais
+    if value.tzinfo is not None:
+        return value.astimezone().replace(tzinfo=None)
+    return value
+
+def _seconds_since(now: datetime, value: datetime) -> float:
+    return (now - _local(value)).total_seconds()
+
+def _error_text(exc: Exception) -> str:
+    return "".join(traceback.format_exception_only(type(exc), exc)).strip()[:2000]
+
+class OutboxWorker:
+    def __init__(self, session_factory=SessionLocal, batch_size: int = BATCH_SIZE):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._last_purge = 0.0
+        # Métricas do processo
+        self.delivered = 0
+        self.retried = 0
+        self.failed = 0
+        self.last_batch_at: Optional[datetime] = None
+        self.last_batch_size = 0
+        self.last_batch_seconds = 0.0
+        self.last_delivery_lag_seconds = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """Iniciar a tarefa no loop corrente (startup do servidor)"""
+        if self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._task = self._loop.create_task(self.run_forever())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def notify(self):
+        """Acordar o worker (mensagens novas); pode ser chamado de outra thread"""
+        loop, wake = self._loop, self._wake
+        if loop is None or wake is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            wake.set()
+        else:
+            loop.call_soon_threadsafe(wake.set)
+
+    async def run_forever(self):
+        if self._wake is None:
+            self._loop = asyncio.get_running_loop()
+            self._wake = asyncio.Event()
+        while True:
+            self._wake.clear()
+            try:
+                delivered = await asyncio.to_thread(self.drain_once)
+            except Exception as exc:
+                # Banco indisponível, por exemplo: tentar de novo no próximo ciclo
+                print(f"❌ Outbox: {_error_text(exc)}")
+                delivered = 0
+            if delivered >= self.batch_size:
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    def drain_once(self) -> int:
+        """Processar um lote de mensagens vencidas; devolve quantas foram entregues"""
+        db = self.session_factory()
+        try:
+            messages, lease = self._claim(db)
+            if not messages:
+                self._maybe_purge(db)
+                return 0
+
+            started = time.perf_counter()
+            groups: "OrderedDict[str, List[ClaimedMessage]]" = OrderedDict()
+            for message in messages:
+                groups.setdefault(message.topic, []).append(message)
+
+            delivered = 0
+            for topic, group in groups.items():
+                delivered += self._deliver(db, topic, group, lease)
+
+            self.last_batch_at = datetime.now()
+            self.last_batch_size = len(messages)
+            self.last_batch_seconds = time.perf_counter() - started
+            self._maybe_purge(db)
+            return delivered
+        finally:
+            db.close()
+
+    def _claim(self, db: Session):
+        """Reservar o próximo lote até o fim do prazo"""
+        now = datetime.now()
+        rows = (
+            db.query(OutboxMessage.id, OutboxMessage.topic, OutboxMessage.payload,
+                     OutboxMessage.attempts, OutboxMessage.created_at)
+            .filter(OutboxMessage.status == "pending", OutboxMessage.available_at <= now)
+            .order_by(OutboxMessage.available_at, OutboxMessage.id)
+            .limit(self.batch_size)
+            # PostgreSQL: vários workers não disputam as mesmas linhas
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        if not rows:
+            db.rollback()
+            return [], None
+
+        lease = now + timedelta(seconds=LEASE_SECONDS)
+        db.execute(
+            update(OutboxMessage)
+            .where(OutboxMessage.id.in_([row.id for row in rows]))
+            .values(available_at=lease, attempts=OutboxMessage.attempts + 1)
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        return [
+            ClaimedMessage(row.id, row.topic, row.payload, row.attempts + 1, row.created_at)
+            for row in rows
+        ], lease
+
+    def _deliver(self, db: Session, topic: str, group: List[ClaimedMessage], lease: datetime) -> int:
+        """Entregar o grupo inteiro; se falhar, mensagem por mensagem"""
+        try:
+            self._run_handler(db, topic, group, lease)
+            return len(group)
+        except Exception as exc:
+            db.rollback()
+            if len(group) == 1:
+                self._schedule_retry(db, group[0], lease, exc)
+                return 0
+
+        # Uma mensagem com problema não segura as demais do lote
+        delivered = 0
+        for message in group:
+            try:
+                self._run_handler(db, topic, [message], lease)
+                delivered += 1
+            except Exception as exc:
+                db.rollback()
+                self._schedule_retry(db, message, lease, exc)
+        return delivered
+
+    def _run_handler(self, db: Session, topic: str, group: List[ClaimedMessage], lease: datetime):
+        function = _handlers.get(topic)
+        if function is None:
+            raise LookupError(f"Nenhum handler para o tópico {topic}")
+
+        after_commit = function(db, [json.loads(message.payload) for message in group])
+
+        # Só conclui se a reserva ainda é deste worker (prazo não venceu)
+        now = datetime.now()
+        result = db.execute(
+            update(OutboxMessage)
+            .where(
+                OutboxMessage.id.in_([message.id for message in group]),
+                OutboxMessage.status == "pending",
+                OutboxMessage.available_at == lease
+            )
+            .values(status="done", processed_at=now, last_error=None)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != len(group):
+            raise RuntimeError("Reserva do lote expirou; mensagens serão entregues por outro ciclo")
+        db.commit()
+
+        self.delivered += len(group)
+        self.last_delivery_lag_seconds = max(
+            _seconds_since(now, message.created_at) for message in group
+        )
+        if after_commit is not None:
+            try:
+                after_commit()
+            except Exception as exc:
+                # Efeitos após o commit são só avisos (ex.: eventos ao vivo)
+                print(f"⚠️ Outbox {topic}: {_error_text(exc)}")
+
+    def _schedule_retry(self, db: Session, message: ClaimedMessage, lease: datetime, exc: Exception):
+        if message.attempts >= MAX_ATTEMPTS:
+            values = {"status": "failed", "last_error": _error_text(exc)}
+            self.failed += 1
+        else:
+            values = {
+                "available_at": datetime.now() + timedelta(seconds=retry_delay(message.attempts)),
+                "last_error": _error_text(exc)
+            }
+            self.retried += 1
+        db.execute(
+            update(OutboxMessage)
+            .where(
+                OutboxMessage.id == message.id,
+                OutboxMessage.status == "pending",
+                OutboxMessage.available_at == lease
+            )
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+
+    def _maybe_purge(self, db: Session):
+        if time.monotonic() - self._last_purge < PURGE_INTERVAL_SECONDS:
+            return
+        self._last_purge = time.monotonic()
+        purge_done(db)
+
+worker = OutboxWorker()
+
+class EventRelay:
+    """Publicar no servidor os eventos das mensagens entregues pelo worker separado"""
+
+    def __init__(self, session_factory=SessionLocal, batch_size: int = BATCH_SIZE):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+        self._since: Optional[datetime] = None
+        # Mensagens já publicadas dentro da janela relida
+        self._seen: Dict[int, datetime] = {}
+        # Métricas do processo
+        self.relayed = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """Iniciar a tarefa no loop corrente; só o que for entregue daqui em diante"""
+        if self.running:
+            return
+        self._since = datetime.now()
+        self._task = asyncio.get_running_loop().create_task(self.run_forever())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def run_forever(self):
+        while True:
+            try:
+                relayed = await asyncio.to_thread(self.relay_once)
+            except Exception as exc:
+                print(f"❌ Relay do outbox: {_error_text(exc)}")
+                relayed = 0
+            if relayed < self.batch_size:
+                await asyncio.sleep(POLL_SECONDS)
+
+    def relay_once(self) -> int:
+        """Publicar as mensagens entregues desde a última leitura"""
+        if self._since is None:
+            self._since = datetime.now()
+        db = self.session_factory()
+        try:
+            window = self._since - timedelta(seconds=RELAY_OVERLAP_SECONDS)
+            rows = (
+                db.query(OutboxMessage.id, OutboxMessage.topic, OutboxMessage.payload, OutboxMessage.processed_at)
+                .filter(
+                    OutboxMessage.status == "done",
+                    OutboxMessage.processed_at > window,
+                    OutboxMessage.topic.in_(list(_relays))
+                )
+                .order_by(OutboxMessage.processed_at, OutboxMessage.id)
+                .limit(self.batch_size + len(self._seen))
+                .all()
+            )
+            rows = [row for row in rows if row.id not in self._seen][:self.batch_size]
+
+            groups: "OrderedDict[str, List[dict]]" = OrderedDict()
+            for row in rows:
+                groups.setdefault(row.topic, []).append(json.loads(row.payload))
+                processed_at = _local(row.processed_at)
+                self._seen[row.id] = processed_at
+                self._since = max(self._since, processed_at)
+            for topic, payloads in groups.items():
+                try:
+                    _relays[topic](db, payloads)
+                except Exception as exc:
+                    print(f"⚠️ Relay do outbox {topic}: {_error_text(exc)}")
+            db.rollback()
+
+            window = self._since - timedelta(seconds=RELAY_OVERLAP_SECONDS)
+            self._seen = {message_id: at for message_id, at in self._seen.items() if at > window}
+            self.relayed += len(rows)
+            return len(rows)
+        finally:
+            db.close()
+
+relay_worker = EventRelay()
+
+def purge_done(db: Session) -> int:
+    """Apagar mensagens entregues há mais de RETENTION_HOURS"""
+    cutoff = datetime.now() - timedelta(hours=RETENTION_HOURS)
+    deleted = (
+        db.query(OutboxMessage)
+        .filter(OutboxMessage.status == "done", OutboxMessage.processed_at < cutoff)
+        .delete(synchronize_session=False)
+    )
+    db.commit()
+    return deleted
+
+def requeue_failed(db: Session, topic: Optional[str] = None) -> int:
+    """Devolver mensagens "failed" para a fila, com tentativas zeradas"""
+    query = db.query(OutboxMessage).filter(OutboxMessage.status == "failed")
+    if topic:
+        query = query.filter(OutboxMessage.topic == topic)
+    requeued = query.update(
+        {"status": "pending", "attempts": 0, "available_at": datetime.now()},
+        synchronize_session=False
+    )
+    db.commit()
+    return requeued
+
+def stats(db: Session) -> dict:
+    """Profundidade da fila, atraso e contadores do worker"""
+    now = datetime.now()
+    by_status = dict(
+        db.query(OutboxMessage.status, func.count(OutboxMessage.id))
+        .group_by(OutboxMessage.status)
+        .all()
+    )
+    oldest_pending = (
+        db.query(func.min(OutboxMessage.created_at))
+        .filter(OutboxMessage.status == "pending")
+        .scalar()
+    )
+    due = (
+        db.query(func.count(OutboxMessage.id))
+        .filter(OutboxMessage.status == "pending", OutboxMessage.available_at <= now)
+        .scalar()
+    )
+    by_topic = dict(
+        db.query(OutboxMessage.topic, func.count(OutboxMessage.id))
+        .filter(OutboxMessage.status == "pending")
+        .group_by(OutboxMessage.topic)
+        .all()
+    )
+    return {
+        "depth": by_status.get("pending", 0),
+        "due": due,
+        "failed": by_status.get("failed", 0),
+        "done": by_status.get("done", 0),
+        "pending_by_topic": by_topic,
+        "lag_seconds": _seconds_since(now, oldest_pending) if oldest_pending else 0.0,
+        "worker": {
+            "mode": WORKER_MODE,
+            "running": worker.running,
+            "delivered": worker.delivered,
+            "retried": worker.retried,
+            "failed": worker.failed,
+            "last_batch_at": worker.last_batch_at,
+            "last_batch_size": worker.last_batch_size,
+            "last_batch_seconds": round(worker.last_batch_seconds, 4),
+            "last_delivery_lag_seconds": round(worker.last_delivery_lag_seconds, 4),
+        },
+        "relay": {
+            "running": relay_worker.running,
+            "relayed": relay_worker.relayed,
+        },
+    }
+
+if __name__ == "__main__":
+    # Worker em processo separado: carrega os modelos, registra os
+    # handlers e drena a fila (pelo nome do pacote, não por __main__, para
+    # usar o mesmo registro de handlers)
+    from backend.database import create_tables
+    from backend.services import nfce, outbox, sale_effects  # noqa: F401
+
+    create_tables()
+    print("🚚 Worker do outbox iniciado")
+    try:
+        asyncio.run(outbox.worker.run_forever())
+    except KeyboardInterrupt:
+        pass
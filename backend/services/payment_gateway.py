@@ -0,0 +1,318 @@
+"""
+Adaptador assíncrono para adquirentes (cartão, PIX).
+
+Os pagamentos de métodos com `requires_approval` são gravados como
+"pending" e autorizados depois da resposta, por uma tarefa assíncrona que
+chama o gateway com timeout por chamada, concorrência limitada e novas
+tentativas. O `transaction_id` é a chave de idempotência: repetir a mesma
+transação devolve o resultado já obtido, sem nova cobrança.
+
+Timeout ou adquirente indisponível não são recusa: o resultado é
+desconhecido e o pagamento continua "pending". A varredura
+(`PendingPaymentSweeper`) repete a autorização dos pendentes cuja última
+tentativa passou de RETRY_SECONDS, inclusive os que ficaram sem resposta
+quando o servidor caiu ou reiniciou.
+
+O `SimulatorGateway` roda no próprio processo, com latência e taxas de
+recusa/falha configuráveis, para testes e para o benchmark.
+"""
+
+import asyncio
+import os
+import random
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from backend.database import SessionLocal
+
+DEFAULT_TIMEOUT_SECONDS = float(os.getenv("PDV_GATEWAY_TIMEOUT", "5"))
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("PDV_GATEWAY_MAX_CONCURRENCY", "50"))
+DEFAULT_MAX_ATTEMPTS = int(os.getenv("PDV_GATEWAY_MAX_ATTEMPTS", "3"))
+DEFAULT_RETRY_BACKOFF_SECONDS = 0.2
+# Intervalo entre tentativas de um pagamento ainda pendente (maior que a
+# duração de todas as tentativas de uma autorização)
+RETRY_SECONDS = float(os.getenv("PDV_GATEWAY_RETRY_SECONDS", "60"))
+SWEEP_BATCH_SIZE = 200
+
+class GatewayUnavailable(Exception):
+    """Falha transitória do adquirente; a chamada pode ser repetida"""
+
+@dataclass(frozen=True)
+class AuthorizationRequest:
+    transaction_id: str
+    amount: float
+    method_type: str
+    sale_id: Optional[int] = None
+
+@dataclass(frozen=True)
+class AuthorizationResult:
+    transaction_id: str
+    approved: bool
+    authorization_code: Optional[str] = None
+    decline_reason: Optional[str] = None
+    # Sem resposta do adquirente (timeout, indisponível): resultado
+    # desconhecido, não é recusa
+    error: Optional[str] = None
+
+class PaymentGateway(ABC):
+    """Interface de um adquirente"""
+
+    @abstractmethod
+    async def authorize(self, request: AuthorizationRequest) -> AuthorizationResult:
+        """Autorizar a transação; deve ser idempotente por transaction_id"""
+
+class SimulatorGateway(PaymentGateway):
+    """Adquirente simulado em processo, para testes e benchmark"""
+
+    def __init__(
+        self,
+        latency: float = 0.05,
+        jitter: float = 0.0,
+        decline_rate: float = 0.0,
+        failure_rate: float = 0.0,
+        seed: Optional[int] = None
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.decline_rate = decline_rate
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._results: Dict[str, AuthorizationResult] = {}
+        self.calls = 0
+
+    async def authorize(self, request: AuthorizationRequest) -> AuthorizationResult:
+        self.calls += 1
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        # Repetições da mesma transação devolvem o resultado original
+        existing = self._results.get(request.transaction_id)
+        if existing:
+            return existing
+
+        if self._random.random() < self.failure_rate:
+            raise GatewayUnavailable("Adquirente simulado indisponível")
+
+        if self._random.random() < self.decline_rate:
+            result = AuthorizationResult(
+                transaction_id=request.transaction_id,
+                approved=False,
+                decline_reason="Transação recusada pelo emissor (simulador)"
+            )
+        else:
+            result = AuthorizationResult(
+                transaction_id=request.transaction_id,
+                approved=True,
+                authorization_code=f"SIM{self._random.randrange(10**6):06d}"
+            )
+        self._results[request.transaction_id] = result
+        return result
+
+class GatewayClient:
+    """Chamada ao gateway com timeout, concorrência limitada e novas tentativas"""
+
+    def __init__(
+        self,
+        gateway: PaymentGateway,
+        timeout: float = DEFAULT_TIMEOUT_SECONDS,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        retry_backoff: float = DEFAULT_RETRY_BACKOFF_SECONDS
+    ):
+        self.gateway = gateway
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # Criado sob demanda para pertencer ao event loop em execução
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def authorize(self, request: AuthorizationRequest) -> AuthorizationResult:
+        """Autorizar repetindo timeouts e falhas transitórias com o mesmo transaction_id"""
+        last_error = "Falha desconhecida"
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                async with self._get_semaphore():
+                    return await asyncio.wait_for(self.gateway.authorize(request), timeout=self.timeout)
+            except asyncio.TimeoutError:
+                last_error = f"Tempo esgotado após {self.timeout}s"
+            except GatewayUnavailable as exc:
+                last_error = str(exc) or "Adquirente indisponível"
+
+            if attempt < self.max_attempts:
+                await asyncio.sleep(self.retry_backoff * (2 ** (attempt - 1)))
+
+        return AuthorizationResult(
+            transaction_id=request.transaction_id,
+            approved=False,
+            error=f"Sem resposta após {self.max_attempts} tentativas: {last_error}"
+        )
+
+def _default_gateway() -> PaymentGateway:
+    return SimulatorGateway(
+        latency=float(os.getenv("PDV_SIMULATOR_LATENCY_MS", "50")) / 1000,
+        decline_rate=float(os.getenv("PDV_SIMULATOR_DECLINE_RATE", "0")),
+        failure_rate=float(os.getenv("PDV_SIMULATOR_FAILURE_RATE", "0"))
+    )
+
+_client = GatewayClient(_default_gateway())
+
+def get_client() -> GatewayClient:
+    return _client
+
+def set_gateway(gateway: PaymentGateway, **options) -> GatewayClient:
+    """Trocar o adquirente usado pelos pagamentos (ex.: integração real ou testes)"""
+    global _client
+    _client = GatewayClient(gateway, **options)
+    return _client
+
+def new_transaction_id() -> str:
+    return uuid.uuid4().hex
+
+def _apply_result(payment_id: int, result: AuthorizationResult):
+    """Gravar o resultado da autorização no pagamento e na venda"""
+    from backend.models.payment import Payment
+    from backend.models.sale import Sale
+    from backend.services import events, settlement, shifts
+
+    db = SessionLocal()
+    try:
+        payment = db.query(Payment).filter(Payment.id == payment_id).first()
+        if not payment or payment.status != "pending":
+            return
+
+        if result.error:
+            # Continua pendente; a varredura tenta de novo
+            payment.attempted_at = datetime.now()
+            db.commit()
+            print(f"⚠️ Pagamento {payment_id}: {result.error}")
+            return
+
+        payment.status = "approved" if result.approved else "declined"
+        payment.authorization_code = result.authorization_code
+        payment.decline_reason = result.decline_reason
+        payment.processed_at = datetime.now()
+
+        if result.approved:
+            settlement.register_approved_payment(db, payment.sale_id, payment.amount)
+            # Conta no caixa em que o pagamento foi criado
+            shifts.record_payments(db, [(payment.shift_id, payment.payment_method_id, payment.amount, False)])
+
+        db.commit()
+        # Roda no threadpool: o barramento entrega no loop do servidor
+        events.publish_payment(db, payment, db.query(Sale).filter(Sale.id == payment.sale_id).first())
+    finally:
+        db.close()
+
+async def authorize_payment(payment_id: int, request: AuthorizationRequest):
+    """Autorizar um pagamento pendente fora da requisição que o criou"""
+    result = await get_client().authorize(request)
+    await run_in_threadpool(_apply_result, payment_id, result)
+    return result
+
+def claim_due(db, limit: int = SWEEP_BATCH_SIZE) -> List[Tuple[int, AuthorizationRequest]]:
+    """Reservar os pagamentos pendentes cuja última tentativa venceu.
+
+    A reserva é um UPDATE condicional de `attempted_at`: com mais de um
+    processo, cada pagamento é retomado por um só.
+    """
+    from backend.models.payment import Payment, PaymentMethod
+
+    now = datetime.now()
+    due = (
+        db.query(Payment.id, Payment.attempted_at, Payment.transaction_id, Payment.amount,
+                 Payment.sale_id, PaymentMethod.type)
+        .join(PaymentMethod, PaymentMethod.id == Payment.payment_method_id)
+        .filter(
+            Payment.status == "pending",
+            Payment.transaction_id.isnot(None),
+            Payment.attempted_at <= now - timedelta(seconds=RETRY_SECONDS)
+        )
+        .order_by(Payment.attempted_at)
+        .limit(limit)
+        .all()
+    )
+    claimed = []
+    for row in due:
+        updated = db.query(Payment).filter(
+            Payment.id == row.id,
+            Payment.status == "pending",
+            Payment.attempted_at == row.attempted_at
+        ).update({"attempted_at": now}, synchronize_session=False)
+        if updated:
+            claimed.append((row.id, AuthorizationRequest(
+                transaction_id=row.transaction_id,
+                amount=row.amount,
+                method_type=row.type,
+                sale_id=row.sale_id
+            )))
+    db.commit()
+    return claimed
+
+class PendingPaymentSweeper:
+    """Retomar as autorizações pendentes (no startup e a cada intervalo)"""
+
+    def __init__(self, session_factory=SessionLocal, interval: float = RETRY_SECONDS / 4):
+        self.session_factory = session_factory
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        # Métricas do processo
+        self.retried = 0
+        self.last_sweep_at: Optional[datetime] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """Iniciar a tarefa no loop corrente (startup do servidor)"""
+        if self.running:
+            return
+        self._task = asyncio.get_running_loop().create_task(self.run_forever())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def run_forever(self):
+        while True:
+            try:
+                await self.sweep_once()
+            except Exception as exc:
+                # Banco indisponível, por exemplo: tentar de novo no próximo ciclo
+                print(f"❌ Pagamentos pendentes: {exc}")
+            await asyncio.sleep(self.interval)
+
+    async def sweep_once(self) -> int:
+        """Autorizar de novo os pendentes vencidos, com a concorrência do cliente"""
+        claimed = await run_in_threadpool(self._claim)
+        await asyncio.gather(*(authorize_payment(payment_id, request) for payment_id, request in claimed))
+        self.retried += len(claimed)
+        self.last_sweep_at = datetime.now()
+        return len(claimed)
+
+    def _claim(self):
+        db = self.session_factory()
+        try:
+            return claim_due(db)
+        finally:
+            db.close()
+
+sweeper = PendingPaymentSweeper()
@@ -0,0 +1,92 @@
+"""
+Cache em memória dos métodos de pagamento.
+
+A tabela tem poucas linhas e quase nunca muda, então é carregada inteira
+na inicialização e servida da memória no caminho de pagamento. As rotas de
+escrita de métodos invalidam o cache; o TTL cobre alterações feitas por
+outros processos, e um id desconhecido recarrega a tabela (no máximo a
+cada MISS_RELOAD_SECONDS), para que um método recém-criado em outro
+processo já possa ser usado.
+"""
+
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from backend.models.payment import PaymentMethod
+
+CACHE_TTL_SECONDS = 300
+MISS_RELOAD_SECONDS = 5
+
+@dataclass(frozen=True)
+class CachedPaymentMethod:
+    id: int
+    name: str
+    type: str
+    requires_approval: bool
+    fee_percentage: float
+    active: bool
+
+    def fee_for(self, amount: float) -> float:
+        """Taxa cobrada sobre o valor informado"""
+        return (amount * (self.fee_percentage or 0)) / 100
+
+class PaymentMethodRegistry:
+    def __init__(self, ttl: float = CACHE_TTL_SECONDS):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._methods: Optional[Dict[int, CachedPaymentMethod]] = None
+        self._loaded_at = 0.0
+
+    def load(self, db: Session) -> Dict[int, CachedPaymentMethod]:
+        """Carregar todos os métodos do banco para a memória"""
+        methods = {
+            method.id: CachedPaymentMethod(
+                id=method.id,
+                name=method.name,
+                type=method.type,
+                requires_approval=bool(method.requires_approval),
+                fee_percentage=method.fee_percentage or 0,
+                active=method.active is not False
+            )
+            for method in db.query(PaymentMethod).all()
+        }
+        with self._lock:
+            self._methods = methods
+            self._loaded_at = time.monotonic()
+        return methods
+
+    def invalidate(self):
+        with self._lock:
+            self._methods = None
+
+    def _current(self, db: Session) -> Dict[int, CachedPaymentMethod]:
+        with self._lock:
+            methods = self._methods
+            expired = time.monotonic() - self._loaded_at > self.ttl
+        if methods is None or expired:
+            methods = self.load(db)
+        return methods
+
+    def get(self, db: Session, method_id: int) -> Optional[CachedPaymentMethod]:
+        methods = self._current(db)
+        method = methods.get(method_id)
+        if method is not None:
+            return method
+        with self._lock:
+            recent = time.monotonic() - self._loaded_at < MISS_RELOAD_SECONDS
+        if recent:
+            return None
+        return self.load(db).get(method_id)
+
+    def all(self, db: Session) -> List[CachedPaymentMethod]:
+        return list(self._current(db).values())
+
+    def name_of(self, db: Session, method_id: int) -> Optional[str]:
+        method = self.get(db, method_id)
+        return method.name if method else None
+
+registry = PaymentMethodRegistry()
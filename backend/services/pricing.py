@@ -0,0 +1,280 @@
+"""
+Motor de preços e promoções do checkout.
+
+As promoções ativas são compiladas em tabelas em memória: cada produto com
+regra própria ou da sua categoria tem uma tupla com todas as regras que o
+alcançam (produto, categoria e gerais); os demais compartilham a tupla das
+regras gerais. Regras de cliente ficam em tabelas separadas por cliente.
+Precificar uma linha é uma consulta a dicionário e uma passada pelas
+poucas regras do produto, sem tocar no banco.
+
+O preço unitário é sempre o do cadastro. Das promoções vigentes vale a que
+dá o maior desconto à linha (não se acumulam); o desconto manual do item
+só prevalece quando é maior que o da promoção e não pode passar de
+PDV_MAX_MANUAL_DISCOUNT por cento (acima disso a linha é recusada). O
+mesmo limite vale para o desconto em reais da venda inteira.
+
+As tabelas são recompiladas quando promoções ou produtos mudam (as rotas
+chamam `invalidate`) e, para alterações feitas por outros processos, após
+o TTL.
+"""
+
+import math
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from backend.models.product import Product
+from backend.models.promotion import Promotion
+
+CACHE_TTL_SECONDS = 60
+# Maior desconto manual por item, em %, sem autorização de gerente
+MAX_MANUAL_DISCOUNT = float(os.getenv("PDV_MAX_MANUAL_DISCOUNT", "10"))
+PROMOTION_TYPES = ("percentage", "fixed", "buy_x_get_y")
+
+class PriceError(Exception):
+    def __init__(self, product_id: int, detail: str):
+        super().__init__(detail)
+        self.product_id = product_id
+        self.detail = detail
+
+@dataclass(frozen=True)
+class Rule:
+    id: int
+    type: str
+    value: float
+    buy_quantity: int
+    get_quantity: int
+    priority: int
+    starts_at: float
+    ends_at: float
+
+    def discount(self, price: float, quantity: int) -> float:
+        if self.type == "percentage":
+            return price * quantity * min(self.value, 100) / 100
+        if self.type == "fixed":
+            return min(self.value, price) * quantity
+        # Leve X, ganhe Y: a cada X + Y unidades, Y saem de graça
+        group = self.buy_quantity + self.get_quantity
+        return (quantity // group) * self.get_quantity * price if group > 0 else 0
+
+@dataclass(frozen=True)
+class CatalogProduct:
+    id: int
+    name: str
+    price: float
+    category_id: Optional[int]
+    active: bool
+
+@dataclass(frozen=True)
+class LinePrice:
+    product: CatalogProduct
+    quantity: int
+    unit_price: float
+    discount_amount: float
+    total_price: float
+    discount_percentage: float
+    promotion_id: Optional[int] = None
+
+class RuleTable:
+    """Regras por produto, com as gerais para produtos sem regra própria"""
+
+    def __init__(self, by_product: Dict[int, Tuple[Rule, ...]], general: Tuple[Rule, ...]):
+        self.by_product = by_product
+        self.general = general
+
+    def rules_for(self, product_id: int) -> Tuple[Rule, ...]:
+        return self.by_product.get(product_id, self.general)
+
+@dataclass
+class CompiledCatalog:
+    products: Dict[int, CatalogProduct]
+    barcodes: Dict[str, int]
+    rules: RuleTable
+    customer_rules: Dict[int, RuleTable]
+    compiled_at: float
+
+def _timestamp(value: Optional[datetime], default: float) -> float:
+    return value.timestamp() if value is not None else default
+
+def _compile_table(promotions: Iterable[Promotion], products_by_category: Dict[int, List[int]]) -> RuleTable:
+    general = []
+    specific: Dict[int, List[Rule]] = {}
+    for promotion in promotions:
+        rule = Rule(
+            id=promotion.id,
+            type=promotion.type,
+            value=promotion.value or 0,
+            buy_quantity=promotion.buy_quantity or 0,
+            get_quantity=promotion.get_quantity or 0,
+            priority=promotion.priority or 0,
+            starts_at=_timestamp(promotion.starts_at, -math.inf),
+            ends_at=_timestamp(promotion.ends_at, math.inf)
+        )
+        if promotion.product_id is not None:
+            specific.setdefault(promotion.product_id, []).append(rule)
+        elif promotion.category_id is not None:
+            for product_id in products_by_category.get(promotion.category_id, ()):
+                specific.setdefault(product_id, []).append(rule)
+        else:
+            general.append(rule)
+
+    general_rules = tuple(general)
+    return RuleTable(
+        {product_id: tuple(rules) + general_rules for product_id, rules in specific.items()},
+        general_rules
+    )
+
+def compile_catalog(db: Session) -> CompiledCatalog:
+    products = {}
+    barcodes = {}
+    for row in db.query(
+        Product.id, Product.name, Product.price, Product.category_id, Product.active, Product.barcode
+    ):
+        products[row.id] = CatalogProduct(row.id, row.name, row.price, row.category_id, row.active is not False)
+        if row.barcode:
+            barcodes[row.barcode] = row.id
+    products_by_category: Dict[int, List[int]] = {}
+    for product in products.values():
+        if product.category_id is not None:
+            products_by_category.setdefault(product.category_id, []).append(product.id)
+
+    # Promoções já vencidas ficam de fora; as futuras entram e são
+    # filtradas pela vigência na hora de precificar
+    now = datetime.now()
+    promotions = [
+        promotion for promotion in
+        db.query(Promotion).filter(Promotion.active == True, Promotion.type.in_(PROMOTION_TYPES))
+        if promotion.ends_at is None or promotion.ends_at > now
+    ]
+    by_customer: Dict[int, List[Promotion]] = {}
+    for promotion in promotions:
+        if promotion.customer_id is not None:
+            by_customer.setdefault(promotion.customer_id, []).append(promotion)
+
+    return CompiledCatalog(
+        products=products,
+        barcodes=barcodes,
+        rules=_compile_table([p for p in promotions if p.customer_id is None], products_by_category),
+        customer_rules={
+            customer_id: _compile_table(customer_promotions, products_by_category)
+            for customer_id, customer_promotions in by_customer.items()
+        },
+        compiled_at=time.time()
+    )
+
+def _best_rule(rules: Iterable[Rule], price: float, quantity: int, now: float) -> Tuple[float, Optional[Rule]]:
+    best_discount, best_rule = 0.0, None
+    for rule in rules:
+        if not rule.starts_at <= now < rule.ends_at:
+            continue
+        discount = rule.discount(price, quantity)
+        if discount > best_discount or (
+            best_rule is not None and discount == best_discount and rule.priority > best_rule.priority
+        ):
+            best_discount, best_rule = discount, rule
+    return best_discount, best_rule
+
+class PricingEngine:
+    def __init__(self, ttl: float = CACHE_TTL_SECONDS):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._catalog: Optional[CompiledCatalog] = None
+        self._loaded_at = 0.0
+
+    def load(self, db: Session) -> CompiledCatalog:
+        catalog = compile_catalog(db)
+        with self._lock:
+            self._catalog = catalog
+            self._loaded_at = time.monotonic()
+        return catalog
+
+    def invalidate(self):
+        with self._lock:
+            self._catalog = None
+
+    def current(self, db: Session) -> CompiledCatalog:
+        with self._lock:
+            catalog = self._catalog
+            expired = time.monotonic() - self._loaded_at > self.ttl
+        if catalog is None or expired:
+            catalog = self.load(db)
+        return catalog
+
+    def price_line(
+        self,
+        catalog: CompiledCatalog,
+        product_id: int,
+        quantity: int,
+        customer_id: Optional[int] = None,
+        manual_percentage: float = 0,
+        now: Optional[float] = None
+    ) -> LinePrice:
+        product = catalog.products.get(product_id)
+        if product is None or not product.active:
+            raise PriceError(product_id, f"Produto ID {product_id} não encontrado ou inativo")
+
+        if quantity <= 0:
+            raise PriceError(product_id, f"Quantidade inválida para o produto {product.name}")
+
+        manual_percentage = manual_percentage or 0
+        if not 0 <= manual_percentage <= MAX_MANUAL_DISCOUNT:
+            raise PriceError(
+                product_id,
+                f"Desconto manual de {manual_percentage:g}% no produto {product.name} "
+                f"fora do limite de {MAX_MANUAL_DISCOUNT:g}%"
+            )
+
+        now = time.time() if now is None else now
+        price = product.price
+        gross = price * quantity
+        discount, rule = _best_rule(catalog.rules.rules_for(product_id), price, quantity, now)
+        customer_table = catalog.customer_rules.get(customer_id) if customer_id is not None else None
+        if customer_table is not None:
+            customer_discount, customer_rule = _best_rule(customer_table.rules_for(product_id), price, quantity, now)
+            if customer_discount > discount:
+                discount, rule = customer_discount, customer_rule
+
+        manual = gross * manual_percentage / 100
+        if manual > discount:
+            discount, rule = manual, None
+
+        discount = round(min(discount, gross), 2)
+        return LinePrice(
+            product=product,
+            quantity=quantity,
+            unit_price=price,
+            discount_amount=discount,
+            total_price=round(gross - discount, 2),
+            discount_percentage=round(discount / gross * 100, 4) if gross else 0,
+            promotion_id=rule.id if rule else None
+        )
+
+    def sale_discount_error(self, discount_amount: float, total_amount: float) -> Optional[str]:
+        """Motivo para recusar o desconto da venda inteira, ou None"""
+        limit = round(total_amount * MAX_MANUAL_DISCOUNT / 100, 2)
+        if (discount_amount or 0) > limit:
+            return (
+                f"Desconto de R$ {discount_amount:.2f} acima do limite de "
+                f"{MAX_MANUAL_DISCOUNT:g}% do total (R$ {limit:.2f})"
+            )
+        return None
+
+    def price_items(self, db: Session, items: Iterable, customer_id: Optional[int] = None) -> List[LinePrice]:
+        """Precificar as linhas (product_id, quantity, discount_percentage)"""
+        catalog = self.current(db)
+        now = time.time()
+        return [
+            self.price_line(
+                catalog, item.product_id, item.quantity, customer_id,
+                getattr(item, "discount_percentage", 0) or 0, now
+            )
+            for item in items
+        ]
+
+engine = PricingEngine()
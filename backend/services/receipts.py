@@ -0,0 +1,180 @@
+"""
+Recibos de venda pré-gerados.
+
+O recibo (JSON e impressão térmica ESC/POS) é montado uma vez, quando a
+venda é gravada, com os nomes e preços daquele momento, e guardado
+compactado em `sale_receipts`. Reimpressões e o visor do cliente leem só
+essa linha pela chave primária, com ETag forte para responder 304.
+
+Pagamentos só marcam o recibo como desatualizado (um UPDATE); a situação
+do pagamento é atualizada no recibo guardado na próxima leitura, sem
+remontar os itens.
+"""
+
+import hashlib
+import json
+import os
+import zlib
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from backend.models.receipt import SaleReceipt
+from backend.models.sale import Sale
+
+COLUMNS = int(os.getenv("PDV_RECEIPT_COLUMNS", "48"))
+
+ESC = b"\x1b"
+GS = b"\x1d"
+INIT = ESC + b"@"
+CODEPAGE_PC860 = ESC + b"t\x03"  # Português
+ALIGN_LEFT = ESC + b"a\x00"
+ALIGN_CENTER = ESC + b"a\x01"
+BOLD_ON = ESC + b"E\x01"
+BOLD_OFF = ESC + b"E\x00"
+FEED_AND_CUT = GS + b"V\x41\x03"
+
+def build_receipt(sale: Sale, lines: Iterable[dict], customer_name: Optional[str]) -> dict:
+    """Dados do recibo; cada linha traz product_name, quantity, unit_price e total_price"""
+    return {
+        "sale_id": sale.id,
+        "date": sale.created_at.strftime("%d/%m/%Y %H:%M"),
+        "customer": customer_name or "Cliente não identificado",
+        "items": [
+            {
+                "product_name": line["product_name"],
+                "quantity": line["quantity"],
+                "unit_price": line["unit_price"],
+                "total_price": line["total_price"]
+            }
+            for line in lines
+        ],
+        "subtotal": sale.total_amount,
+        "discount": sale.discount_amount,
+        "total": sale.final_amount,
+        "payment_method": sale.payment_method,
+        "payment_status": sale.payment_status
+    }
+
+def _money(value) -> str:
+    text = f"{value or 0:,.2f}"
+    return "R$ " + text.replace(",", "_").replace(".", ",").replace("_", ".")
+
+def _columns(left: str, right: str, width: int = COLUMNS) -> str:
+    left = left[:max(width - len(right) - 1, 0)]
+    return left + " " * (width - len(left) - len(right)) + right
+
+def render_escpos(receipt: dict, width: int = COLUMNS) -> bytes:
+    """Impressão do recibo em ESC/POS para impressora térmica"""
+    def text(value: str) -> bytes:
+        return (value + "\n").encode("cp860", errors="replace")
+
+    separator = text("-" * width)
+    out = [INIT, CODEPAGE_PC860, ALIGN_CENTER, BOLD_ON, text("RECIBO DE VENDA"), BOLD_OFF]
+    out.append(text(f"Venda #{receipt['sale_id']}  {receipt['date']}"))
+    out.append(ALIGN_LEFT)
+    out.append(text(f"Cliente: {receipt['customer']}"[:width]))
+    out.append(separator)
+    for item in receipt["items"]:
+        out.append(text(item["product_name"][:width]))
+        out.append(text(_columns(
+            f"  {item['quantity']} x {_money(item['unit_price'])}",
+            _money(item["total_price"]),
+            width
+        )))
+    out.append(separator)
+    out.append(text(_columns("Subtotal", _money(receipt["subtotal"]), width)))
+    if receipt["discount"]:
+        out.append(text(_columns("Desconto", "-" + _money(receipt["discount"]), width)))
+    out += [BOLD_ON, text(_columns("TOTAL", _money(receipt["total"]), width)), BOLD_OFF]
+    out.append(text(_columns("Pagamento", str(receipt["payment_method"]), width)))
+    out.append(text(_columns("Situação", str(receipt["payment_status"]), width)))
+    out += [text(""), FEED_AND_CUT]
+    return b"".join(out)
+
+def _encode(receipt: dict) -> dict:
+    payload = json.dumps(receipt, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return {
+        "sale_id": receipt["sale_id"],
+        "etag": hashlib.sha256(payload).hexdigest()[:32],
+        "payload": zlib.compress(payload),
+        "escpos": zlib.compress(render_escpos(receipt)),
+        "stale": False,
+    }
+
+def store_receipt(db: Session, receipt: dict) -> SaleReceipt:
+    """Guardar (ou substituir) o recibo de uma venda"""
+    values = _encode(receipt)
+    snapshot = db.query(SaleReceipt).filter(SaleReceipt.sale_id == receipt["sale_id"]).first()
+    if snapshot is None:
+        snapshot = SaleReceipt(**values)
+        db.add(snapshot)
+    else:
+        for field, value in values.items():
+            setattr(snapshot, field, value)
+    return snapshot
+
+def receipt_rows(receipts: List[dict]) -> List[dict]:
+    """Linhas para inserção em massa (vendas em lote)"""
+    now = datetime.now()
+    return [dict(_encode(receipt), created_at=now) for receipt in receipts]
+
+def mark_stale(db: Session, sale_id: int):
+    """Sinalizar que a situação do pagamento mudou"""
+    db.execute(
+        update(SaleReceipt)
+        .where(SaleReceipt.sale_id == sale_id, SaleReceipt.stale == False)
+        .values(stale=True)
+        .execution_options(synchronize_session=False)
+    )
+
+def get_receipt(db: Session, sale_id: int) -> Optional[SaleReceipt]:
+    """Recibo guardado da venda, gerando-o se faltar ou estiver desatualizado"""
+    snapshot = db.query(SaleReceipt).filter(SaleReceipt.sale_id == sale_id).first()
+    if snapshot is not None and not snapshot.stale:
+        return snapshot
+
+    if snapshot is not None:
+        # Só a situação do pagamento muda: itens e nomes ficam como na venda
+        sale = db.query(Sale.payment_method, Sale.payment_status).filter(Sale.id == sale_id).first()
+        receipt = json.loads(zlib.decompress(snapshot.payload))
+        receipt["payment_method"] = sale.payment_method
+        receipt["payment_status"] = sale.payment_status
+    else:
+        # Vendas anteriores aos recibos guardados: montar uma vez a partir
+        # dos dados atuais
+        sale = db.query(Sale).filter(Sale.id == sale_id).first()
+        if not sale:
+            return None
+        receipt = build_receipt(
+            sale,
+            [
+                {
+                    "product_name": item.product.name,
+                    "quantity": item.quantity,
+                    "unit_price": item.unit_price,
+                    "total_price": item.total_price
+                }
+                for item in sale.items
+            ],
+            sale.customer.name if sale.customer else None
+        )
+    snapshot = store_receipt(db, receipt)
+    db.commit()
+    return snapshot
+
+def etag_for(snapshot: SaleReceipt, fmt: str = "json") -> str:
+    if fmt == "escpos":
+        return f'"{snapshot.etag}-escpos"'
+    return f'"{snapshot.etag}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [value.strip() for value in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+def content(snapshot: SaleReceipt, fmt: str = "json") -> bytes:
+    return zlib.decompress(snapshot.escpos if fmt == "escpos" else snapshot.payload)
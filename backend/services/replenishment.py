@@ -0,0 +1,402 @@
+"""
+Sugestões de reposição a partir da velocidade de vendas.
+
+O `min_stock` do cadastro é um limite fixo; aqui a demanda de cada produto
+sai do histórico de saídas (`InventoryMovement` "out") e o cálculo é feito
+com NumPy sobre o catálogo inteiro da loja de uma vez:
+
+- o banco agrupa as saídas por produto e dia, e as linhas são lidas em
+  blocos direto para arrays, somando por produto com `bincount` (total,
+  soma dos quadrados e primeiro dia com venda), sem um laço por produto;
+- demanda diária média e desvio padrão consideram os dias sem venda, desde
+  o primeiro dia com venda na janela (`PDV_REPLENISHMENT_WINDOW` dias);
+- estoque de segurança = z(nível de serviço) x desvio x raiz(prazo de
+  entrega); ponto de pedido = demanda no prazo + segurança, nunca abaixo
+  do `min_stock`;
+- abaixo do ponto de pedido, a sugestão completa até o ponto de pedido
+  mais a demanda do ciclo de revisão, limitada ao `max_stock`.
+
+Roda uma vez por noite (`PDV_REPLENISHMENT_HOUR`) em segundo plano, ou
+por `python -m backend.services.replenishment`, e grava o resultado em
+`replenishment_suggestions`, de onde as rotas leem.
+"""
+
+import asyncio
+import math
+import os
+import time
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from statistics import NormalDist
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import Session
+
+from backend.database import SessionLocal
+from backend.models.inventory import Inventory, InventoryMovement
+from backend.models.product import Product
+from backend.models.replenishment import ReplenishmentRun, ReplenishmentSuggestion
+from backend.services.bulk import bulk_insert
+from backend.services.settlement import date_range_filter
+
+WINDOW_DAYS = int(os.getenv("PDV_REPLENISHMENT_WINDOW", "365"))
+# Histórico mínimo considerado, para que um produto novo não pareça
+# vender demais por ter poucos dias de janela
+MIN_HISTORY_DAYS = int(os.getenv("PDV_REPLENISHMENT_MIN_HISTORY", "14"))
+LEAD_TIME_DAYS = float(os.getenv("PDV_REPLENISHMENT_LEAD_TIME", "7"))
+REVIEW_DAYS = float(os.getenv("PDV_REPLENISHMENT_REVIEW", "7"))
+SERVICE_LEVEL = float(os.getenv("PDV_REPLENISHMENT_SERVICE_LEVEL", "0.95"))
+RUN_HOUR = int(os.getenv("PDV_REPLENISHMENT_HOUR", "2"))
+# "off" desliga a execução noturna no servidor (ex.: rodando via cron)
+SCHEDULER_MODE = os.getenv("PDV_REPLENISHMENT_SCHEDULER", "on")
+# Linhas (produto, dia) por bloco lido do banco
+FETCH_SIZE = 100_000
+
+@dataclass
+class Parameters:
+    window_days: int = WINDOW_DAYS
+    min_history_days: int = MIN_HISTORY_DAYS
+    lead_time_days: float = LEAD_TIME_DAYS
+    review_days: float = REVIEW_DAYS
+    service_level: float = SERVICE_LEVEL
+
+    @property
+    def z(self) -> float:
+        return NormalDist().inv_cdf(min(max(self.service_level, 0.5), 0.9999))
+
+@dataclass
+class Catalog:
+    """Estoque da loja em arrays, ordenado por product_id"""
+    product_ids: np.ndarray
+    available: np.ndarray
+    min_stock: np.ndarray
+    max_stock: np.ndarray  # NaN sem máximo
+
+@dataclass
+class Demand:
+    """Saídas por produto do catálogo na janela"""
+    total: np.ndarray
+    total_sq: np.ndarray  # Soma dos quadrados das saídas diárias
+    first_day: np.ndarray  # Dias desde o início da janela; janela inteira sem venda
+    rows: int = 0
+
+def load_catalog(db: Session, store_id: int) -> Catalog:
+    """Estoque dos produtos ativos da loja"""
+    rows = db.execute(
+        select(
+            Inventory.product_id,
+            Inventory.quantity - func.coalesce(Inventory.reserved_quantity, 0),
+            func.coalesce(Inventory.min_stock, 0),
+            Inventory.max_stock
+        )
+        .join(Product, Product.id == Inventory.product_id)
+        .where(Inventory.store_id == store_id, Product.active == True)
+        .order_by(Inventory.product_id)
+    ).all()
+    if not rows:
+        empty = np.empty(0)
+        return Catalog(empty.astype(np.int64), empty, empty, empty)
+    product_ids, available, min_stock, max_stock = zip(*rows)
+    return Catalog(
+        product_ids=np.array(product_ids, dtype=np.int64),
+        available=np.array(available, dtype=np.float64),
+        min_stock=np.array(min_stock, dtype=np.float64),
+        max_stock=np.array([np.nan if value is None else value for value in max_stock], dtype=np.float64)
+    )
+
+def load_demand(db: Session, store_id: int, catalog: Catalog, start: date, end: date) -> Demand:
+    """Somar as saídas diárias da loja por produto, em blocos, sem guardar as linhas"""
+    size = len(catalog.product_ids)
+    window = (end - start).days + 1
+    demand = Demand(
+        total=np.zeros(size),
+        total_sq=np.zeros(size),
+        first_day=np.full(size, window, dtype=np.int64)
+    )
+    if not size:
+        return demand
+
+    day = func.date(InventoryMovement.created_at)
+    statement = (
+        select(InventoryMovement.product_id, day, func.sum(InventoryMovement.quantity))
+        .where(
+            InventoryMovement.store_id == store_id,
+            InventoryMovement.movement_type == "out",
+            date_range_filter(InventoryMovement.created_at, start, end)
+        )
+        .group_by(InventoryMovement.product_id, day)
+    )
+    # Cursor do driver direto (nomeado, no servidor, no PostgreSQL): as
+    # linhas viram arrays por bloco, sem montar um Row do SQLAlchemy por linha
+    dialect = db.get_bind().dialect
+    compiled = statement.compile(dialect=dialect)
+    params = compiled.construct_params()
+    if compiled.positional:
+        params = [params[name] for name in compiled.positiontup]
+    raw = db.connection().connection
+    cursor = raw.cursor(name="replenishment_demand") if dialect.name == "postgresql" else raw.cursor()
+    cursor.execute(str(compiled), params)
+    origin = np.datetime64(start.isoformat(), "D")
+    try:
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            # O dia chega como texto (SQLite) ou date (PostgreSQL)
+            block = np.array(rows, dtype=[("product_id", np.int64), ("day", object), ("quantity", np.float64)])
+            product_ids = block["product_id"]
+            quantities = block["quantity"]
+            offsets = (block["day"].astype("datetime64[D]") - origin).astype(np.int64)
+
+            # Posição no catálogo; saídas de produtos fora dele (inativos) ficam de fora
+            index = np.searchsorted(catalog.product_ids, product_ids)
+            index[index == size] = 0
+            known = catalog.product_ids[index] == product_ids
+            index, quantities, offsets = index[known], quantities[known], offsets[known]
+
+            demand.total += np.bincount(index, weights=quantities, minlength=size)
+            demand.total_sq += np.bincount(index, weights=quantities * quantities, minlength=size)
+            np.minimum.at(demand.first_day, index, offsets)
+            demand.rows += len(rows)
+    finally:
+        cursor.close()
+    return demand
+
+def compute(catalog: Catalog, demand: Demand, window: int, params: Parameters) -> Dict[str, np.ndarray]:
+    """Velocidade, variabilidade, cobertura e sugestão para todo o catálogo"""
+    # Dias observados: do primeiro dia com venda até o fim da janela
+    days = np.clip(window - demand.first_day, min(params.min_history_days, window), window).astype(np.float64)
+    daily = demand.total / days
+    variance = np.maximum(demand.total_sq / days - daily * daily, 0)
+    std = np.sqrt(variance)
+
+    safety = np.ceil(params.z * std * math.sqrt(params.lead_time_days))
+    reorder_point = np.maximum(np.ceil(daily * params.lead_time_days + safety), catalog.min_stock)
+    target = reorder_point + np.ceil(daily * params.review_days)
+    # O máximo do cadastro limita o pedido, mas não abaixo do ponto de pedido
+    target = np.where(np.isnan(catalog.max_stock), target, np.maximum(np.minimum(target, catalog.max_stock), reorder_point))
+
+    needs_reorder = (catalog.available <= reorder_point) & ((daily > 0) | (catalog.min_stock > 0))
+    suggested = np.where(needs_reorder, np.maximum(target - catalog.available, 0), 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cover = np.where(daily > 0, np.maximum(catalog.available, 0) / daily, np.nan)
+
+    return {
+        "daily_demand": np.round(daily, 4),
+        "demand_std": np.round(std, 4),
+        "safety_stock": safety,
+        "reorder_point": reorder_point,
+        "days_of_cover": np.round(cover, 1),
+        "suggested_quantity": suggested,
+        "needs_reorder": needs_reorder,
+    }
+
+def run_store(db: Session, run: ReplenishmentRun, store_id: int, params: Parameters, today: date) -> int:
+    """Recalcular as sugestões de uma loja (sem commit); devolve quantos produtos"""
+    end = today - timedelta(days=1)
+    start = today - timedelta(days=params.window_days)
+    catalog = load_catalog(db, store_id)
+    demand = load_demand(db, store_id, catalog, start, end)
+    result = compute(catalog, demand, params.window_days, params)
+    run.demand_rows = (run.demand_rows or 0) + demand.rows
+
+    now = datetime.now()
+    cover = [None if math.isnan(value) else value for value in result["days_of_cover"].tolist()]
+    rows = [
+        {
+            "run_id": run.id,
+            "store_id": store_id,
+            "product_id": product_id,
+            "available": int(available),
+            "daily_demand": daily,
+            "demand_std": std,
+            "safety_stock": int(safety),
+            "reorder_point": int(reorder_point),
+            "days_of_cover": days_of_cover,
+            "suggested_quantity": int(suggested),
+            "needs_reorder": needs_reorder,
+            "computed_at": now
+        }
+        for product_id, available, daily, std, safety, reorder_point, days_of_cover, suggested, needs_reorder in zip(
+            catalog.product_ids.tolist(),
+            catalog.available.tolist(),
+            result["daily_demand"].tolist(),
+            result["demand_std"].tolist(),
+            result["safety_stock"].tolist(),
+            result["reorder_point"].tolist(),
+            cover,
+            result["suggested_quantity"].tolist(),
+            result["needs_reorder"].tolist()
+        )
+    ]
+    # Substitui as sugestões da loja na mesma transação: as rotas nunca
+    # veem a loja pela metade
+    db.execute(delete(ReplenishmentSuggestion).where(ReplenishmentSuggestion.store_id == store_id))
+    bulk_insert(db, ReplenishmentSuggestion, rows)
+    return len(rows)
+
+def run(db: Session, store_id: Optional[int] = None, params: Optional[Parameters] = None) -> ReplenishmentRun:
+    """Recalcular as sugestões de uma loja ou de todas, com commit por loja"""
+    params = params or Parameters()
+    started = time.perf_counter()
+    execution = ReplenishmentRun(
+        status="running",
+        window_days=params.window_days,
+        lead_time_days=params.lead_time_days,
+        review_days=params.review_days,
+        service_level=params.service_level,
+        stores=0,
+        products=0,
+        demand_rows=0
+    )
+    db.add(execution)
+    db.commit()
+
+    if store_id is not None:
+        store_ids = [store_id]
+    else:
+        store_ids = [row[0] for row in db.query(Inventory.store_id).filter(
+            Inventory.store_id.isnot(None)
+        ).distinct().order_by(Inventory.store_id).all()]
+
+    today = date.today()
+    try:
+        for current in store_ids:
+            execution.products += run_store(db, execution, current, params, today)
+            execution.stores += 1
+            db.commit()
+        execution.status = "done"
+    except Exception as exc:
+        db.rollback()
+        execution.status = "failed"
+        execution.error = str(exc)[:255]
+        raise
+    finally:
+        execution.duration_seconds = round(time.perf_counter() - started, 3)
+        execution.finished_at = datetime.now()
+        db.commit()
+        db.refresh(execution)
+    return execution
+
+def suggestions(
+    db: Session,
+    store_id: int,
+    only_reorder: bool = True,
+    skip: int = 0,
+    limit: int = 100
+) -> List[dict]:
+    """Sugestões gravadas da loja, as de menor cobertura primeiro"""
+    query = db.query(
+        ReplenishmentSuggestion, Product.name
+    ).join(Product, Product.id == ReplenishmentSuggestion.product_id).filter(
+        ReplenishmentSuggestion.store_id == store_id
+    )
+    if only_reorder:
+        query = query.filter(ReplenishmentSuggestion.needs_reorder == True)
+    rows = query.order_by(
+        ReplenishmentSuggestion.days_of_cover.is_(None),
+        ReplenishmentSuggestion.days_of_cover,
+        ReplenishmentSuggestion.product_id
+    ).offset(skip).limit(limit).all()
+    return [
+        {
+            "product_id": suggestion.product_id,
+            "product_name": name,
+            "available": suggestion.available,
+            "daily_demand": suggestion.daily_demand,
+            "demand_std": suggestion.demand_std,
+            "days_of_cover": suggestion.days_of_cover,
+            "safety_stock": suggestion.safety_stock,
+            "reorder_point": suggestion.reorder_point,
+            "suggested_quantity": suggestion.suggested_quantity,
+            "needs_reorder": suggestion.needs_reorder,
+            "computed_at": suggestion.computed_at
+        }
+        for suggestion, name in rows
+    ]
+
+def run_view(execution: Optional[ReplenishmentRun]) -> Optional[dict]:
+    if execution is None:
+        return None
+    return {
+        "id": execution.id,
+        "status": execution.status,
+        "window_days": execution.window_days,
+        "lead_time_days": execution.lead_time_days,
+        "review_days": execution.review_days,
+        "service_level": execution.service_level,
+        "stores": execution.stores,
+        "products": execution.products,
+        "demand_rows": execution.demand_rows,
+        "duration_seconds": execution.duration_seconds,
+        "error": execution.error,
+        "started_at": execution.started_at,
+        "finished_at": execution.finished_at
+    }
+
+def last_run(db: Session) -> Optional[dict]:
+    return run_view(db.query(ReplenishmentRun).order_by(ReplenishmentRun.id.desc()).first())
+
+class ReplenishmentScheduler:
+    """Execução noturna, no loop do servidor"""
+
+    def __init__(self, session_factory=SessionLocal, hour: int = RUN_HOUR):
+        self.session_factory = session_factory
+        self.hour = hour
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.running:
+            return
+        self._task = asyncio.get_running_loop().create_task(self.run_forever())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def seconds_until_next(self, now: Optional[datetime] = None) -> float:
+        now = now or datetime.now()
+        next_run = now.replace(hour=self.hour, minute=0, second=0, microsecond=0)
+        if next_run <= now:
+            next_run += timedelta(days=1)
+        return (next_run - now).total_seconds()
+
+    async def run_forever(self):
+        while True:
+            await asyncio.sleep(self.seconds_until_next())
+            try:
+                await asyncio.to_thread(self.run_once)
+            except Exception as exc:
+                print(f"❌ Reposição: {exc}")
+
+    def run_once(self, store_id: Optional[int] = None) -> dict:
+        db = self.session_factory()
+        try:
+            return run_view(run(db, store_id))
+        finally:
+            db.close()
+
+scheduler = ReplenishmentScheduler()
+
+if __name__ == "__main__":
+    # Execução avulsa (cron): recalcula todas as lojas e sai
+    from backend.database import create_tables
+
+    create_tables()
+    execution = scheduler.run_once()
+    print(
+        f"📦 Reposição: {execution['products']} produtos em {execution['stores']} lojas, "
+        f"{execution['demand_rows']} linhas de demanda, {execution['duration_seconds']}s"
+    )
@@ -0,0 +1,371 @@
+"""
+Reservas de estoque para carrinhos abertos e pedidos online.
+
+Cada dono (carrinho ou pedido) tem uma linha por produto em
+`stock_reservations`, com prazo de validade. O total reservado de cada
+produto fica em `Inventory.reserved_quantity`, ajustado na mesma transação
+em que a reserva é criada, alterada, liberada, vencida ou convertida em
+venda: o saldo disponível (quantity - reserved_quantity) sai da própria
+linha do estoque, sem somar reservas, por mais carrinhos que estejam
+abertos.
+
+Reservar é um UPDATE condicional que só soma ao reservado se houver saldo
+disponível, sem janela para reservas concorrentes. Liberar, vencer e
+converter primeiro mudam o status das reservas ainda ativas e só então
+descontam do reservado o que de fato mudou, para que duas liberações da
+mesma reserva não descontem duas vezes.
+
+Na venda as reservas do dono são convertidas (saem do reservado) antes da
+baixa do estoque. As vencidas são liberadas por uma tarefa em segundo
+plano que percorre o índice (status, expires_at) em lotes.
+"""
+
+import asyncio
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import bindparam, case, func, select, update
+from sqlalchemy.orm import Session
+
+from backend.database import SessionLocal
+from backend.models.inventory import Inventory
+from backend.models.reservation import StockReservation
+from backend.services.stock import InsufficientStock, available_quantity, supports_returning
+
+DEFAULT_TTL_SECONDS = int(os.getenv("PDV_RESERVATION_TTL", "900"))
+MAX_TTL_SECONDS = int(os.getenv("PDV_RESERVATION_MAX_TTL", "86400"))
+SWEEP_SECONDS = float(os.getenv("PDV_RESERVATION_SWEEP", "15"))
+SWEEP_BATCH_SIZE = 500
+
+def _ttl(ttl_seconds: Optional[int]) -> int:
+    return min(max(int(ttl_seconds or DEFAULT_TTL_SECONDS), 1), MAX_TTL_SECONDS)
+
+def _expire_loaded(db: Session):
+    # Mantém objetos já carregados na sessão coerentes com o banco
+    for obj in list(db.identity_map.values()):
+        if isinstance(obj, (Inventory, StockReservation)):
+            db.expire(obj)
+
+def _increase_reserved(db: Session, store_id: int, product_id: int, quantity: int) -> bool:
+    """Somar ao reservado se houver saldo disponível; falso se faltar"""
+    result = db.execute(
+        update(Inventory)
+        .where(
+            Inventory.product_id == product_id,
+            Inventory.store_id == store_id,
+            available_quantity() >= quantity
+        )
+        .values(reserved_quantity=func.coalesce(Inventory.reserved_quantity, 0) + quantity)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount > 0
+
+def _decrease_reserved(db: Session, totals: Dict[Tuple[int, int], int]):
+    """Descontar do reservado, uma instrução para todos os produtos"""
+    if not totals:
+        return
+    table = Inventory.__table__
+    remaining = func.coalesce(table.c.reserved_quantity, 0) - bindparam("released")
+    db.execute(
+        update(table)
+        .where(table.c.store_id == bindparam("b_store_id"), table.c.product_id == bindparam("b_product_id"))
+        .values(reserved_quantity=case((remaining > 0, remaining), else_=0)),
+        [
+            {"b_store_id": store_id, "b_product_id": product_id, "released": quantity}
+            for (store_id, product_id), quantity in totals.items()
+        ]
+    )
+
+def _finish(db: Session, criteria: list, status: str, sale_id: Optional[int] = None) -> int:
+    """Encerrar as reservas ativas que atendem `criteria` e devolver o saldo"""
+    statement = (
+        update(StockReservation)
+        .where(*criteria, StockReservation.status == "active")
+        .values(status=status, sale_id=sale_id, updated_at=datetime.now())
+        .execution_options(synchronize_session=False)
+    )
+    if supports_returning(db):
+        rows = db.execute(statement.returning(
+            StockReservation.store_id, StockReservation.product_id, StockReservation.quantity
+        )).all()
+    else:
+        rows = db.query(
+            StockReservation.store_id, StockReservation.product_id, StockReservation.quantity
+        ).filter(*criteria, StockReservation.status == "active").all()
+        db.execute(statement)
+
+    totals: Dict[Tuple[int, int], int] = defaultdict(int)
+    for store_id, product_id, quantity in rows:
+        totals[(store_id, product_id)] += quantity
+    _decrease_reserved(db, totals)
+    _expire_loaded(db)
+    return len(rows)
+
+def _owner(owner_type: str, owner_id: str) -> list:
+    return [StockReservation.owner_type == owner_type, StockReservation.owner_id == owner_id]
+
+# Operações (sem commit: entram na transação de quem chama)
+
+def hold(
+    db: Session,
+    owner_type: str,
+    owner_id: str,
+    store_id: int,
+    product_id: int,
+    quantity: int,
+    ttl_seconds: Optional[int] = None
+) -> Optional[StockReservation]:
+    """Definir em `quantity` as unidades do produto reservadas para o dono.
+
+    Só a diferença para a reserva atual é somada ou descontada do
+    reservado. Levanta InsufficientStock se faltar saldo para o aumento;
+    devolve None se o produto não controla estoque na loja.
+    """
+    now = datetime.now()
+    reservation = db.query(StockReservation).filter(
+        *_owner(owner_type, owner_id),
+        StockReservation.store_id == store_id,
+        StockReservation.product_id == product_id
+    ).first()
+    current = reservation.quantity if reservation is not None and reservation.status == "active" else 0
+    delta = quantity - current
+
+    if delta > 0 and not _increase_reserved(db, store_id, product_id, delta):
+        available = db.query(available_quantity()).filter(
+            Inventory.product_id == product_id,
+            Inventory.store_id == store_id
+        ).first()
+        if available is None:
+            return None
+        raise InsufficientStock(product_id, max(available[0] + current, 0))
+    if delta < 0:
+        _decrease_reserved(db, {(store_id, product_id): -delta})
+    _expire_loaded(db)
+
+    expires_at = now + timedelta(seconds=_ttl(ttl_seconds))
+    if reservation is None:
+        if quantity <= 0:
+            return None
+        reservation = StockReservation(
+            owner_type=owner_type,
+            owner_id=owner_id,
+            store_id=store_id,
+            product_id=product_id,
+            quantity=quantity,
+            status="active",
+            expires_at=expires_at
+        )
+        db.add(reservation)
+    else:
+        reservation.quantity = quantity
+        reservation.status = "active" if quantity > 0 else "released"
+        reservation.expires_at = expires_at
+        reservation.sale_id = None
+    # A sessão não tem autoflush: as consultas seguintes precisam ver a linha
+    db.flush()
+    return reservation
+
+def reserve(
+    db: Session,
+    owner_type: str,
+    owner_id: str,
+    store_id: int,
+    items: Iterable[Tuple[int, int]],
+    ttl_seconds: Optional[int] = None
+) -> List[StockReservation]:
+    """Reservar os itens (product_id, quantity) e renovar as demais reservas do dono.
+
+    Tudo ou nada: se faltar saldo para um item, InsufficientStock é
+    levantada e quem chama desfaz a transação.
+    """
+    quantities: Dict[int, int] = defaultdict(int)
+    for product_id, quantity in items:
+        quantities[product_id] += quantity
+    for product_id, quantity in quantities.items():
+        hold(db, owner_type, owner_id, store_id, product_id, quantity, ttl_seconds)
+    renew(db, owner_type, owner_id, ttl_seconds)
+    return active(db, owner_type, owner_id)
+
+def renew(db: Session, owner_type: str, owner_id: str, ttl_seconds: Optional[int] = None) -> datetime:
+    """Estender o prazo de todas as reservas ativas do dono"""
+    expires_at = datetime.now() + timedelta(seconds=_ttl(ttl_seconds))
+    db.query(StockReservation).filter(
+        *_owner(owner_type, owner_id),
+        StockReservation.status == "active"
+    ).update({"expires_at": expires_at}, synchronize_session=False)
+    _expire_loaded(db)
+    return expires_at
+
+def release(db: Session, owner_type: str, owner_id: str) -> int:
+    """Liberar as reservas do dono (carrinho descartado, pedido cancelado)"""
+    return _finish(db, _owner(owner_type, owner_id), "released")
+
+def convert(db: Session, owner_type: str, owner_id: str, sale_id: int) -> int:
+    """Consumir as reservas do dono na venda, antes da baixa do estoque"""
+    return _finish(db, _owner(owner_type, owner_id), "converted", sale_id)
+
+def active(db: Session, owner_type: str, owner_id: str) -> List[StockReservation]:
+    return db.query(StockReservation).filter(
+        *_owner(owner_type, owner_id),
+        StockReservation.status == "active"
+    ).order_by(StockReservation.product_id).all()
+
+def held(db: Session, owner_type: str, owner_id: str, store_id: int) -> Dict[int, int]:
+    """Unidades reservadas pelo dono, por produto"""
+    return dict(
+        db.query(StockReservation.product_id, StockReservation.quantity).filter(
+            *_owner(owner_type, owner_id),
+            StockReservation.store_id == store_id,
+            StockReservation.status == "active"
+        ).all()
+    )
+
+def availability(db: Session, product_id: int, store_id: int) -> Optional[dict]:
+    """Em mãos, reservado e disponível do produto na loja"""
+    row = db.query(Inventory.quantity, Inventory.reserved_quantity).filter(
+        Inventory.product_id == product_id,
+        Inventory.store_id == store_id
+    ).first()
+    if row is None:
+        return None
+    reserved = row.reserved_quantity or 0
+    return {
+        "product_id": product_id,
+        "store_id": store_id,
+        "on_hand": row.quantity,
+        "reserved": reserved,
+        "available": row.quantity - reserved,
+    }
+
+# Expiração e manutenção
+
+def expire_due(db: Session, limit: int = SWEEP_BATCH_SIZE) -> int:
+    """Liberar um lote de reservas vencidas (com commit)"""
+    now = datetime.now()
+    ids = [
+        row.id for row in
+        db.query(StockReservation.id)
+        .filter(StockReservation.status == "active", StockReservation.expires_at <= now)
+        .order_by(StockReservation.expires_at)
+        .limit(limit)
+    ]
+    if not ids:
+        return 0
+    # O prazo entra de novo no filtro: reservas renovadas depois da leitura ficam
+    expired = _finish(db, [StockReservation.id.in_(ids), StockReservation.expires_at <= now], "expired")
+    db.commit()
+    return expired
+
+def rebuild_counters(db: Session) -> int:
+    """Recalcular o reservado de todo o estoque a partir das reservas ativas.
+
+    Usado na inicialização: corrige contadores de bancos anteriores às
+    reservas (coluna nula) ou alterados fora do sistema.
+    """
+    totals = (
+        select(func.coalesce(func.sum(StockReservation.quantity), 0))
+        .where(
+            StockReservation.store_id == Inventory.store_id,
+            StockReservation.product_id == Inventory.product_id,
+            StockReservation.status == "active"
+        )
+        .scalar_subquery()
+    )
+    updated = db.query(Inventory).update({"reserved_quantity": totals}, synchronize_session=False)
+    db.commit()
+    return updated
+
+class ReservationSweeper:
+    def __init__(self, session_factory=SessionLocal, interval: float = SWEEP_SECONDS):
+        self.session_factory = session_factory
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        # Métricas do processo
+        self.expired = 0
+        self.last_sweep_at: Optional[datetime] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """Iniciar a tarefa no loop corrente (startup do servidor)"""
+        if self.running:
+            return
+        self._task = asyncio.get_running_loop().create_task(self.run_forever())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def run_forever(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.sweep_once)
+            except Exception as exc:
+                # Banco indisponível, por exemplo: tentar de novo no próximo ciclo
+                print(f"❌ Reservas: {exc}")
+            await asyncio.sleep(self.interval)
+
+    def sweep_once(self) -> int:
+        """Liberar todas as reservas vencidas, em lotes"""
+        db = self.session_factory()
+        try:
+            expired = 0
+            while True:
+                batch = expire_due(db)
+                expired += batch
+                if batch < SWEEP_BATCH_SIZE:
+                    break
+            self.expired += expired
+            self.last_sweep_at = datetime.now()
+            return expired
+        finally:
+            db.close()
+
+sweeper = ReservationSweeper()
+
+def stats(db: Session) -> dict:
+    """Reservas ativas por tipo de dono, vencidas à espera da varredura e métricas"""
+    now = datetime.now()
+    by_owner = {
+        owner_type: {"reservations": count, "units": units or 0}
+        for owner_type, count, units in
+        db.query(
+            StockReservation.owner_type,
+            func.count(StockReservation.id),
+            func.sum(StockReservation.quantity)
+        )
+        .filter(StockReservation.status == "active")
+        .group_by(StockReservation.owner_type)
+        .all()
+    }
+    overdue = (
+        db.query(func.count(StockReservation.id))
+        .filter(StockReservation.status == "active", StockReservation.expires_at <= now)
+        .scalar()
+    )
+    next_expiry = (
+        db.query(func.min(StockReservation.expires_at))
+        .filter(StockReservation.status == "active", StockReservation.expires_at > now)
+        .scalar()
+    )
+    return {
+        "active": by_owner,
+        "overdue": overdue,
+        "next_expiry_at": next_expiry,
+        "sweeper": {
+            "running": sweeper.running,
+            "interval_seconds": sweeper.interval,
+            "expired": sweeper.expired,
+            "last_sweep_at": sweeper.last_sweep_at,
+        },
+    }
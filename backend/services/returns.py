@@ -0,0 +1,473 @@
+"""
+Cancelamento e devolução de vendas.
+
+Cancelar devolve ao estoque tudo o que ainda não voltou; devolver, só os
+itens informados. Nos dois casos o estorno de todas as vendas e produtos
+afetados é feito em conjunto, na transação de quem chama:
+
+- um UPDATE por loja soma ao estoque as quantidades de todos os produtos
+  (CASE por produto) e devolve os saldos novos;
+- os movimentos de entrada são gravados em massa, um por venda e produto,
+  com `reference_id` da venda;
+- os itens guardam a quantidade já devolvida, para que nada volte duas
+  vezes ao estoque;
+- os agregados das categorias recebem o negativo do que saiu na venda;
+- o valor já pago e estornado vira pagamentos "refunded" da venda, nas
+  formas dos pagamentos aprovados (do último para o primeiro), somados
+  aos estornos do caixa aberto no terminal que devolve;
+- o caixa em que a venda foi registrada desconta o valor devolvido (e a
+  venda, se cancelada).
+
+Cancelar em massa (ex.: anular as vendas de um terminal em um período)
+usa o mesmo caminho para muitas vendas de uma vez.
+"""
+
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import case, func, update
+from sqlalchemy.orm import Session
+
+from backend.database import round_money
+from backend.models.inventory import Inventory, InventoryMovement
+from backend.models.payment import Payment
+from backend.models.product import Product
+from backend.models.receipt import SaleReceipt
+from backend.models.sale import Sale, SaleItem
+from backend.services import categories as category_service
+from backend.services import shifts, stock_levels
+from backend.services.bulk import bulk_insert
+from backend.services.stock import supports_returning
+
+# Produtos por instrução e vendas por consulta IN
+CHUNK_SIZE = 500
+
+class ReturnError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+@dataclass
+class ReversalLine:
+    sale_id: int
+    store_id: int
+    sale_item_id: int
+    product_id: int
+    quantity: int
+    revenue: float  # Parte do total do item que está sendo estornada
+
+@dataclass
+class ReversalResult:
+    kind: str  # cancellation, return
+    sale_ids: List[int]
+    store_ids: List[int] = field(default_factory=list)
+    units: int = 0
+    returned_amount: float = 0.0
+    refunded_amount: float = 0.0
+    # (product_id, store_id, saldo anterior, saldo novo, estoque mínimo)
+    stock_changes: List[tuple] = field(default_factory=list)
+
+    def view(self) -> dict:
+        return {
+            "kind": self.kind,
+            "sale_ids": self.sale_ids,
+            "sales": len(self.sale_ids),
+            "units": self.units,
+            "returned_amount": round(self.returned_amount, 2),
+            "refunded_amount": round(self.refunded_amount, 2),
+            "products": len(self.stock_changes),
+        }
+
+def _chunks(values: List, size: int = CHUNK_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+def _restore_stock(db: Session, store_id: int, quantities: Dict[int, int]) -> Dict[int, Tuple[int, int, Optional[int]]]:
+    """Somar as quantidades ao estoque da loja; devolve (anterior, novo, mínimo) por produto"""
+    changes = {}
+    now = datetime.now()
+    for chunk in _chunks(sorted(quantities)):
+        delta = case({product_id: quantities[product_id] for product_id in chunk}, value=Inventory.product_id, else_=0)
+        statement = (
+            update(Inventory)
+            .where(Inventory.store_id == store_id, Inventory.product_id.in_(chunk))
+            .values(
+                quantity=Inventory.quantity + delta,
+                stock_level=stock_levels.level_expression(Inventory.quantity + delta),
+                last_updated=now
+            )
+            .execution_options(synchronize_session=False)
+        )
+        if supports_returning(db):
+            rows = db.execute(statement.returning(
+                Inventory.product_id, Inventory.quantity, Inventory.min_stock
+            )).all()
+            for product_id, new_quantity, min_stock in rows:
+                changes[product_id] = (new_quantity - quantities[product_id], new_quantity, min_stock)
+        else:
+            rows = db.query(Inventory.product_id, Inventory.quantity, Inventory.min_stock).filter(
+                Inventory.store_id == store_id,
+                Inventory.product_id.in_(chunk)
+            ).with_for_update().all()
+            db.execute(statement)
+            for product_id, previous_quantity, min_stock in rows:
+                changes[product_id] = (previous_quantity, previous_quantity + quantities[product_id], min_stock)
+
+    # Mantém objetos já carregados na sessão coerentes com o banco
+    for obj in list(db.identity_map.values()):
+        if isinstance(obj, Inventory):
+            db.expire(obj)
+    return changes
+
+def _reverse_lines(
+    db: Session,
+    lines: List[ReversalLine],
+    label: str,
+    reason: Optional[str],
+    terminal_id: Optional[str],
+    result: ReversalResult
+):
+    """Devolver ao estoque, gravar os movimentos e descontar dos agregados"""
+    by_store: Dict[int, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+    by_sale: Dict[Tuple[int, int, int], int] = defaultdict(int)
+    for line in lines:
+        by_store[line.store_id][line.product_id] += line.quantity
+        by_sale[(line.store_id, line.product_id, line.sale_id)] += line.quantity
+        result.units += line.quantity
+
+    movement_rows = []
+    now = datetime.now()
+    restocked = set()
+    for store_id, quantities in by_store.items():
+        changes = _restore_stock(db, store_id, quantities)
+        balance = {product_id: change[0] for product_id, change in changes.items()}
+        for product_id, (previous_quantity, new_quantity, min_stock) in sorted(changes.items()):
+            restocked.add((store_id, product_id))
+            result.stock_changes.append((product_id, store_id, previous_quantity, new_quantity, min_stock))
+        # Um movimento por venda e produto, encadeando os saldos em ordem de venda
+        for (line_store, product_id, sale_id), quantity in sorted(by_sale.items()):
+            if line_store != store_id or product_id not in balance:
+                continue
+            previous_quantity = balance[product_id]
+            balance[product_id] = previous_quantity + quantity
+            movement_rows.append({
+                "product_id": product_id,
+                "store_id": store_id,
+                "terminal_id": terminal_id,
+                "movement_type": "in",
+                "quantity": quantity,
+                "previous_quantity": previous_quantity,
+                "new_quantity": balance[product_id],
+                "reason": f"{label} #{sale_id}: {reason}" if reason else f"{label} #{sale_id}",
+                "reference_id": sale_id,
+                "created_at": now
+            })
+    bulk_insert(db, InventoryMovement, movement_rows)
+    stock_levels.record(db, result.stock_changes)
+
+    # Agregados das categorias: o negativo do que a venda somou
+    product_ids = sorted({line.product_id for line in lines})
+    products = {}
+    for chunk in _chunks(product_ids):
+        products.update({
+            row.id: row for row in
+            db.query(Product.id, Product.category_id, Product.price).filter(Product.id.in_(chunk)).all()
+        })
+    category_service.record_sale(db, [
+        {
+            "category_id": products[line.product_id].category_id,
+            "quantity": -line.quantity,
+            "revenue": -line.revenue,
+            "stock_value": (
+                -products[line.product_id].price * line.quantity
+                if (line.store_id, line.product_id) in restocked else 0
+            )
+        }
+        for line in lines if line.product_id in products
+    ])
+
+def _refund(db: Session, refunds: Dict[int, float], terminal_id: Optional[str]) -> float:
+    """Gravar o estorno de cada venda nas formas dos pagamentos aprovados.
+
+    O valor é distribuído do último pagamento para o primeiro, até o valor
+    de cada um; estornos anteriores da venda já consumiram, na mesma ordem,
+    parte desses pagamentos.
+    """
+    refunds = {sale_id: amount for sale_id, amount in refunds.items() if amount > 0}
+    if not refunds:
+        return 0.0
+    approved: Dict[int, list] = {}
+    refunded: Dict[Tuple[int, int], float] = {}
+    for chunk in _chunks(sorted(refunds)):
+        for row in (
+            db.query(Payment.id, Payment.sale_id, Payment.payment_method_id, Payment.store_id,
+                     Payment.terminal_id, Payment.amount, Payment.status)
+            .filter(Payment.sale_id.in_(chunk), Payment.status.in_(("approved", "refunded")))
+            .order_by(Payment.id.desc())
+            .all()
+        ):
+            if row.status == "approved":
+                approved.setdefault(row.sale_id, []).append(row)
+            else:
+                key = (row.sale_id, row.payment_method_id)
+                refunded[key] = refunded.get(key, 0) + (row.amount or 0)
+
+    now = datetime.now()
+    rows = []
+    open_shifts = shifts.open_shift_ids(db, {
+        (payment.store_id, terminal_id or payment.terminal_id)
+        for payments in approved.values() for payment in payments
+    })
+    for sale_id, amount in refunds.items():
+        remaining = round(amount, 2)
+        for payment in approved.get(sale_id, ()):
+            if remaining <= 0:
+                break
+            # Parte do pagamento já estornada antes
+            key = (sale_id, payment.payment_method_id)
+            already = min(refunded.get(key, 0), payment.amount)
+            refunded[key] = refunded.get(key, 0) - already
+            share = round(min(remaining, payment.amount - already), 2)
+            if share <= 0:
+                continue
+            remaining = round(remaining - share, 2)
+            rows.append({
+                "sale_id": sale_id,
+                "payment_method_id": payment.payment_method_id,
+                "store_id": payment.store_id,
+                "terminal_id": terminal_id or payment.terminal_id,
+                "shift_id": open_shifts.get((payment.store_id, terminal_id or payment.terminal_id)),
+                "amount": share,
+                "fee_amount": 0,
+                "net_amount": share,
+                "status": "refunded",
+                "created_at": now,
+                "processed_at": now
+            })
+    bulk_insert(db, Payment, rows)
+    shifts.record_payments(db, [
+        (row["shift_id"], row["payment_method_id"], row["amount"], True) for row in rows
+    ])
+    return round(sum(row["amount"] for row in rows), 2)
+
+def _cancel_pending_payments(db: Session, sale_ids: List[int]):
+    """Pagamentos ainda em autorização de vendas canceladas não valem mais"""
+    for chunk in _chunks(sale_ids):
+        db.query(Payment).filter(
+            Payment.sale_id.in_(chunk),
+            Payment.status == "pending"
+        ).update({"status": "cancelled", "processed_at": datetime.now()}, synchronize_session=False)
+
+def _mark_receipts_stale(db: Session, sale_ids: List[int]):
+    for chunk in _chunks(sale_ids):
+        db.execute(
+            update(SaleReceipt)
+            .where(SaleReceipt.sale_id.in_(chunk), SaleReceipt.stale == False)
+            .values(stale=True)
+            .execution_options(synchronize_session=False)
+        )
+
+def _share(revenue: float, sale) -> float:
+    """Parte do valor final da venda (após o desconto da venda) de uma receita de itens"""
+    if not sale.total_amount:
+        return 0.0
+    return revenue * (sale.final_amount or 0) / sale.total_amount
+
+def select_sales(
+    db: Session,
+    store_id: Optional[int] = None,
+    terminal_id: Optional[str] = None,
+    start_at: Optional[datetime] = None,
+    end_at: Optional[datetime] = None
+) -> List[int]:
+    """Ids das vendas não canceladas do terminal no período"""
+    query = db.query(Sale.id).filter(
+        Sale.terminal_id == terminal_id,
+        func.coalesce(Sale.payment_status, "") != "cancelled"
+    )
+    if store_id is not None:
+        query = query.filter(Sale.store_id == store_id)
+    if start_at is not None:
+        query = query.filter(Sale.created_at >= start_at)
+    if end_at is not None:
+        query = query.filter(Sale.created_at < end_at)
+    return [row.id for row in query.order_by(Sale.id).all()]
+
+def cancel_sales(
+    db: Session,
+    sale_ids: Iterable[int],
+    reason: Optional[str] = None,
+    terminal_id: Optional[str] = None
+) -> ReversalResult:
+    """Cancelar as vendas, devolvendo ao estoque o que ainda não voltou (sem commit).
+
+    Vendas já canceladas ou inexistentes são ignoradas.
+    """
+    ids = sorted(set(sale_ids))
+    sales = {}
+    for chunk in _chunks(ids):
+        sales.update({
+            row.id: row for row in
+            db.query(Sale.id, Sale.store_id, Sale.shift_id, Sale.total_amount, Sale.final_amount,
+                     Sale.paid_amount, Sale.returned_amount)
+            .filter(Sale.id.in_(chunk), func.coalesce(Sale.payment_status, "") != "cancelled")
+            .all()
+        })
+    result = ReversalResult(
+        kind="cancellation",
+        sale_ids=sorted(sales),
+        store_ids=sorted({sale.store_id for sale in sales.values() if sale.store_id is not None})
+    )
+    if not sales:
+        return result
+
+    # Marca as vendas primeiro: cancelamentos concorrentes da mesma venda
+    # não devolvem o estoque duas vezes
+    for chunk in _chunks(result.sale_ids):
+        updated = db.query(Sale).filter(
+            Sale.id.in_(chunk),
+            func.coalesce(Sale.payment_status, "") != "cancelled"
+        ).update({
+            "payment_status": "cancelled",
+            "returned_amount": Sale.final_amount,
+            "paid_amount": 0,
+            "updated_at": datetime.now()
+        }, synchronize_session=False)
+        if updated != len(chunk):
+            raise ReturnError(409, "Venda cancelada por outra operação")
+
+    lines = []
+    for chunk in _chunks(result.sale_ids):
+        for item in db.query(
+            SaleItem.id, SaleItem.sale_id, SaleItem.product_id, SaleItem.quantity,
+            SaleItem.returned_quantity, SaleItem.total_price
+        ).filter(SaleItem.sale_id.in_(chunk)).all():
+            remaining = item.quantity - (item.returned_quantity or 0)
+            if remaining <= 0:
+                continue
+            lines.append(ReversalLine(
+                sale_id=item.sale_id,
+                store_id=sales[item.sale_id].store_id,
+                sale_item_id=item.id,
+                product_id=item.product_id,
+                quantity=remaining,
+                revenue=item.total_price * remaining / item.quantity if item.quantity else 0
+            ))
+        db.query(SaleItem).filter(SaleItem.sale_id.in_(chunk)).update(
+            {"returned_quantity": SaleItem.quantity}, synchronize_session=False
+        )
+    _reverse_lines(db, lines, "Cancelamento da venda", reason, terminal_id, result)
+
+    reversed_amounts = {
+        sale_id: (sale.final_amount or 0) - (sale.returned_amount or 0) for sale_id, sale in sales.items()
+    }
+    result.returned_amount = sum(reversed_amounts.values())
+    shifts.record_reversals(db, [
+        (sales[sale_id].shift_id, True, amount) for sale_id, amount in reversed_amounts.items()
+    ])
+    result.refunded_amount = _refund(
+        db, {sale_id: sale.paid_amount or 0 for sale_id, sale in sales.items()}, terminal_id
+    )
+    _cancel_pending_payments(db, result.sale_ids)
+    _mark_receipts_stale(db, result.sale_ids)
+    db.expire_all()
+    return result
+
+def return_items(
+    db: Session,
+    sale_id: int,
+    items: Iterable[Tuple[int, int]],
+    reason: Optional[str] = None,
+    terminal_id: Optional[str] = None
+) -> ReversalResult:
+    """Devolver parte dos itens (product_id, quantity) de uma venda (sem commit).
+
+    Devolvidos todos os itens, a venda fica cancelada.
+    """
+    sale = db.query(Sale).filter(Sale.id == sale_id).first()
+    if not sale:
+        raise ReturnError(404, "Venda não encontrada")
+    if sale.payment_status == "cancelled":
+        raise ReturnError(400, "Venda cancelada não aceita devoluções")
+
+    requested: Dict[int, int] = defaultdict(int)
+    for product_id, quantity in items:
+        requested[product_id] += quantity
+
+    sale_items = sorted(sale.items, key=lambda item: item.id)
+    lines = []
+    for product_id, quantity in requested.items():
+        candidates = [item for item in sale_items if item.product_id == product_id]
+        if not candidates:
+            raise ReturnError(400, f"Produto ID {product_id} não consta na venda")
+        remaining = sum(item.quantity - (item.returned_quantity or 0) for item in candidates)
+        if quantity > remaining:
+            raise ReturnError(
+                400,
+                f"Quantidade devolvida do produto ID {product_id} maior que a vendida. Restam: {remaining}"
+            )
+        # Várias linhas do mesmo produto: devolve na ordem dos itens
+        for item in candidates:
+            available = item.quantity - (item.returned_quantity or 0)
+            take = min(available, quantity)
+            if take <= 0:
+                continue
+            lines.append(ReversalLine(
+                sale_id=sale.id,
+                store_id=sale.store_id,
+                sale_item_id=item.id,
+                product_id=product_id,
+                quantity=take,
+                revenue=item.total_price * take / item.quantity
+            ))
+            quantity -= take
+            if not quantity:
+                break
+
+    fully_returned = all(
+        item.quantity - (item.returned_quantity or 0) == sum(
+            line.quantity for line in lines if line.sale_item_id == item.id
+        )
+        for item in sale_items
+    )
+    # Quantidade devolvida por item, sem passar da vendida (devoluções
+    # concorrentes da mesma venda)
+    for line in lines:
+        updated = db.query(SaleItem).filter(
+            SaleItem.id == line.sale_item_id,
+            SaleItem.quantity - func.coalesce(SaleItem.returned_quantity, 0) >= line.quantity
+        ).update(
+            {"returned_quantity": func.coalesce(SaleItem.returned_quantity, 0) + line.quantity},
+            synchronize_session=False
+        )
+        if not updated:
+            raise ReturnError(409, "Item já devolvido por outra operação")
+
+    result = ReversalResult(kind="return", sale_ids=[sale.id], store_ids=[sale.store_id])
+    _reverse_lines(db, lines, "Devolução da venda", reason, terminal_id, result)
+
+    if fully_returned:
+        # O que sobrou da venda sai inteiro, sem resíduo de arredondamento
+        value = (sale.final_amount or 0) - (sale.returned_amount or 0)
+    else:
+        value = round(_share(sum(line.revenue for line in lines), sale), 2)
+    refund = min(value, sale.paid_amount or 0)
+    result.returned_amount = value
+    shifts.record_reversals(db, [(sale.shift_id, fully_returned, value)])
+    result.refunded_amount = _refund(db, {sale.id: refund}, terminal_id)
+
+    values = {
+        "returned_amount": round_money(func.coalesce(Sale.returned_amount, 0) + value),
+        "paid_amount": round_money(func.coalesce(Sale.paid_amount, 0) - result.refunded_amount),
+        "updated_at": datetime.now()
+    }
+    if fully_returned:
+        values["payment_status"] = "cancelled"
+        _cancel_pending_payments(db, [sale.id])
+    db.query(Sale).filter(Sale.id == sale.id).update(values, synchronize_session=False)
+    _mark_receipts_stale(db, [sale.id])
+    db.expire_all()
+    return result
@@ -0,0 +1,552 @@
+"""
+Gravação de vendas em lote (sincronização offline e POST /api/sales/bulk).
+
+Cada venda do lote traz um `client_id` (id gerado no terminal ou chave de
+idempotência do integrador), e reenvios não gravam de novo. Na
+sincronização do terminal offline a venda já aconteceu no caixa, então
+divergências (estoque negativo, preço diferente do catálogo, cliente
+inexistente) são gravadas e reportadas como conflitos; só são recusadas
+vendas que não podem ser gravadas (produto ou método de pagamento
+inexistente). No modo estrito do endpoint de lote, essas divergências
+recusam a venda, uma a uma, e os itens são precificados pelo motor de
+preços como no checkout (preço do cadastro, promoções e limite do
+desconto manual).
+
+Produtos, clientes e vendas já recebidas são carregados em poucas
+consultas por lote; vendas, itens, movimentos e pagamentos são inseridos
+em massa, com um commit a cada `chunk_size` vendas.
+"""
+
+import os
+from datetime import datetime
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from backend.models.customer import Customer
+from backend.models.inventory import Inventory, InventoryMovement
+from backend.models.outbox import OutboxMessage
+from backend.models.payment import Payment
+from backend.models.product import Product
+from backend.models.receipt import SaleReceipt
+from backend.models.sale import Sale, SaleItem
+from backend.services import bulk, events, nfce, outbox, pricing, receipts, shifts, stock, stock_levels
+from backend.services import categories as category_service
+from backend.services.payment_methods import registry as payment_method_registry
+from backend.services.settlement import TOLERANCE
+
+CHUNK_SIZE = int(os.getenv("PDV_SALE_BATCH_CHUNK", "500"))
+# Tentativas por bloco quando uma gravação concorrente o invalida
+CHUNK_ATTEMPTS = 3
+# Limite de parâmetros por IN (o SQLite antigo aceita até 999)
+LOOKUP_CHUNK = 900
+
+def _chunks(values: List, size: int) -> Iterable[List]:
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+def existing_client_ids(db: Session, client_ids: List[str]) -> Dict[str, int]:
+    """Vendas já gravadas para os `client_id` informados ({client_id: sale_id})"""
+    found = {}
+    for chunk in _chunks(list(set(client_ids)), LOOKUP_CHUNK):
+        rows = db.query(Sale.client_id, Sale.id).filter(Sale.client_id.in_(chunk)).all()
+        found.update({client_id: sale_id for client_id, sale_id in rows})
+    return found
+
+def _load_products(db: Session, product_ids: List[int]) -> Dict[int, tuple]:
+    products = {}
+    for chunk in _chunks(list(product_ids), LOOKUP_CHUNK):
+        rows = db.query(
+            Product.id, Product.name, Product.price, Product.active, Product.category_id
+        ).filter(Product.id.in_(chunk)).all()
+        products.update({row.id: row for row in rows})
+    return products
+
+def _load_customers(db: Session, customer_ids: List[int]) -> Dict[int, str]:
+    customers = {}
+    for chunk in _chunks(list(customer_ids), LOOKUP_CHUNK):
+        rows = db.query(Customer.id, Customer.name).filter(Customer.id.in_(chunk)).all()
+        customers.update({customer_id: name for customer_id, name in rows})
+    return customers
+
+def _load_stock(db: Session, product_ids: Iterable[int], store_id: int) -> Dict[int, int]:
+    """Saldo disponível (descontadas as reservas) dos produtos que controlam estoque"""
+    quantities = {}
+    for chunk in _chunks(list(product_ids), LOOKUP_CHUNK):
+        rows = db.query(Inventory.product_id, stock.available_quantity()).filter(
+            Inventory.product_id.in_(chunk),
+            Inventory.store_id == store_id
+        ).all()
+        quantities.update({product_id: quantity for product_id, quantity in rows})
+    return quantities
+
+def _load_min_stock(db: Session, product_ids: Iterable[int], store_id: int) -> Dict[int, Optional[int]]:
+    min_stock = {}
+    for chunk in _chunks(list(product_ids), LOOKUP_CHUNK):
+        rows = db.query(Inventory.product_id, Inventory.min_stock).filter(
+            Inventory.product_id.in_(chunk),
+            Inventory.store_id == store_id
+        ).all()
+        min_stock.update({product_id: value for product_id, value in rows})
+    return min_stock
+
+def ingest_sales(
+    db: Session,
+    sales: List,
+    store_id: int,
+    terminal_id: Optional[str] = None,
+    strict: bool = False,
+    chunk_size: int = CHUNK_SIZE
+) -> dict:
+    """Gravar um lote de vendas identificadas por `client_id`.
+
+    Sem `strict` (sincronização offline), divergências são gravadas e
+    reportadas em `conflicts`. Com `strict` (POST /api/sales/bulk), vendas
+    com estoque insuficiente, produto inativo, cliente inexistente ou
+    pagamento sem autorização são recusadas individualmente, sem afetar as
+    demais.
+
+    Retorna um resultado por venda enviada, na mesma ordem (created,
+    duplicate ou rejected), os conflitos e os totais. Reenvios do mesmo
+    `client_id` não gravam de novo nem baixam o estoque outra vez.
+    """
+    results: Dict[str, dict] = {}
+    conflicts: List[dict] = []
+    # Itens precificados pelo motor, por client_id (modo estrito)
+    lines: Dict[str, List[pricing.LinePrice]] = {}
+
+    product_ids = {item.product_id for sale in sales for item in sale.items}
+    existing = existing_client_ids(db, [sale.client_id for sale in sales])
+    products = _load_products(db, product_ids)
+    customers = _load_customers(db, {sale.customer_id for sale in sales if sale.customer_id is not None})
+    available = _load_stock(db, product_ids, store_id) if strict else None
+
+    pending = []
+    for sale in sales:
+        if sale.client_id in existing:
+            results[sale.client_id] = {"status": "duplicate", "sale_id": existing[sale.client_id]}
+            continue
+        if sale.client_id in results:
+            # Repetida no próprio lote
+            continue
+        reason = _rejection_reason(db, sale, products, customers, available, strict, lines)
+        if reason:
+            results[sale.client_id] = {"status": "rejected", "sale_id": None, "detail": reason}
+            continue
+        results[sale.client_id] = None
+        pending.append(sale)
+
+    for chunk in _chunks(pending, chunk_size):
+        created = {}
+        for attempt in range(CHUNK_ATTEMPTS):
+            reported = len(conflicts)
+            try:
+                created, summaries, transitions = _write_chunk(
+                    db, chunk, products, customers, store_id, terminal_id, strict, conflicts, lines
+                )
+                db.commit()
+                outbox.worker.notify()
+                events.publish_sales_batch(db, store_id, summaries)
+                events.publish_stock_levels(store_id, transitions)
+                break
+            except (IntegrityError, stock.InsufficientStock):
+                # Uma gravação concorrente levou o mesmo client_id ou o
+                # mesmo estoque: descartar o bloco e revalidar o que falta
+                db.rollback()
+                del conflicts[reported:]
+                chunk = _recheck_chunk(db, chunk, products, customers, results, store_id, strict, lines)
+                if not chunk:
+                    break
+        else:
+            for sale in chunk:
+                results[sale.client_id] = {
+                    "status": "rejected",
+                    "sale_id": None,
+                    "detail": "Gravação concorrente; reenvie a venda"
+                }
+        for client_id, sale_id in created.items():
+            results[client_id] = {"status": "created", "sale_id": sale_id}
+
+    output = []
+    seen = set()
+    for index, sale in enumerate(sales):
+        result = results[sale.client_id]
+        if sale.client_id in seen and result["status"] == "created":
+            result = {"status": "duplicate", "sale_id": result["sale_id"]}
+        seen.add(sale.client_id)
+        output.append({"index": index, "client_id": sale.client_id, **result})
+
+    statuses = [result["status"] for result in output]
+    return {
+        "received": len(sales),
+        "created": statuses.count("created"),
+        "duplicates": statuses.count("duplicate"),
+        "rejected": statuses.count("rejected"),
+        "results": output,
+        "conflicts": _merge_stock_conflicts(conflicts),
+    }
+
+def _recheck_chunk(
+    db: Session,
+    chunk: List,
+    products: Dict[int, tuple],
+    customers: Dict[int, str],
+    results: Dict[str, dict],
+    store_id: int,
+    strict: bool,
+    lines: Dict[str, List[pricing.LinePrice]]
+) -> List:
+    """Revalidar um bloco descartado contra o estado atual do banco"""
+    existing = existing_client_ids(db, [sale.client_id for sale in chunk])
+    for client_id, sale_id in existing.items():
+        results[client_id] = {"status": "duplicate", "sale_id": sale_id}
+    chunk = [sale for sale in chunk if sale.client_id not in existing]
+    if not strict:
+        return chunk
+
+    available = _load_stock(db, {item.product_id for sale in chunk for item in sale.items}, store_id)
+    remaining = []
+    for sale in chunk:
+        reason = _rejection_reason(db, sale, products, customers, available, strict, lines)
+        if reason:
+            results[sale.client_id] = {"status": "rejected", "sale_id": None, "detail": reason}
+        else:
+            remaining.append(sale)
+    return remaining
+
+def _merge_stock_conflicts(conflicts: List[dict]) -> List[dict]:
+    """Um conflito de estoque por produto para o lote inteiro, não por bloco"""
+    merged = []
+    by_product: Dict[int, dict] = {}
+    for conflict in conflicts:
+        if conflict["type"] != "negative_stock":
+            merged.append(conflict)
+            continue
+        current = by_product.get(conflict["product_id"])
+        if current is None:
+            by_product[conflict["product_id"]] = dict(conflict)
+            merged.append(by_product[conflict["product_id"]])
+        else:
+            current["quantity"] += conflict["quantity"]
+            current["new_quantity"] = conflict["new_quantity"]
+    return merged
+
+class ItemLine(NamedTuple):
+    unit_price: float
+    discount_amount: float
+    total_price: float
+    discount_percentage: float
+    promotion_id: Optional[int]
+
+def _item_lines(sale, lines: Dict[str, List[pricing.LinePrice]]) -> List[ItemLine]:
+    """Valores gravados para cada item da venda.
+
+    No modo estrito vêm do motor de preços; na sincronização offline, do
+    terminal (a venda já aconteceu com esses valores).
+    """
+    priced = lines.get(sale.client_id)
+    if priced is not None:
+        return [
+            ItemLine(line.unit_price, line.discount_amount, line.total_price, line.discount_percentage, line.promotion_id)
+            for line in priced
+        ]
+    result = []
+    for item in sale.items:
+        gross = item.unit_price * item.quantity
+        discount_amount = (gross * (item.discount_percentage or 0)) / 100
+        result.append(ItemLine(item.unit_price, discount_amount, gross - discount_amount, item.discount_percentage or 0, None))
+    return result
+
+def _tender_approved(db: Session, tender) -> bool:
+    """Pagamento offline conta como aprovado se não exige autorização ou já a trouxe"""
+    method = payment_method_registry.get(db, tender.payment_method_id)
+    return bool(tender.authorization_code) or not method.requires_approval
+
+def _rejection_reason(
+    db: Session,
+    sale,
+    products: Dict[int, tuple],
+    customers: Dict[int, str],
+    available: Optional[Dict[int, int]],
+    strict: bool,
+    lines: Dict[str, List[pricing.LinePrice]]
+) -> Optional[str]:
+    """Motivo para recusar a venda, ou None.
+
+    Com `strict`, `available` é o saldo simulado por produto: a venda aceita
+    já desconta dele, para que as próximas do lote vejam o saldo restante.
+    Os itens precificados pelo motor ficam em `lines`.
+    """
+    if not sale.items:
+        return "Venda sem itens"
+    for item in sale.items:
+        if item.product_id not in products:
+            return f"Produto ID {item.product_id} não encontrado"
+        if item.quantity <= 0:
+            return f"Quantidade inválida para o produto ID {item.product_id}"
+    for tender in sale.tenders:
+        if payment_method_registry.get(db, tender.payment_method_id) is None:
+            return f"Método de pagamento ID {tender.payment_method_id} não encontrado"
+        if tender.amount <= 0:
+            return "Valor do pagamento deve ser positivo"
+    if not strict:
+        return None
+
+    if sale.customer_id is not None and sale.customer_id not in customers:
+        return "Cliente não encontrado"
+    for item in sale.items:
+        if not products[item.product_id].active:
+            return f"Produto ID {item.product_id} não encontrado ou inativo"
+    for tender in sale.tenders:
+        if not _tender_approved(db, tender):
+            return "Pagamento que exige aprovação deve trazer authorization_code"
+
+    try:
+        priced = pricing.engine.price_items(db, sale.items, sale.customer_id)
+    except pricing.PriceError as exc:
+        return exc.detail
+    for item, line in zip(sale.items, priced):
+        if abs(item.unit_price - line.unit_price) > TOLERANCE:
+            return (
+                f"Preço do produto {line.product.name} mudou: "
+                f"R$ {line.unit_price:.2f} (enviado R$ {item.unit_price:.2f})"
+            )
+    discount_error = pricing.engine.sale_discount_error(
+        sale.discount_amount, sum(line.total_price for line in priced)
+    )
+    if discount_error:
+        return discount_error
+
+    needed: Dict[int, int] = {}
+    for item in sale.items:
+        needed[item.product_id] = needed.get(item.product_id, 0) + item.quantity
+    for product_id, quantity in needed.items():
+        if product_id in available and available[product_id] < quantity:
+            return f"Estoque insuficiente para o produto ID {product_id}. Disponível: {available[product_id]}"
+    for product_id, quantity in needed.items():
+        if product_id in available:
+            available[product_id] -= quantity
+    lines[sale.client_id] = priced
+    return None
+
+def _write_chunk(
+    db: Session,
+    chunk: List,
+    products: Dict[int, tuple],
+    customers: Dict[int, str],
+    store_id: int,
+    terminal_id: Optional[str],
+    strict: bool,
+    conflicts: List[dict],
+    lines: Dict[str, List[pricing.LinePrice]]
+) -> Tuple[Dict[str, int], List[tuple], List[dict]]:
+    synced_at = datetime.now()
+    item_lines = {sale.client_id: _item_lines(sale, lines) for sale in chunk}
+    # Vendas sincronizadas entram no caixa aberto no terminal, se houver
+    shift_id = shifts.current_shift_id(db, store_id, terminal_id)
+    sale_rows = []
+    for sale in chunk:
+        customer_id = sale.customer_id
+        if customer_id is not None and customer_id not in customers:
+            conflicts.append({
+                "type": "customer_not_found",
+                "client_id": sale.client_id,
+                "customer_id": customer_id,
+            })
+            customer_id = None
+
+        total_amount = 0
+        for item, line in zip(sale.items, item_lines[sale.client_id]):
+            product = products[item.product_id]
+            if not product.active:
+                conflicts.append({
+                    "type": "product_inactive",
+                    "client_id": sale.client_id,
+                    "product_id": item.product_id,
+                })
+            if abs(item.unit_price - product.price) > TOLERANCE:
+                conflicts.append({
+                    "type": "price_changed",
+                    "client_id": sale.client_id,
+                    "product_id": item.product_id,
+                    "sold_price": item.unit_price,
+                    "current_price": product.price,
+                })
+            if (item.discount_percentage or 0) > pricing.MAX_MANUAL_DISCOUNT:
+                conflicts.append({
+                    "type": "manual_discount",
+                    "client_id": sale.client_id,
+                    "product_id": item.product_id,
+                    "discount_percentage": item.discount_percentage,
+                })
+            total_amount += line.total_price
+
+        discount = sale.discount_amount or 0
+        if pricing.engine.sale_discount_error(discount, total_amount):
+            conflicts.append({
+                "type": "manual_discount",
+                "client_id": sale.client_id,
+                "discount_amount": discount,
+                "total_amount": total_amount,
+            })
+        final_amount = total_amount - discount
+        approved = sum(tender.amount for tender in sale.tenders if _tender_approved(db, tender))
+        if approved <= 0:
+            payment_status = "pending"
+        elif approved >= final_amount - TOLERANCE:
+            payment_status = "paid"
+        else:
+            payment_status = "partial"
+
+        sale_rows.append(Sale(
+            client_id=sale.client_id,
+            customer_id=customer_id,
+            store_id=store_id,
+            terminal_id=terminal_id,
+            shift_id=shift_id,
+            total_amount=total_amount,
+            discount_amount=discount,
+            final_amount=final_amount,
+            paid_amount=approved,
+            payment_method=sale.payment_method,
+            payment_status=payment_status,
+            notes=sale.notes,
+            created_at=sale.created_at or synced_at,
+            synced_at=synced_at
+        ))
+
+    # Um INSERT em lote (com RETURNING) devolve os ids das vendas
+    db.add_all(sale_rows)
+    db.flush()
+    sale_ids = {row.client_id: row.id for row in sale_rows}
+
+    item_rows = []
+    payment_rows = []
+    category_lines = []
+    totals: Dict[int, int] = {}
+    for sale in chunk:
+        sale_id = sale_ids[sale.client_id]
+        for item, line in zip(sale.items, item_lines[sale.client_id]):
+            item_rows.append({
+                "sale_id": sale_id,
+                "product_id": item.product_id,
+                "quantity": item.quantity,
+                "unit_price": line.unit_price,
+                "total_price": line.total_price,
+                "discount_percentage": line.discount_percentage,
+                "discount_amount": line.discount_amount,
+                "promotion_id": line.promotion_id,
+            })
+            totals[item.product_id] = totals.get(item.product_id, 0) + item.quantity
+        for tender in sale.tenders:
+            method = payment_method_registry.get(db, tender.payment_method_id)
+            fee_amount = method.fee_for(tender.amount)
+            approved = _tender_approved(db, tender)
+            payment_rows.append({
+                "sale_id": sale_id,
+                "payment_method_id": method.id,
+                "store_id": store_id,
+                "terminal_id": terminal_id,
+                "shift_id": shift_id,
+                "amount": tender.amount,
+                "fee_amount": fee_amount,
+                "net_amount": tender.amount - fee_amount,
+                "authorization_code": tender.authorization_code,
+                "transaction_id": tender.transaction_id,
+                "status": "approved" if approved else "pending",
+                "created_at": sale.created_at or synced_at,
+                "processed_at": synced_at if approved else None,
+            })
+
+    bulk.bulk_insert(db, SaleItem, item_rows)
+    bulk.bulk_insert(db, Payment, payment_rows)
+    shifts.record_sales(db, shift_id, len(sale_rows), sum(row.final_amount for row in sale_rows))
+    shifts.record_payments(db, [
+        (shift_id, row["payment_method_id"], row["amount"], False)
+        for row in payment_rows if row["status"] == "approved"
+    ])
+    bulk.bulk_insert(db, SaleReceipt, receipts.receipt_rows([
+        receipts.build_receipt(
+            row,
+            [
+                {
+                    "product_name": products[item.product_id].name,
+                    "quantity": item.quantity,
+                    "unit_price": line.unit_price,
+                    "total_price": line.total_price
+                }
+                for item, line in zip(sale.items, item_lines[sale.client_id])
+            ],
+            customers.get(row.customer_id)
+        )
+        for sale, row in zip(chunk, sale_rows)
+    ]))
+
+    # Uma baixa por produto com o total do bloco; na sincronização offline
+    # o saldo pode ficar negativo
+    stock_before: Dict[int, int] = {}
+    stock_changes = []
+    for product_id, quantity in sorted(totals.items()):
+        stock_change = stock.decrement_stock(db, product_id, quantity, store_id, allow_negative=not strict)
+        if stock_change is None:
+            continue
+        previous_quantity, new_quantity = stock_change
+        stock_before[product_id] = previous_quantity
+        stock_changes.append((product_id, previous_quantity, new_quantity))
+        if new_quantity < 0:
+            conflicts.append({
+                "type": "negative_stock",
+                "product_id": product_id,
+                "quantity": quantity,
+                "available": previous_quantity,
+                "new_quantity": new_quantity,
+            })
+
+    # Movimentos por item, com o saldo corrente na ordem das vendas
+    movement_rows = []
+    running = dict(stock_before)
+    for sale in chunk:
+        sale_id = sale_ids[sale.client_id]
+        for item, line in zip(sale.items, item_lines[sale.client_id]):
+            product = products[item.product_id]
+            category_lines.append({
+                "category_id": product.category_id,
+                "quantity": item.quantity,
+                "revenue": line.total_price,
+                "stock_value": product.price * item.quantity if item.product_id in running else 0,
+            })
+            if item.product_id not in running:
+                continue
+            previous_quantity = running[item.product_id]
+            running[item.product_id] = previous_quantity - item.quantity
+            movement_rows.append({
+                "product_id": item.product_id,
+                "store_id": store_id,
+                "terminal_id": terminal_id,
+                "movement_type": "out",
+                "quantity": item.quantity,
+                "previous_quantity": previous_quantity,
+                "new_quantity": running[item.product_id],
+                "reason": f"Venda #{sale_id}" if strict else f"Venda #{sale_id} (offline)",
+                "reference_id": sale_id,
+                "created_at": sale.created_at or synced_at,
+            })
+
+    bulk.bulk_insert(db, InventoryMovement, movement_rows)
+    min_stock = _load_min_stock(db, stock_before, store_id)
+    transitions = stock_levels.record(db, [
+        (product_id, store_id, previous_quantity, new_quantity, min_stock.get(product_id))
+        for product_id, previous_quantity, new_quantity in stock_changes
+    ])
+    category_service.record_sale(db, category_lines)
+    # NFC-e pelo outbox; vendas feitas sem servidor saem em contingência
+    bulk.bulk_insert(db, OutboxMessage, nfce.issue_rows(
+        (sale_ids[sale.client_id] for sale in chunk), contingency=not strict
+    ))
+    # Resumo das vendas para os totais ao vivo, lido antes do commit
+    summaries = [
+        (row.created_at, row.final_amount, row.payment_method, row.paid_amount)
+        for row in sale_rows
+    ]
+    return sale_ids, summaries, transitions
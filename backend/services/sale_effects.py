@@ -0,0 +1,78 @@
+"""
+Efeitos de uma venda entregues pelo outbox.
+
+`enqueue_sale_created` roda dentro da transação da venda; o handler
+"sale.created" roda depois, no worker, para um lote de vendas de uma vez:
+soma os agregados das categorias, grava os recibos e publica os eventos
+ao vivo. Os dados que precisam refletir o momento da venda (nomes no
+recibo, saldos antes e depois da baixa) vão na própria mensagem. Com o
+worker em processo separado, o servidor publica os eventos pelo relay.
+"""
+
+from typing import List, Optional
+
+from sqlalchemy.orm import Session
+
+from backend.models.receipt import SaleReceipt
+from backend.models.sale import Sale
+from backend.services import categories as category_service
+from backend.services import events, outbox, receipts
+from backend.services.bulk import bulk_insert
+
+SALE_CREATED = "sale.created"
+
+def enqueue_sale_created(
+    db: Session,
+    sale: Sale,
+    category_lines: List[dict],
+    receipt_lines: List[dict],
+    customer_name: Optional[str],
+    stock_changes: List[tuple]
+):
+    """Registrar os efeitos da venda na transação corrente.
+
+    `stock_changes` traz (product_id, saldo anterior, saldo novo, estoque mínimo).
+    """
+    outbox.enqueue(db, SALE_CREATED, {
+        "sale_id": sale.id,
+        "store_id": sale.store_id,
+        "items_count": len(receipt_lines),
+        "category_lines": category_lines,
+        "receipt_lines": receipt_lines,
+        "customer_name": customer_name,
+        "stock_changes": stock_changes,
+    }, aggregate_id=sale.id)
+
+@outbox.handler(SALE_CREATED)
+def handle_sale_created(db: Session, payloads: List[dict]):
+    sale_ids = [payload["sale_id"] for payload in payloads]
+    sales = {sale.id: sale for sale in db.query(Sale).filter(Sale.id.in_(sale_ids)).all()}
+
+    category_service.record_sale(db, [line for payload in payloads for line in payload["category_lines"]])
+
+    # Recibo pode já ter sido gerado por uma leitura antes do worker
+    existing = {
+        sale_id for (sale_id,) in
+        db.query(SaleReceipt.sale_id).filter(SaleReceipt.sale_id.in_(sale_ids)).all()
+    }
+    bulk_insert(db, SaleReceipt, receipts.receipt_rows([
+        receipts.build_receipt(sales[payload["sale_id"]], payload["receipt_lines"], payload["customer_name"])
+        for payload in payloads
+        if payload["sale_id"] in sales and payload["sale_id"] not in existing
+    ]))
+
+    return lambda: _publish(db, payloads, sales)
+
+@outbox.relay(SALE_CREATED)
+def relay_sale_created(db: Session, payloads: List[dict]):
+    sale_ids = [payload["sale_id"] for payload in payloads]
+    _publish(db, payloads, {sale.id: sale for sale in db.query(Sale).filter(Sale.id.in_(sale_ids)).all()})
+
+def _publish(db: Session, payloads: List[dict], sales: dict):
+    for payload in payloads:
+        sale = sales.get(payload["sale_id"])
+        if sale is None:
+            continue
+        events.publish_sale(db, sale, payload["items_count"])
+        for product_id, previous_quantity, new_quantity, min_stock in payload["stock_changes"]:
+            events.publish_stock_change(product_id, sale.store_id, previous_quantity, new_quantity, min_stock)
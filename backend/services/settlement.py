@@ -0,0 +1,156 @@
+"""
+Saldo pago das vendas e conciliação venda x pagamentos.
+
+Uma venda pode ser paga com vários pagamentos (ex.: parte em dinheiro,
+parte no cartão). Cada pagamento aprovado soma ao `paid_amount` da venda
+por incremento no banco, e o status passa a "partial" ou "paid" conforme o
+saldo. A conciliação compara `final_amount` com a soma dos pagamentos
+aprovados de um período inteiro em uma única consulta agrupada.
+
+Devoluções reduzem o devido (`returned_amount`) e o que foi devolvido ao
+cliente fica em pagamentos "refunded", descontados dos aprovados.
+"""
+
+from datetime import date, datetime, time, timedelta
+from typing import List, Optional
+
+from sqlalchemy import and_, case, func, or_, update
+from sqlalchemy.orm import Session
+
+from backend.database import timestamp_bound
+
+from backend.models.payment import Payment
+from backend.models.sale import Sale
+from backend.services import receipts
+
+# Tolerância de arredondamento em reais
+TOLERANCE = 0.005
+
+def register_approved_payment(db: Session, sale_id: int, amount: float):
+    """Somar um pagamento aprovado ao saldo da venda e atualizar o status.
+
+    Feito em um único UPDATE, sem ler a venda, para que pagamentos
+    concorrentes da mesma venda não percam incrementos. Vendas canceladas
+    não mudam de status. O recibo guardado fica marcado como desatualizado.
+    """
+    new_paid = func.coalesce(Sale.paid_amount, 0) + amount
+    db.execute(
+        update(Sale)
+        .where(Sale.id == sale_id)
+        .values(
+            paid_amount=new_paid,
+            payment_status=case(
+                (Sale.payment_status == "cancelled", Sale.payment_status),
+                (new_paid >= Sale.final_amount - func.coalesce(Sale.returned_amount, 0) - TOLERANCE, "paid"),
+                else_="partial"
+            )
+        )
+        .execution_options(synchronize_session="fetch")
+    )
+    receipts.mark_stale(db, sale_id)
+
+def _signed_amount():
+    """Valor do pagamento com sinal: estornos descontam"""
+    return case((Payment.status == "refunded", -Payment.amount), else_=Payment.amount)
+
+def backfill_paid_amounts(db: Session):
+    """Preencher o saldo pago de vendas gravadas antes da coluna existir"""
+    approved_sum = db.query(func.coalesce(func.sum(_signed_amount()), 0)).filter(
+        Payment.sale_id == Sale.id,
+        Payment.status.in_(("approved", "refunded"))
+    ).scalar_subquery()
+    db.execute(
+        update(Sale)
+        .where(Sale.paid_amount.is_(None))
+        .values(paid_amount=approved_sum)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+def date_range_filter(column, start_date: Optional[date], end_date: Optional[date]):
+    """Filtro de período sobre uma coluna de data/hora que aproveita índices.
+
+    Compara com a meia-noite do primeiro dia e do dia seguinte ao último, em
+    vez de aplicar date() à coluna.
+    """
+    conditions = []
+    if start_date:
+        conditions.append(column >= timestamp_bound(datetime.combine(start_date, time.min)))
+    if end_date:
+        conditions.append(column < timestamp_bound(datetime.combine(end_date + timedelta(days=1), time.min)))
+    return and_(*conditions) if conditions else None
+
+def reconcile(
+    db: Session,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    only_mismatched: bool = True,
+    limit: Optional[int] = None
+) -> dict:
+    """Comparar o valor devido das vendas com os pagamentos aprovados, menos estornos"""
+    approved = db.query(
+        Payment.sale_id.label("sale_id"),
+        func.sum(_signed_amount()).label("approved_amount"),
+        func.count(Payment.id).label("payments_count")
+    ).filter(Payment.status.in_(("approved", "refunded"))).group_by(Payment.sale_id).subquery()
+
+    approved_amount = func.coalesce(approved.c.approved_amount, 0)
+    difference = approved_amount - (Sale.final_amount - func.coalesce(Sale.returned_amount, 0))
+    status = case(
+        (difference < -TOLERANCE, "underpaid"),
+        (difference > TOLERANCE, "overpaid"),
+        else_="ok"
+    ).label("reconciliation_status")
+
+    query = db.query(
+        Sale.id,
+        Sale.created_at,
+        Sale.final_amount,
+        Sale.paid_amount,
+        Sale.payment_status,
+        approved_amount.label("approved_amount"),
+        func.coalesce(approved.c.payments_count, 0).label("payments_count"),
+        difference.label("difference"),
+        status
+    ).outerjoin(approved, approved.c.sale_id == Sale.id).filter(
+        or_(Sale.payment_status.is_(None), Sale.payment_status != "cancelled")
+    )
+
+    period = date_range_filter(Sale.created_at, start_date, end_date)
+    if period is not None:
+        query = query.filter(period)
+
+    if only_mismatched:
+        query = query.filter(or_(difference < -TOLERANCE, difference > TOLERANCE))
+
+    query = query.order_by(Sale.created_at, Sale.id)
+    if limit:
+        query = query.limit(limit)
+
+    rows = query.all()
+    sales: List[dict] = []
+    totals = {"ok": 0, "underpaid": 0, "overpaid": 0}
+    for row in rows:
+        totals[row.reconciliation_status] += 1
+        sales.append({
+            "sale_id": row.id,
+            "created_at": row.created_at,
+            "final_amount": row.final_amount,
+            "approved_amount": row.approved_amount,
+            "paid_amount": row.paid_amount or 0,
+            "payments_count": row.payments_count,
+            "difference": round(row.difference, 2),
+            "payment_status": row.payment_status,
+            "status": row.reconciliation_status,
+            # Saldo gravado na venda diverge dos pagamentos aprovados
+            "balance_drift": abs((row.paid_amount or 0) - row.approved_amount) > TOLERANCE
+        })
+
+    return {
+        "period": {
+            "start_date": start_date.strftime("%d/%m/%Y") if start_date else None,
+            "end_date": end_date.strftime("%d/%m/%Y") if end_date else None
+        },
+        "totals": totals,
+        "sales": sales
+    }
@@ -0,0 +1,436 @@
+"""
+Abertura e fechamento de caixa por terminal.
+
+Cada terminal tem no máximo um caixa (turno) aberto, com o troco inicial,
+os suprimentos e as sangrias. Os totais do caixa são mantidos por
+incremento na mesma transação em que a venda ou o pagamento é gravado:
+
+- `register_shifts` soma a quantidade e o valor das vendas, descontando
+  cancelamentos e devoluções no caixa de origem da venda;
+- `register_shift_totals` soma, por forma de pagamento, os pagamentos
+  aprovados e os estornos.
+
+Fechar o caixa é um único UPDATE condicional no caixa aberto: o dinheiro
+esperado na gaveta (troco + dinheiro recebido - estornos em dinheiro +
+suprimentos - sangrias) sai das linhas de totais do próprio caixa, sem
+varrer as vendas do dia, e nada que chegue depois entra na conta. Vendas
+e pagamentos guardam o `shift_id`, então `reconcile` recalcula os totais a
+partir deles para conferir o que foi mantido.
+
+Pagamentos que aguardam autorização contam no caixa em que foram criados
+quando aprovados, mesmo que ele já tenha sido fechado; como dinheiro não
+passa por autorização, o esperado na gaveta não muda depois do fechamento.
+"""
+
+import os
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from backend.database import round_money
+from backend.models.payment import Payment
+from backend.models.sale import Sale
+from backend.models.shift import RegisterShift, RegisterShiftMovement, RegisterShiftTotal
+from backend.services.payment_methods import registry as payment_method_registry
+from backend.services.settlement import TOLERANCE
+
+# Com 1, vendas e pagamentos exigem caixa aberto no terminal
+REQUIRE_OPEN_SHIFT = os.getenv("PDV_SHIFT_REQUIRED", "0") == "1"
+
+MOVEMENT_TYPES = ("withdrawal", "deposit")
+
+class ShiftError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+def _expire_loaded(db: Session):
+    # Mantém objetos já carregados na sessão coerentes com o banco
+    for obj in list(db.identity_map.values()):
+        if isinstance(obj, (RegisterShift, RegisterShiftTotal)):
+            db.expire(obj)
+
+def current_shift_id(db: Session, store_id: Optional[int], terminal_id: Optional[str]) -> Optional[int]:
+    """Id do caixa aberto no terminal, ou None"""
+    if store_id is None or not terminal_id:
+        return None
+    return db.query(RegisterShift.id).filter(
+        RegisterShift.store_id == store_id,
+        RegisterShift.terminal_id == terminal_id,
+        RegisterShift.status == "open"
+    ).scalar()
+
+def shift_for_sale(db: Session, store_id: Optional[int], terminal_id: Optional[str]) -> Optional[int]:
+    """Caixa que recebe a venda ou o pagamento; com PDV_SHIFT_REQUIRED, falha sem caixa aberto"""
+    shift_id = current_shift_id(db, store_id, terminal_id)
+    if shift_id is None and REQUIRE_OPEN_SHIFT:
+        raise ShiftError(409, "Nenhum caixa aberto neste terminal")
+    return shift_id
+
+def open_shift_ids(db: Session, terminals: Iterable[Tuple[int, str]]) -> Dict[Tuple[int, str], int]:
+    """Caixas abertos de vários terminais (loja, terminal) em uma consulta"""
+    terminals = {(store_id, terminal_id) for store_id, terminal_id in terminals if store_id is not None and terminal_id}
+    if not terminals:
+        return {}
+    rows = db.query(RegisterShift.id, RegisterShift.store_id, RegisterShift.terminal_id).filter(
+        RegisterShift.status == "open",
+        RegisterShift.terminal_id.in_(sorted({terminal_id for _, terminal_id in terminals}))
+    ).all()
+    return {
+        (row.store_id, row.terminal_id): row.id
+        for row in rows if (row.store_id, row.terminal_id) in terminals
+    }
+
+def open_shift(
+    db: Session,
+    store_id: int,
+    terminal_id: str,
+    opening_float: float = 0,
+    opened_by: Optional[str] = None,
+    notes: Optional[str] = None
+) -> RegisterShift:
+    """Abrir o caixa do terminal (sem commit); falha se já houver um aberto"""
+    if not terminal_id:
+        raise ShiftError(400, "Informe o terminal (header X-Terminal-Id)")
+    if opening_float < 0:
+        raise ShiftError(400, "Troco inicial não pode ser negativo")
+
+    shift = RegisterShift(
+        store_id=store_id,
+        terminal_id=terminal_id,
+        status="open",
+        opening_float=opening_float,
+        opened_by=opened_by,
+        notes=notes
+    )
+    db.add(shift)
+    try:
+        # O índice único parcial barra dois caixas abertos no mesmo terminal
+        db.flush()
+    except IntegrityError:
+        db.rollback()
+        raise ShiftError(409, "Já existe um caixa aberto neste terminal")
+
+    # Uma linha de totais por forma de pagamento, para que o caminho da
+    # venda só precise de UPDATE
+    rows = [
+        {
+            "shift_id": shift.id,
+            "payment_method_id": method.id,
+            "method_type": method.type,
+            "payments_count": 0,
+            "received_amount": 0,
+            "refunded_amount": 0
+        }
+        for method in payment_method_registry.all(db)
+    ]
+    if rows:
+        db.execute(insert(RegisterShiftTotal), rows)
+    return shift
+
+def record_sales(db: Session, shift_id: Optional[int], count: int, amount: float):
+    """Somar vendas ao caixa (valores negativos descontam)"""
+    if shift_id is None or not (count or amount):
+        return
+    db.execute(
+        update(RegisterShift)
+        .where(RegisterShift.id == shift_id)
+        .values(
+            sales_count=RegisterShift.sales_count + count,
+            sales_amount=round_money(RegisterShift.sales_amount + amount)
+        )
+        .execution_options(synchronize_session=False)
+    )
+    _expire_loaded(db)
+
+def record_reversals(db: Session, reversals: Iterable[Tuple[Optional[int], bool, float]]):
+    """Descontar cancelamentos e devoluções (shift_id, venda cancelada, valor) dos caixas das vendas.
+
+    Vale o caixa em que a venda foi registrada, mesmo já fechado: a venda
+    cancelada sai da contagem e o valor devolvido sai do total vendido.
+    """
+    totals: Dict[int, List[float]] = defaultdict(lambda: [0, 0.0])
+    for shift_id, cancelled, amount in reversals:
+        if shift_id is None:
+            continue
+        totals[shift_id][0] += 1 if cancelled else 0
+        totals[shift_id][1] += amount
+    for shift_id, (count, amount) in sorted(totals.items()):
+        record_sales(db, shift_id, -count, -amount)
+
+def record_payments(db: Session, payments: Iterable[Tuple[Optional[int], int, float, bool]]):
+    """Somar pagamentos (shift_id, payment_method_id, valor, estorno) aos totais dos caixas.
+
+    Um UPDATE por caixa e forma de pagamento, com os valores já agregados.
+    """
+    totals: Dict[Tuple[int, int], List[float]] = defaultdict(lambda: [0, 0.0, 0.0])
+    for shift_id, method_id, amount, refunded in payments:
+        if shift_id is None:
+            continue
+        total = totals[(shift_id, method_id)]
+        if refunded:
+            total[2] += amount
+        else:
+            total[0] += 1
+            total[1] += amount
+
+    for (shift_id, method_id), (count, received, refunded) in sorted(totals.items()):
+        values = dict(
+            payments_count=RegisterShiftTotal.payments_count + count,
+            received_amount=round_money(RegisterShiftTotal.received_amount + received),
+            refunded_amount=round_money(RegisterShiftTotal.refunded_amount + refunded)
+        )
+        updated = db.execute(
+            update(RegisterShiftTotal)
+            .where(RegisterShiftTotal.shift_id == shift_id, RegisterShiftTotal.payment_method_id == method_id)
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if updated:
+            continue
+        # Forma de pagamento cadastrada depois da abertura do caixa
+        method = payment_method_registry.get(db, method_id)
+        row = {
+            "shift_id": shift_id,
+            "payment_method_id": method_id,
+            "method_type": method.type if method else None,
+            "payments_count": count,
+            "received_amount": round(received, 2),
+            "refunded_amount": round(refunded, 2)
+        }
+        try:
+            with db.begin_nested():
+                db.execute(insert(RegisterShiftTotal), [row])
+        except IntegrityError:
+            # Outra transação criou a linha primeiro
+            db.execute(
+                update(RegisterShiftTotal)
+                .where(RegisterShiftTotal.shift_id == shift_id, RegisterShiftTotal.payment_method_id == method_id)
+                .values(**values)
+                .execution_options(synchronize_session=False)
+            )
+    _expire_loaded(db)
+
+def _cash_total(shift_id):
+    """Dinheiro recebido menos estornos em dinheiro, como subconsulta"""
+    return select(
+        func.coalesce(func.sum(RegisterShiftTotal.received_amount - RegisterShiftTotal.refunded_amount), 0)
+    ).where(
+        RegisterShiftTotal.shift_id == shift_id,
+        RegisterShiftTotal.method_type == "cash"
+    ).scalar_subquery()
+
+def _expected_cash(shift_id):
+    return (
+        RegisterShift.opening_float + _cash_total(shift_id)
+        + RegisterShift.deposits - RegisterShift.withdrawals
+    )
+
+def add_movement(
+    db: Session,
+    shift_id: int,
+    movement_type: str,
+    amount: float,
+    reason: Optional[str] = None,
+    created_by: Optional[str] = None
+) -> RegisterShiftMovement:
+    """Registrar sangria ou suprimento no caixa aberto (sem commit)"""
+    if movement_type not in MOVEMENT_TYPES:
+        raise ShiftError(400, "Tipo de movimento inválido. Use: withdrawal ou deposit")
+    if amount <= 0:
+        raise ShiftError(400, "Valor do movimento deve ser positivo")
+
+    conditions = [RegisterShift.id == shift_id, RegisterShift.status == "open"]
+    if movement_type == "withdrawal":
+        # A sangria não pode levar mais do que há na gaveta
+        conditions.append(_expected_cash(shift_id) >= amount - TOLERANCE)
+        values = {"withdrawals": round_money(RegisterShift.withdrawals + amount)}
+    else:
+        values = {"deposits": round_money(RegisterShift.deposits + amount)}
+
+    updated = db.execute(
+        update(RegisterShift)
+        .where(*conditions)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not updated:
+        status = db.query(RegisterShift.status).filter(RegisterShift.id == shift_id).scalar()
+        if status is None:
+            raise ShiftError(404, "Caixa não encontrado")
+        if status != "open":
+            raise ShiftError(409, "Caixa já fechado")
+        raise ShiftError(400, "Sangria maior que o dinheiro em caixa")
+
+    movement = RegisterShiftMovement(
+        shift_id=shift_id,
+        type=movement_type,
+        amount=amount,
+        reason=reason,
+        created_by=created_by
+    )
+    db.add(movement)
+    db.flush()
+    _expire_loaded(db)
+    return movement
+
+def close_shift(
+    db: Session,
+    shift_id: int,
+    counted_cash: Optional[float] = None,
+    counted: Optional[Dict[int, float]] = None,
+    closed_by: Optional[str] = None,
+    notes: Optional[str] = None
+) -> RegisterShift:
+    """Fechar o caixa com a contagem da gaveta (sem commit).
+
+    O esperado é calculado no próprio UPDATE que fecha o caixa, então
+    pagamentos concorrentes entram antes ou ficam de fora por inteiro.
+    """
+    expected = _expected_cash(shift_id)
+    values = {
+        "status": "closed",
+        "closed_at": datetime.now(),
+        "closed_by": closed_by,
+        "expected_cash": round_money(expected),
+    }
+    if counted_cash is not None:
+        values["counted_cash"] = counted_cash
+        values["cash_difference"] = round_money(counted_cash - expected)
+    if notes is not None:
+        values["notes"] = notes
+
+    updated = db.execute(
+        update(RegisterShift)
+        .where(RegisterShift.id == shift_id, RegisterShift.status == "open")
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not updated:
+        if db.query(RegisterShift.id).filter(RegisterShift.id == shift_id).scalar() is None:
+            raise ShiftError(404, "Caixa não encontrado")
+        raise ShiftError(409, "Caixa já fechado")
+
+    for method_id, amount in (counted or {}).items():
+        db.execute(
+            update(RegisterShiftTotal)
+            .where(RegisterShiftTotal.shift_id == shift_id, RegisterShiftTotal.payment_method_id == method_id)
+            .values(counted_amount=amount)
+            .execution_options(synchronize_session=False)
+        )
+    _expire_loaded(db)
+    return db.query(RegisterShift).filter(RegisterShift.id == shift_id).first()
+
+def summary(db: Session, shift: RegisterShift) -> dict:
+    """Caixa com os totais por forma de pagamento e o esperado na gaveta"""
+    totals = db.query(RegisterShiftTotal).filter(
+        RegisterShiftTotal.shift_id == shift.id
+    ).order_by(RegisterShiftTotal.payment_method_id).all()
+
+    methods = []
+    for total in totals:
+        if not total.payments_count and not total.refunded_amount and total.counted_amount is None:
+            continue
+        net = round(total.received_amount - total.refunded_amount, 2)
+        methods.append({
+            "payment_method_id": total.payment_method_id,
+            "payment_method_name": payment_method_registry.name_of(db, total.payment_method_id),
+            "method_type": total.method_type,
+            "payments_count": total.payments_count,
+            "received_amount": total.received_amount,
+            "refunded_amount": total.refunded_amount,
+            "net_amount": net,
+            "counted_amount": total.counted_amount,
+            "difference": round(total.counted_amount - net, 2) if total.counted_amount is not None else None
+        })
+
+    if shift.status == "open":
+        expected_cash = db.query(round_money(_expected_cash(shift.id))).filter(
+            RegisterShift.id == shift.id
+        ).scalar()
+    else:
+        expected_cash = shift.expected_cash
+
+    return {
+        "id": shift.id,
+        "store_id": shift.store_id,
+        "terminal_id": shift.terminal_id,
+        "status": shift.status,
+        "opened_by": shift.opened_by,
+        "closed_by": shift.closed_by,
+        "opened_at": shift.opened_at,
+        "closed_at": shift.closed_at,
+        "opening_float": shift.opening_float,
+        "sales_count": shift.sales_count,
+        "sales_amount": shift.sales_amount,
+        "deposits": shift.deposits,
+        "withdrawals": shift.withdrawals,
+        "expected_cash": expected_cash,
+        "counted_cash": shift.counted_cash,
+        "cash_difference": shift.cash_difference,
+        "notes": shift.notes,
+        "payment_methods": methods
+    }
+
+def reconcile(db: Session, shift: RegisterShift) -> dict:
+    """Recalcular os totais do caixa a partir das vendas, pagamentos e movimentos"""
+    differences = []
+
+    def compare(field: str, stored, computed, payment_method_id: Optional[int] = None):
+        if abs((stored or 0) - (computed or 0)) > TOLERANCE:
+            difference = {"field": field, "stored": stored, "computed": computed}
+            if payment_method_id is not None:
+                difference["payment_method_id"] = payment_method_id
+            differences.append(difference)
+
+    # Canceladas não contam; devoluções descontam do valor
+    sales = db.query(
+        func.count(Sale.id).filter(func.coalesce(Sale.payment_status, "") != "cancelled"),
+        func.coalesce(func.sum(Sale.final_amount - func.coalesce(Sale.returned_amount, 0)), 0)
+    ).filter(Sale.shift_id == shift.id).one()
+    compare("sales_count", shift.sales_count, sales[0])
+    compare("sales_amount", shift.sales_amount, round(sales[1], 2))
+
+    movements = dict(
+        db.query(RegisterShiftMovement.type, func.sum(RegisterShiftMovement.amount))
+        .filter(RegisterShiftMovement.shift_id == shift.id)
+        .group_by(RegisterShiftMovement.type)
+        .all()
+    )
+    compare("deposits", shift.deposits, round(movements.get("deposit") or 0, 2))
+    compare("withdrawals", shift.withdrawals, round(movements.get("withdrawal") or 0, 2))
+
+    computed: Dict[int, List[float]] = defaultdict(lambda: [0, 0.0, 0.0])
+    for method_id, status, count, amount in db.query(
+        Payment.payment_method_id, Payment.status, func.count(Payment.id), func.sum(Payment.amount)
+    ).filter(
+        Payment.shift_id == shift.id,
+        Payment.status.in_(("approved", "refunded"))
+    ).group_by(Payment.payment_method_id, Payment.status).all():
+        if status == "approved":
+            computed[method_id][0] += count
+            computed[method_id][1] += amount
+        else:
+            computed[method_id][2] += amount
+
+    stored = {
+        total.payment_method_id: total
+        for total in db.query(RegisterShiftTotal).filter(RegisterShiftTotal.shift_id == shift.id).all()
+    }
+    for method_id in sorted(set(stored) | set(computed)):
+        total = stored.get(method_id)
+        count, received, refunded = computed.get(method_id, (0, 0.0, 0.0))
+        compare("payments_count", total.payments_count if total else 0, count, method_id)
+        compare("received_amount", total.received_amount if total else 0, round(received, 2), method_id)
+        compare("refunded_amount", total.refunded_amount if total else 0, round(refunded, 2), method_id)
+
+    return {
+        "shift_id": shift.id,
+        "status": "ok" if not differences else "mismatch",
+        "differences": differences
+    }
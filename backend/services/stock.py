@@ -0,0 +1,91 @@
+"""
+Baixa de estoque atômica.
+
+Em bancos com UPDATE ... RETURNING (PostgreSQL, SQLite >= 3.35) a baixa é
+uma única instrução que só decrementa se houver saldo e devolve a nova
+quantidade, sem ler a linha antes e sem janela para vendas concorrentes.
+Nos demais cai no fluxo ler-e-gravar.
+
+A baixa só consome o saldo disponível (em mãos menos o reservado para
+carrinhos e pedidos online, ver services/reservations.py) e grava o nível
+de estoque no mesmo UPDATE (ver services/stock_levels.py).
+"""
+
+from datetime import datetime
+from typing import Optional, Tuple
+
+from sqlalchemy import func, update
+from sqlalchemy.orm import Session
+
+from backend.models.inventory import Inventory
+from backend.services.stock_levels import level_expression
+
+class InsufficientStock(Exception):
+    def __init__(self, product_id: int, available: int):
+        super().__init__(f"Estoque insuficiente para o produto {product_id}. Disponível: {available}")
+        self.product_id = product_id
+        self.available = available
+
+def available_quantity():
+    """Expressão do saldo disponível: em mãos menos o reservado"""
+    return Inventory.quantity - func.coalesce(Inventory.reserved_quantity, 0)
+
+def supports_returning(db: Session) -> bool:
+    return bool(getattr(db.get_bind().dialect, "update_returning", False))
+
+def decrement_stock(
+    db: Session,
+    product_id: int,
+    quantity: int,
+    store_id: int,
+    allow_negative: bool = False
+) -> Optional[Tuple[int, int]]:
+    """Baixar `quantity` do estoque do produto na loja.
+
+    Retorna (quantidade_anterior, quantidade_nova), ou None se o produto
+    não controla estoque. Levanta InsufficientStock se não houver saldo e
+    `allow_negative` for falso.
+    """
+    if supports_returning(db):
+        statement = (
+            update(Inventory)
+            .where(Inventory.product_id == product_id, Inventory.store_id == store_id)
+            .values(
+                quantity=Inventory.quantity - quantity,
+                stock_level=level_expression(Inventory.quantity - quantity),
+                last_updated=datetime.now()
+            )
+            .returning(Inventory.quantity)
+            .execution_options(synchronize_session=False)
+        )
+        if not allow_negative:
+            statement = statement.where(available_quantity() >= quantity)
+        row = db.execute(statement).first()
+        if row is not None:
+            # Mantém objetos já carregados na sessão coerentes com o banco
+            for obj in db.identity_map.values():
+                if isinstance(obj, Inventory) and obj.product_id == product_id and obj.store_id == store_id:
+                    db.expire(obj, ["quantity", "stock_level", "last_updated"])
+            return row[0] + quantity, row[0]
+
+        available = db.query(available_quantity()).filter(
+            Inventory.product_id == product_id,
+            Inventory.store_id == store_id
+        ).first()
+        if available is None:
+            return None
+        raise InsufficientStock(product_id, available[0])
+
+    inventory = db.query(Inventory).filter(
+        Inventory.product_id == product_id,
+        Inventory.store_id == store_id
+    ).first()
+    if not inventory:
+        return None
+    available = inventory.quantity - (inventory.reserved_quantity or 0)
+    if not allow_negative and available < quantity:
+        raise InsufficientStock(product_id, available)
+    previous_quantity = inventory.quantity
+    inventory.quantity = previous_quantity - quantity
+    inventory.last_updated = datetime.now()
+    return previous_quantity, inventory.quantity
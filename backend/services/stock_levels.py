@@ -0,0 +1,152 @@
+"""
+Nível de estoque (ok, baixo, crítico) mantido na linha do estoque.
+
+`Inventory.stock_level` é gravado junto com `quantity` e `min_stock`, no
+mesmo UPDATE (baixa da venda, estorno) ou no flush do ORM (cadastro e
+ajustes), então as listas de estoque baixo são uma leitura do índice
+parcial das linhas baixas/críticas, sem comparar quantity com min_stock na
+tabela inteira:
+
+- critical: sem saldo (quantity <= 0);
+- low: no estoque mínimo ou abaixo dele;
+- ok: acima do mínimo.
+
+Cada passagem de um nível para outro é gravada em `stock_level_events`, na
+transação da mudança, e publicada no barramento (`low_stock`) depois do
+commit por `events.publish_stock_change`, que usa a mesma regra.
+"""
+
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import Integer, case, event, func, inspect, literal, literal_column, or_, update
+from sqlalchemy.orm import Session
+
+from backend.models.inventory import Inventory, StockLevelEvent
+from backend.services.bulk import bulk_insert
+
+LOW_LEVELS = ("low", "critical")
+
+def level_of(quantity: int, min_stock: Optional[int]) -> str:
+    if quantity <= 0:
+        return "critical"
+    if quantity <= (min_stock or 0):
+        return "low"
+    return "ok"
+
+def level_expression(quantity=Inventory.quantity, min_stock=Inventory.min_stock):
+    """Mesma regra de `level_of` em SQL, para gravar no UPDATE da quantidade"""
+    return case(
+        (quantity <= 0, "critical"),
+        (quantity <= func.coalesce(min_stock, 0), "low"),
+        else_="ok"
+    )
+
+def is_low():
+    """Filtro das linhas em estoque baixo ou crítico.
+
+    Com os valores escritos na consulta (não como parâmetros), para que o
+    banco reconheça a condição do índice parcial.
+    """
+    return Inventory.stock_level.in_([literal_column(f"'{level}'") for level in LOW_LEVELS])
+
+@event.listens_for(Inventory, "before_insert")
+@event.listens_for(Inventory, "before_update")
+def _set_level(mapper, connection, target):
+    """Flush do ORM: o nível acompanha quantity/min_stock alterados"""
+    state = inspect(target)
+    if not state.persistent:
+        target.stock_level = level_of(target.quantity or 0, target.min_stock)
+        return
+    changed = {
+        name for name in ("quantity", "min_stock")
+        if name in state.dict and state.attrs[name].history.has_changes()
+    }
+    if not changed:
+        return
+    # Valor novo de quem mudou; o outro vem da própria linha no UPDATE
+    # (pode estar expirado na sessão, ex.: após a baixa atômica)
+    values = [
+        literal(state.dict[name], Integer) if name in changed else getattr(Inventory, name)
+        for name in ("quantity", "min_stock")
+    ]
+    target.stock_level = level_expression(*values)
+
+def _event_row(product_id, store_id, previous_level, quantity, min_stock) -> Optional[dict]:
+    level = level_of(quantity, min_stock)
+    if level == previous_level:
+        return None
+    return {
+        "product_id": product_id,
+        "store_id": store_id,
+        "previous_level": previous_level,
+        "level": level,
+        "quantity": quantity,
+        "min_stock": min_stock,
+    }
+
+def record(db: Session, changes: Iterable[Tuple[int, Optional[int], int, int, Optional[int]]]) -> List[dict]:
+    """Gravar as passagens de nível de mudanças de saldo (sem commit).
+
+    `changes` traz (product_id, store_id, saldo anterior, saldo novo,
+    estoque mínimo), como as mudanças que a venda e o estorno publicam.
+    """
+    rows = []
+    for product_id, store_id, previous_quantity, new_quantity, min_stock in changes:
+        row = _event_row(product_id, store_id, level_of(previous_quantity, min_stock), new_quantity, min_stock)
+        if row:
+            rows.append(row)
+    bulk_insert(db, StockLevelEvent, rows)
+    return rows
+
+def record_transition(
+    db: Session,
+    product_id: int,
+    store_id: Optional[int],
+    previous_level: Optional[str],
+    quantity: int,
+    min_stock: Optional[int]
+) -> Optional[dict]:
+    """Gravar a passagem de nível de uma linha alterada pelo cadastro (sem commit)"""
+    row = _event_row(product_id, store_id, previous_level or "ok", quantity, min_stock)
+    if row:
+        bulk_insert(db, StockLevelEvent, [row])
+    return row
+
+def rebuild(db: Session) -> int:
+    """Recalcular o nível das linhas sem nível ou divergentes (inicialização)"""
+    expression = level_expression()
+    updated = db.execute(
+        update(Inventory)
+        .where(or_(Inventory.stock_level.is_(None), Inventory.stock_level != expression))
+        .values(stock_level=expression)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    return updated
+
+def recent_events(
+    db: Session,
+    store_id: int,
+    after_id: Optional[int] = None,
+    limit: int = 100
+) -> List[dict]:
+    """Passagens de nível da loja, em ordem de chegada (após `after_id`)"""
+    query = db.query(StockLevelEvent).filter(StockLevelEvent.store_id == store_id)
+    if after_id is not None:
+        query = query.filter(StockLevelEvent.id > after_id)
+    else:
+        # Sem cursor: as mais recentes
+        latest = query.order_by(StockLevelEvent.id.desc()).limit(limit).all()
+        return [_event_view(row) for row in reversed(latest)]
+    return [_event_view(row) for row in query.order_by(StockLevelEvent.id).limit(limit).all()]
+
+def _event_view(row: StockLevelEvent) -> dict:
+    return {
+        "id": row.id,
+        "product_id": row.product_id,
+        "previous_level": row.previous_level,
+        "level": row.level,
+        "quantity": row.quantity,
+        "min_stock": row.min_stock,
+        "created_at": row.created_at
+    }
@@ -0,0 +1,147 @@
+"""
+Dimensão de loja e terminal.
+
+Vendas, pagamentos, estoque e movimentações carregam `store_id` (e, quando
+se aplica, `terminal_id`). A loja da requisição vem do cabeçalho
+`X-Store-Id` ou, se ausente, de PDV_STORE_ID; o terminal, de
+`X-Terminal-Id`. Lojas informadas no cabeçalho são conferidas contra um
+cache dos ids cadastrados, recarregado quando aparece um id desconhecido.
+
+Uma rede pode manter um banco por loja: PDV_STORE_DATABASES lista
+"id=url" separados por vírgula (ex.: "1=sqlite:///./loja1.db,2=...").
+Os relatórios entre lojas consultam cada banco e juntam os resultados.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, FrozenSet, List, Optional
+
+from fastapi import Header, HTTPException
+from sqlalchemy import update
+from sqlalchemy.orm import Session, sessionmaker
+
+from backend.database import ReadSessionLocal, SessionLocal, create_db_engine, read_only_url
+from backend.models.store import Store
+
+DEFAULT_STORE_ID = int(os.getenv("PDV_STORE_ID", "1"))
+DEFAULT_STORE_CODE = os.getenv("PDV_STORE_CODE", "LOJA01")
+DEFAULT_STORE_NAME = os.getenv("PDV_STORE_NAME", "Loja Principal")
+
+# Intervalo mínimo entre recargas provocadas por ids desconhecidos
+STORE_RELOAD_SECONDS = 5
+
+_stores_lock = threading.Lock()
+_stores: Dict[str, object] = {"ids": frozenset(), "loaded_at": None}
+
+def _load_store_ids() -> FrozenSet[int]:
+    db = SessionLocal()
+    try:
+        ids = frozenset(row[0] for row in db.query(Store.id).filter(Store.active.isnot(False)).all())
+    finally:
+        db.close()
+    with _stores_lock:
+        _stores["ids"] = ids
+        _stores["loaded_at"] = time.monotonic()
+    return ids
+
+def invalidate_stores():
+    """Descartar o cache de lojas (cadastro ou desativação)"""
+    with _stores_lock:
+        _stores["loaded_at"] = None
+
+def store_exists(store_id: int) -> bool:
+    """Loja cadastrada e ativa, pelo cache; um id desconhecido recarrega o cache"""
+    with _stores_lock:
+        ids, loaded_at = _stores["ids"], _stores["loaded_at"]
+    if loaded_at is not None and store_id in ids:
+        return True
+    if loaded_at is not None and time.monotonic() - loaded_at < STORE_RELOAD_SECONDS:
+        return False
+    return store_id in _load_store_ids()
+
+def get_store_id(x_store_id: Optional[int] = Header(None)) -> int:
+    """Dependency com a loja da requisição"""
+    if x_store_id is None:
+        return DEFAULT_STORE_ID
+    if not store_exists(x_store_id):
+        raise HTTPException(status_code=404, detail="Loja não encontrada")
+    return x_store_id
+
+def get_terminal_id(x_terminal_id: Optional[str] = Header(None)) -> Optional[str]:
+    """Dependency com o terminal (caixa) da requisição, se informado"""
+    return x_terminal_id
+
+def ensure_default_store(db: Session):
+    """Criar a loja padrão e atribuí-la aos registros gravados sem loja"""
+    from backend.models.inventory import Inventory, InventoryMovement
+    from backend.models.payment import Payment
+    from backend.models.sale import Sale
+
+    if not db.query(Store.id).filter(Store.id == DEFAULT_STORE_ID).first():
+        db.add(Store(id=DEFAULT_STORE_ID, code=DEFAULT_STORE_CODE, name=DEFAULT_STORE_NAME))
+        db.flush()
+
+    for model in (Sale, Payment, Inventory, InventoryMovement):
+        db.execute(
+            update(model)
+            .where(model.store_id.is_(None))
+            .values(store_id=DEFAULT_STORE_ID)
+            .execution_options(synchronize_session=False)
+        )
+    db.commit()
+    invalidate_stores()
+
+def _configured_databases() -> Dict[int, str]:
+    databases = {}
+    for entry in os.getenv("PDV_STORE_DATABASES", "").split(","):
+        if "=" not in entry:
+            continue
+        store_id, url = entry.split("=", 1)
+        databases[int(store_id.strip())] = url.strip()
+    return databases
+
+class StoreRouter:
+    """Sessões de leitura por loja, para relatórios com fan-out"""
+
+    def __init__(self, databases: Optional[Dict[int, str]] = None):
+        self.databases = databases if databases is not None else _configured_databases()
+        self._sessions: Dict[int, sessionmaker] = {}
+
+    @property
+    def partitioned(self) -> bool:
+        """Indica se cada loja tem banco próprio"""
+        return bool(self.databases)
+
+    def store_ids(self) -> List[int]:
+        return sorted(self.databases)
+
+    def read_session(self, store_id: int) -> Session:
+        url = self.databases.get(store_id)
+        if url is None:
+            return ReadSessionLocal()
+        if store_id not in self._sessions:
+            engine = create_db_engine(
+                read_only_url(url),
+                profile="read_only",
+                env_prefix="PDV_READ_DB"
+            )
+            self._sessions[store_id] = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        return self._sessions[store_id]()
+
+    def fan_out(self, query: Callable[[Session, int], dict], store_ids: Optional[List[int]] = None) -> Dict[int, dict]:
+        """Executar `query(db, store_id)` no banco de cada loja, em paralelo"""
+        store_ids = store_ids or self.store_ids()
+
+        def run(store_id):
+            db = self.read_session(store_id)
+            try:
+                return store_id, query(db, store_id)
+            finally:
+                db.close()
+
+        with ThreadPoolExecutor(max_workers=min(len(store_ids), 16) or 1) as executor:
+            return dict(executor.map(run, store_ids))
+
+store_router = StoreRouter()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Benchmark e conferência da inserção em massa no PostgreSQL.
+
+Cria um schema temporário no banco informado, confere que o COPY grava os
+mesmos valores que o INSERT (textos com tab, barra invertida e quebra de
+linha, nulos, booleanos, datas e binários) e mede `--rows` movimentos de
+estoque por COPY e por INSERT com executemany. O schema é removido no fim.
+
+Uso:
+    python benchmarks/bench_bulk_insert.py --url postgresql+psycopg://pdv@localhost/pdv --rows 100000
+    python benchmarks/bench_bulk_insert.py --url postgresql+psycopg2://pdv@localhost/pdv
+"""
+
+import argparse
+import os
+import sys
+import time
+import uuid
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, func, text
+from sqlalchemy.orm import sessionmaker
+
+from backend.database import Base
+from backend.models import customer, idempotency, nfce, outbox, payment, promotion, receipt, replenishment, reservation, sale, shift  # noqa: F401
+from backend.models.customer import Customer
+from backend.models.inventory import InventoryMovement
+from backend.models.product import Product
+from backend.models.receipt import SaleReceipt
+from backend.models.sale import Sale
+from backend.models.store import Store
+from backend.services import bulk
+
+SAMPLE_TEXTS = ["tab\there", "barra \\ invertida", "linha\nnova", "\\N", "", "acentuação"]
+
+def check_round_trip(db):
+    """Gravar os mesmos valores por COPY e por INSERT e comparar a leitura"""
+    rows = [
+        {"name": name, "email": f"copy{index}@bench", "phone": None, "active": index % 2 == 0}
+        for index, name in enumerate(SAMPLE_TEXTS)
+    ]
+    bulk.USE_COPY = True
+    bulk.bulk_insert(db, Customer, rows)
+    bulk.USE_COPY = False
+    bulk.bulk_insert(db, Customer, [dict(row, email=row["email"].replace("copy", "insert")) for row in rows])
+
+    db.add(Sale(id=1, store_id=1, total_amount=0, final_amount=0, payment_method="cash"))
+    db.flush()
+    blob = bytes(range(256))
+    bulk.USE_COPY = True
+    bulk.bulk_insert(db, SaleReceipt, [{"sale_id": 1, "etag": "x", "payload": blob, "escpos": blob, "stale": False}])
+    db.commit()
+
+    def read(prefix):
+        return [
+            (row.name, row.phone, row.active)
+            for row in db.query(Customer).filter(Customer.email.like(f"{prefix}%")).order_by(Customer.email)
+        ]
+
+    stored = db.query(SaleReceipt).filter(SaleReceipt.sale_id == 1).one()
+    problems = []
+    if read("copy") != read("insert"):
+        problems.append(f"clientes: {read('copy')} != {read('insert')}")
+    if bytes(stored.payload) != blob or stored.stale is not False:
+        problems.append("recibo: binário ou booleano diferente")
+    return problems
+
+def timed_insert(db, rows, use_copy):
+    bulk.USE_COPY = use_copy
+    started = time.perf_counter()
+    bulk.bulk_insert(db, InventoryMovement, rows)
+    db.commit()
+    return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=os.getenv("DATABASE_URL"), help="URL de um PostgreSQL")
+    parser.add_argument("--rows", type=int, default=50000)
+    args = parser.parse_args()
+    if not args.url or not args.url.startswith("postgresql"):
+        parser.error("informe --url de um PostgreSQL (ou DATABASE_URL)")
+
+    schema = f"pdv_bench_{uuid.uuid4().hex[:8]}"
+    admin = create_engine(args.url)
+    with admin.begin() as conn:
+        conn.execute(text(f'CREATE SCHEMA "{schema}"'))
+    engine = create_engine(args.url, connect_args={"options": f"-csearch_path={schema}"})
+    try:
+        Base.metadata.create_all(bind=engine)
+        Session = sessionmaker(bind=engine)
+        with Session() as db:
+            print(f"driver: {engine.dialect.driver}")
+            db.add(Store(id=1, code="BENCH", name="Loja"))
+            db.add(Product(id=1, name="Produto", price=10.0, active=True))
+            db.commit()
+
+            problems = check_round_trip(db)
+            print("conferência COPY x INSERT:", "ok" if not problems else "; ".join(problems))
+
+            now = datetime.now()
+            rows = [
+                {"product_id": 1, "store_id": 1, "movement_type": "out", "quantity": 1,
+                 "previous_quantity": index + 1, "new_quantity": index, "reason": "Venda\t#1",
+                 "reference_id": index, "created_at": now}
+                for index in range(args.rows)
+            ]
+            copy_seconds = timed_insert(db, rows, True)
+            insert_seconds = timed_insert(db, rows, False)
+            total = db.query(func.count(InventoryMovement.id)).scalar()
+            print(
+                f"{args.rows} movimentos  COPY: {copy_seconds:.2f}s  "
+                f"INSERT: {insert_seconds:.2f}s  gravados: {total}"
+            )
+    finally:
+        engine.dispose()
+        with admin.begin() as conn:
+            conn.execute(text(f'DROP SCHEMA "{schema}" CASCADE'))
+        admin.dispose()
+        bulk.USE_COPY = os.getenv("PDV_PG_COPY", "1") != "0"
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Benchmark do adaptador de gateway: autorizações por segundo com o simulador.
+
+Uso:
+    python benchmarks/bench_gateway.py --requests 5000 --latency-ms 50 --concurrency 200
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.services.payment_gateway import (
+    AuthorizationRequest,
+    GatewayClient,
+    SimulatorGateway,
+    new_transaction_id,
+)
+
+async def run(args):
+    gateway = SimulatorGateway(
+        latency=args.latency_ms / 1000,
+        jitter=args.jitter_ms / 1000,
+        decline_rate=args.decline_rate,
+        failure_rate=args.failure_rate,
+        seed=42
+    )
+    client = GatewayClient(
+        gateway,
+        timeout=args.timeout,
+        max_concurrency=args.concurrency,
+        retry_backoff=0.01
+    )
+    requests = [
+        AuthorizationRequest(transaction_id=new_transaction_id(), amount=100.0, method_type="credit_card")
+        for _ in range(args.requests)
+    ]
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(client.authorize(request) for request in requests))
+    elapsed = time.perf_counter() - start
+
+    approved = sum(1 for result in results if result.approved)
+    unknown = sum(1 for result in results if result.error)
+    print(f"Autorizações: {len(results)} em {elapsed:.2f}s ({len(results) / elapsed:.0f}/s)")
+    print(
+        f"Aprovadas: {approved}  Recusadas: {len(results) - approved - unknown}  "
+        f"Sem resposta: {unknown}  Chamadas ao gateway: {gateway.calls}"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--decline-rate", type=float, default=0.05)
+    parser.add_argument("--failure-rate", type=float, default=0.01)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--timeout", type=float, default=2.0)
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
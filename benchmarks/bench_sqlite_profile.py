@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Benchmark do perfil SQLite: vazão de leitura e escrita mista, antes e depois.
+
+Cada perfil roda sobre um banco novo em diretório temporário, com threads
+escritoras (inserem vendas com itens, como no checkout) e leitoras (agregam
+as vendas, como os relatórios) ao mesmo tempo.
+
+Uso:
+    python benchmarks/bench_sqlite_profile.py --seconds 10 --writers 4 --readers 4
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from backend.database import Base, create_db_engine
+from backend.models.product import Product, Category
+from backend.models.customer import Customer
+from backend.models.sale import Sale, SaleItem
+from backend.models.inventory import Inventory, InventoryMovement
+from backend.models.payment import PaymentMethod, Payment
+
+def run_profile(profile, args):
+    directory = tempfile.mkdtemp(prefix="pdv_bench_")
+    url = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    engine = create_db_engine(url, profile=profile)
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+
+    with Session() as db:
+        db.add(Product(id=1, name="Produto", price=10.0, active=True))
+        db.commit()
+
+    counters = {"writes": 0, "reads": 0, "errors": 0}
+    lock = threading.Lock()
+    stop = time.monotonic() + args.seconds
+
+    def writer():
+        while time.monotonic() < stop:
+            try:
+                with Session() as db:
+                    sale = Sale(total_amount=10, final_amount=10, payment_method="cash")
+                    db.add(sale)
+                    db.flush()
+                    db.add(SaleItem(sale_id=sale.id, product_id=1, quantity=1, unit_price=10, total_price=10))
+                    db.commit()
+                with lock:
+                    counters["writes"] += 1
+            except OperationalError:
+                with lock:
+                    counters["errors"] += 1
+
+    def reader():
+        while time.monotonic() < stop:
+            try:
+                with Session() as db:
+                    db.query(func.count(Sale.id), func.sum(Sale.final_amount)).one()
+                with lock:
+                    counters["reads"] += 1
+            except OperationalError:
+                with lock:
+                    counters["errors"] += 1
+
+    threads = [threading.Thread(target=writer) for _ in range(args.writers)]
+    threads += [threading.Thread(target=reader) for _ in range(args.readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+
+    print(
+        f"{profile:12s} escritas/s: {counters['writes'] / args.seconds:8.0f}  "
+        f"leituras/s: {counters['reads'] / args.seconds:8.0f}  "
+        f"erros 'database is locked': {counters['errors']}"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--profiles", nargs="+", default=["legacy", "performance"])
+    args = parser.parse_args()
+    for profile in args.profiles:
+        run_profile(profile, args)
+
+if __name__ == "__main__":
+    main()
@@ -10,12 +10,28 @@ from pathlib import Path
 from backend.models.product import Product, Category
 from backend.models.customer import Customer
 from backend.models.sale import Sale, SaleItem
-from backend.models.inventory import Inventory, InventoryMovement
+from backend.models.inventory import Inventory, InventoryMovement, StockLevelEvent
 from backend.models.payment import PaymentMethod, Payment
-from backend.database import create_tables, get_db
+from backend.models.store import Store
+from backend.models.idempotency import IdempotencyKey
+from backend.models.receipt import SaleReceipt
+from backend.models.outbox import OutboxMessage
+from backend.models.nfce import NfceDocument, NfceSequence
+from backend.models.promotion import Promotion
+from backend.models.reservation import StockReservation
+from backend.models.shift import RegisterShift, RegisterShiftTotal, RegisterShiftMovement
+from backend.models.replenishment import ReplenishmentRun, ReplenishmentSuggestion
+from backend.database import create_tables, get_db, SessionLocal
+from backend.services import categories as category_service
+from backend.services import customer_search, idempotency, nfce, outbox, payment_gateway, replenishment, reservations, settlement, stock_levels, stores
+from backend.services.payment_methods import registry as payment_method_registry
+from backend.services.carts import store as cart_store
 
 # Importar routers
-from backend.routers import products, customers, sales, inventory, payments, reports
+from backend.routers import products, customers, sales, inventory, payments, reports, events, promotions, carts
+from backend.routers import outbox as outbox_router
+from backend.routers import reservations as reservations_router
+from backend.routers import shifts as shifts_router
 
 # Criar instância do FastAPI
 app = FastAPI(
@@ -40,6 +56,12 @@ app.include_router(sales.router, prefix="/api/sales", tags=["sales"])
 app.include_router(inventory.router, prefix="/api/inventory", tags=["inventory"])
 app.include_router(payments.router, prefix="/api/payments", tags=["payments"])
 app.include_router(reports.router, prefix="/api/reports", tags=["reports"])
+app.include_router(events.router, prefix="/api/events", tags=["events"])
+app.include_router(carts.router, prefix="/api/carts", tags=["carts"])
+app.include_router(promotions.router, prefix="/api/promotions", tags=["promotions"])
+app.include_router(outbox_router.router, prefix="/api/outbox", tags=["outbox"])
+app.include_router(reservations_router.router, prefix="/api/reservations", tags=["reservations"])
+app.include_router(shifts_router.router, prefix="/api/shifts", tags=["shifts"])
 
 # Servir arquivos estáticos
 frontend_path = Path(__file__).parent / "frontend"
@@ -50,7 +72,55 @@ if frontend_path.exists():
 async def startup_event():
     """Criar tabelas do banco de dados na inicialização"""
     create_tables()
+    
+    # Preparar dados derivados: loja padrão, vínculo e agregados de
+    # categorias, chaves de busca de clientes, cache de métodos de
+    # pagamento, saldo pago das vendas, total reservado e nível do estoque;
+    # descartar chaves de idempotência vencidas
+    db = SessionLocal()
+    try:
+        stores.ensure_default_store(db)
+        category_service.backfill_product_categories(db)
+        customer_search.backfill_search_keys(db)
+        payment_method_registry.load(db)
+        settlement.backfill_paid_amounts(db)
+        idempotency.purge_expired(db)
+        reservations.rebuild_counters(db)
+        stock_levels.rebuild(db)
+    finally:
+        db.close()
     print("✅ Banco de dados inicializado!")
+    
+    # Carrinhos abertos gravados no último desligamento
+    cart_store.load()
+    
+    # Efeitos pós-venda gravados no outbox (PDV_OUTBOX_WORKER=off quando o
+    # worker roda em processo separado; o servidor só retransmite os eventos)
+    if outbox.WORKER_MODE != "off":
+        outbox.worker.start()
+    else:
+        outbox.relay_worker.start()
+    
+    # Liberação das reservas de estoque vencidas
+    reservations.sweeper.start()
+    
+    # Autorizações de pagamento pendentes (sem resposta ou interrompidas)
+    payment_gateway.sweeper.start()
+    
+    # Sugestões de reposição, recalculadas toda noite
+    if replenishment.SCHEDULER_MODE != "off":
+        replenishment.scheduler.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Parar o worker do outbox, as varreduras e a reposição noturna e gravar os carrinhos abertos"""
+    await outbox.worker.stop()
+    await outbox.relay_worker.stop()
+    await reservations.sweeper.stop()
+    await payment_gateway.sweeper.stop()
+    await replenishment.scheduler.stop()
+    nfce.shutdown_pool()
+    cart_store.save()
 
 @app.get("/", response_class=HTMLResponse)
 async def read_root():
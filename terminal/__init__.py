@@ -0,0 +1 @@
+# Cliente do terminal de caixa (modo offline)
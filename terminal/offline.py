@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Modo offline do terminal de caixa.
+
+Quando o servidor não responde, as vendas são gravadas em um journal
+SQLite local com um `client_id` gerado no terminal, e os códigos de barras
+são consultados em uma cópia local do catálogo. Ao voltar a conexão, o
+journal é enviado em lote para `POST /api/sales/sync`; o `client_id` torna
+o reenvio seguro.
+
+Uso:
+    python terminal/offline.py --server http://localhost:8005 catalog
+    python terminal/offline.py --server http://localhost:8005 sync
+    python terminal/offline.py status
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import uuid
+from datetime import datetime
+from typing import List, Optional
+from urllib import error, request
+
+JOURNAL_PATH = os.getenv("PDV_TERMINAL_JOURNAL", "terminal_journal.db")
+SYNC_BATCH_SIZE = int(os.getenv("PDV_TERMINAL_SYNC_BATCH", "5000"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS catalog (
+    product_id INTEGER PRIMARY KEY,
+    barcode TEXT,
+    name TEXT NOT NULL,
+    price REAL NOT NULL,
+    category_id INTEGER,
+    quantity INTEGER
+);
+CREATE INDEX IF NOT EXISTS ix_catalog_barcode ON catalog (barcode);
+CREATE TABLE IF NOT EXISTS payment_methods (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    type TEXT NOT NULL,
+    requires_approval INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS catalog_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS journal (
+    client_id TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    sale_id INTEGER,
+    detail TEXT,
+    synced_at TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_journal_status ON journal (status, created_at);
+"""
+
+class ServerUnavailable(Exception):
+    """Servidor fora do ar ou sem rede"""
+
+class OfflineTerminal:
+    def __init__(
+        self,
+        server_url: str,
+        journal_path: str = JOURNAL_PATH,
+        store_id: Optional[int] = None,
+        terminal_id: Optional[str] = None,
+        timeout: float = 5.0
+    ):
+        self.server_url = server_url.rstrip("/")
+        self.store_id = store_id
+        self.terminal_id = terminal_id
+        self.timeout = timeout
+        self.conn = sqlite3.connect(journal_path)
+        self.conn.row_factory = sqlite3.Row
+        # O journal precisa sobreviver a queda de energia do caixa
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def _call(
+        self,
+        method: str,
+        path: str,
+        payload=None,
+        timeout: Optional[float] = None,
+        idempotency_key: Optional[str] = None
+    ):
+        headers = {"Content-Type": "application/json"}
+        if idempotency_key:
+            headers["Idempotency-Key"] = idempotency_key
+        if self.store_id is not None:
+            headers["X-Store-Id"] = str(self.store_id)
+        if self.terminal_id:
+            headers["X-Terminal-Id"] = self.terminal_id
+        body = json.dumps(payload).encode("utf-8") if payload is not None else None
+        req = request.Request(self.server_url + path, data=body, headers=headers, method=method)
+        try:
+            with request.urlopen(req, timeout=timeout or self.timeout) as response:
+                return json.loads(response.read().decode("utf-8"))
+        except error.HTTPError:
+            # O servidor respondeu: o erro é da requisição, não da conexão
+            raise
+        except (error.URLError, TimeoutError, ConnectionError) as exc:
+            raise ServerUnavailable(str(exc)) from exc
+
+    # Catálogo local
+
+    def refresh_catalog(self) -> int:
+        """Baixar o catálogo da loja e substituir a cópia local"""
+        snapshot = self._call("GET", "/api/products/catalog/snapshot")
+        with self.conn:
+            self.conn.execute("DELETE FROM catalog")
+            self.conn.executemany(
+                "INSERT INTO catalog (product_id, barcode, name, price, category_id, quantity) "
+                "VALUES (:id, :barcode, :name, :price, :category_id, :quantity)",
+                snapshot["products"]
+            )
+            self.conn.execute("DELETE FROM payment_methods")
+            self.conn.executemany(
+                "INSERT INTO payment_methods (id, name, type, requires_approval) "
+                "VALUES (:id, :name, :type, :requires_approval)",
+                snapshot["payment_methods"]
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO catalog_meta (key, value) VALUES ('generated_at', ?)",
+                (snapshot["generated_at"],)
+            )
+        return len(snapshot["products"])
+
+    def lookup_barcode(self, barcode: str) -> Optional[dict]:
+        """Produto do catálogo local pelo código de barras"""
+        row = self.conn.execute(
+            "SELECT product_id AS id, barcode, name, price, category_id, quantity "
+            "FROM catalog WHERE barcode = ?",
+            (barcode,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    # Vendas
+
+    def record_sale(self, sale: dict) -> str:
+        """Gravar a venda no journal local e devolver o client_id"""
+        client_id = sale.get("client_id") or str(uuid.uuid4())
+        created_at = sale.get("created_at") or datetime.now().isoformat()
+        payload = dict(sale, client_id=client_id, created_at=created_at)
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO journal (client_id, payload, created_at) VALUES (?, ?, ?)",
+                (client_id, json.dumps(payload), created_at)
+            )
+        return client_id
+
+    def create_sale(self, sale: dict) -> dict:
+        """Registrar a venda no servidor ou, sem conexão, no journal local.
+
+        O client_id vai como Idempotency-Key: se o servidor gravou a venda e
+        a resposta se perdeu, a sincronização do journal não a duplica.
+        """
+        client_id = sale.get("client_id") or str(uuid.uuid4())
+        try:
+            return self._call("POST", "/api/sales/", sale, idempotency_key=client_id)
+        except ServerUnavailable:
+            self.record_sale(dict(sale, client_id=client_id))
+            return {"offline": True, "client_id": client_id}
+
+    def pending(self, limit: Optional[int] = None) -> List[dict]:
+        query = "SELECT payload FROM journal WHERE status = 'pending' ORDER BY created_at"
+        if limit:
+            query += f" LIMIT {int(limit)}"
+        return [json.loads(row["payload"]) for row in self.conn.execute(query)]
+
+    def sync(self, batch_size: int = SYNC_BATCH_SIZE) -> dict:
+        """Enviar o journal pendente em lotes e marcar o resultado de cada venda"""
+        totals = {"sent": 0, "created": 0, "duplicates": 0, "rejected": 0, "conflicts": []}
+        while True:
+            batch = self.pending(batch_size)
+            if not batch:
+                break
+            # Lotes grandes levam mais que uma venda avulsa
+            response = self._call("POST", "/api/sales/sync", {"sales": batch}, timeout=max(self.timeout, 120))
+            synced_at = datetime.now().isoformat()
+            with self.conn:
+                self.conn.executemany(
+                    "UPDATE journal SET status = ?, sale_id = ?, detail = ?, synced_at = ? WHERE client_id = ?",
+                    [
+                        (
+                            "rejected" if result["status"] == "rejected" else "synced",
+                            result.get("sale_id"),
+                            result.get("detail"),
+                            synced_at,
+                            result["client_id"]
+                        )
+                        for result in response["results"]
+                    ]
+                )
+            totals["sent"] += len(batch)
+            totals["created"] += response["created"]
+            totals["duplicates"] += response["duplicates"]
+            totals["rejected"] += response["rejected"]
+            totals["conflicts"].extend(response["conflicts"])
+            if len(batch) < batch_size:
+                break
+        return totals
+
+    def status(self) -> dict:
+        counts = dict(self.conn.execute("SELECT status, COUNT(*) FROM journal GROUP BY status").fetchall())
+        generated_at = self.conn.execute(
+            "SELECT value FROM catalog_meta WHERE key = 'generated_at'"
+        ).fetchone()
+        return {
+            "journal": counts,
+            "catalog_products": self.conn.execute("SELECT COUNT(*) FROM catalog").fetchone()[0],
+            "catalog_generated_at": generated_at[0] if generated_at else None,
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description="Modo offline do terminal de caixa")
+    parser.add_argument("command", choices=["catalog", "sync", "status"])
+    parser.add_argument("--server", default=os.getenv("PDV_SERVER_URL", "http://localhost:8005"))
+    parser.add_argument("--journal", default=JOURNAL_PATH)
+    parser.add_argument("--store-id", type=int, default=None)
+    parser.add_argument("--terminal-id", default=os.getenv("PDV_TERMINAL_ID"))
+    args = parser.parse_args()
+
+    terminal = OfflineTerminal(args.server, args.journal, args.store_id, args.terminal_id)
+    try:
+        if args.command == "catalog":
+            print(f"📦 {terminal.refresh_catalog()} produtos no catálogo local")
+        elif args.command == "sync":
+            result = terminal.sync()
+            print(json.dumps(result, ensure_ascii=False, indent=2))
+        else:
+            print(json.dumps(terminal.status(), ensure_ascii=False, indent=2))
+    except ServerUnavailable as exc:
+        print(f"❌ Servidor indisponível: {exc}")
+    finally:
+        terminal.close()
+
+if __name__ == "__main__":
+    main()